@@ -0,0 +1,56 @@
+"""Precomputes the transfer patterns used by /shortest_path?engine=transfer_patterns.
+
+Run it after populate_database.py (from the backend/app directory, like the API):
+    python build_transfer_patterns.py 2024-06-10
+
+The patterns are computed on the given service day and written to TRANSFER_PATTERNS_FILE with the
+current network version and the signature of the services running that day: the API ignores them,
+and falls back to the full search, as soon as the network version changes and on the dates running
+other services.
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from tortoise import Tortoise
+from db_config.config import DATABASE_URL
+from services.calendar import service_calendar
+from services.matrix import MATRIX_WORKERS
+from services.transfer_patterns import TRANSFER_PATTERNS_FILE, TRANSFER_PATTERN_MAX_DURATION, build_transfer_patterns, save_transfer_patterns
+from utils.colors import colors
+from utils.network_version import get_network_version
+from main import load_static_network, timetable_store
+
+
+async def main(args):
+    total_begin_time = time.time()
+    service_date = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+
+    version = get_network_version()
+    await Tortoise.init(db_url=DATABASE_URL, modules={"models": ["db_config.models"]})
+    try:
+        network = await load_static_network()
+        timetable = await timetable_store.get(network, service_date)
+        service_signature = await service_calendar.get_signature(service_date.strftime("%Y%m%d"))
+    finally:
+        await Tortoise.close_connections()
+
+    begin_time = time.time()
+    index = build_transfer_patterns(timetable, version, service_signature, args.max_duration, args.workers)
+    print("-> Computed transfer patterns in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+    size = save_transfer_patterns(index, args.output)
+    pairs = sum(len(destinations) for destinations in index.patterns.values())
+    patterns = sum(len(end_patterns) for destinations in index.patterns.values() for end_patterns in destinations.values())
+    print(f"* {len(index.patterns)} origins, {pairs} station pairs, {patterns} patterns ({patterns / max(pairs, 1):.2f} per pair)")
+    print(f"* Wrote {args.output}: {size / 1024:.1f} KB, network version {version}")
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precomputes the transfer patterns of every station.")
+    parser.add_argument("date", help="Service day the patterns are computed on (YYYY-MM-DD)")
+    parser.add_argument("--max-duration", type=int, default=TRANSFER_PATTERN_MAX_DURATION, help="Longest journey considered, in minutes")
+    parser.add_argument("--workers", type=int, default=MATRIX_WORKERS, help="Number of worker processes")
+    parser.add_argument("--output", default=TRANSFER_PATTERNS_FILE, help="Output file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""Computes a station to station travel time matrix from the command line.
+
+Usage (from the backend/app directory, like the API):
+    python compute_matrix.py "2024-06-10 08:00:00" --output matrix.npy
+    python compute_matrix.py "2024-06-10 08:00:00" --origins IDFM:71370,IDFM:71517 --output matrix.ndjson
+
+The .npy output is an int32 matrix (origins x destinations) of travel times in seconds, -1 when
+unreachable; any other extension gets one JSON line per origin, as the /matrix endpoint streams them.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+from tortoise import Tortoise
+from db_config.config import DATABASE_URL
+from services.timetable import get_service_date
+from services.matrix import MATRIX_WORKERS, MAX_MATRIX_DURATION, MatrixPool, get_matrix_stations, matrix_to_npy
+from utils.colors import colors
+from main import load_static_network, timetable_store
+
+
+async def main(args):
+    total_begin_time = time.time()
+    date_obj = datetime.datetime.strptime(args.date, "%Y-%m-%d %H:%M:%S")
+
+    await Tortoise.init(db_url=DATABASE_URL, modules={"models": ["db_config.models"]})
+    try:
+        network = await load_static_network()
+        timetable = await timetable_store.get(network, get_service_date(date_obj))
+    finally:
+        await Tortoise.close_connections()
+
+    origin_ids, origin_stops = get_matrix_stations(timetable, args.origins.split(",") if args.origins else None)
+    destination_ids, destination_stops = get_matrix_stations(timetable, args.destinations.split(",") if args.destinations else None)
+
+    pool = MatrixPool(args.workers)
+    begin_time = time.time()
+    rows = [row async for row in pool.rows(timetable, origin_stops, destination_stops, date_obj, args.max_duration)]
+    pool.shutdown()
+    print("-> Computed " + str(len(origin_ids)) + "x" + str(len(destination_ids)) + " matrix in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+    if args.output.endswith(".npy"):
+        with open(args.output, "wb") as f:
+            f.write(matrix_to_npy(rows))
+    else:
+        with open(args.output, "w") as f:
+            f.write(json.dumps({"destinations": destination_ids}) + "\n")
+            for origin, row in zip(origin_ids, rows):
+                f.write(json.dumps({"origin": origin, "travel_times": row}) + "\n")
+
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes a station to station travel time matrix.")
+    parser.add_argument("date", help="Departure date and time (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--origins", help="Origin parent_station IDs separated by commas, every station by default")
+    parser.add_argument("--destinations", help="Destination parent_station IDs separated by commas, every station by default")
+    parser.add_argument("--max-duration", type=int, default=MAX_MATRIX_DURATION, help="Longest travel time considered, in minutes")
+    parser.add_argument("--workers", type=int, default=MATRIX_WORKERS, help="Number of worker processes")
+    parser.add_argument("--output", default="matrix.npy", help="Output file, .npy or JSON lines")
+    asyncio.run(main(parser.parse_args()))
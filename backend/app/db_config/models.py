@@ -87,8 +87,10 @@ class Stop(Model):
 
 class StopTime(Model):
     trip = fields.ForeignKeyField("models.Trip", related_name="stop_times")
-    arrival_time = fields.CharField(max_length=8)  # HH:MM:SS
-    departure_time = fields.CharField(max_length=8) # HH:MM:SS
+    arrival_time = fields.CharField(max_length=8, null=True)  # HH:MM:SS, empty between two timepoints
+    departure_time = fields.CharField(max_length=8, null=True) # HH:MM:SS, empty between two timepoints
+    arrival_secs = fields.IntField(null=True)  # arrival_time in seconds since the start of the service day
+    departure_secs = fields.IntField(null=True)  # departure_time in seconds since the start of the service day
     stop = fields.ForeignKeyField("models.Stop", related_name="stop_times")
     stop_sequence = fields.IntField()
     pickup_type = fields.IntField()
@@ -104,6 +106,8 @@ class StopTime(Model):
             ("trip_id",),
             ("stop_id",),
             ("stop_sequence",), 
+            ("arrival_secs",),
+            ("departure_secs",),
         ]
 
 class Transfer(Model):
@@ -0,0 +1,58 @@
+"""Exports the network and the timetables of some service days as a binary snapshot.
+
+Run it after populate_database.py (from the backend/app directory, like the API):
+    python export_snapshot.py 2024-06-10 2024-06-11
+
+The API workers map SNAPSHOT_FILE read-only at startup instead of querying the database and
+building the timetables. The snapshot holds the current network version: the workers ignore it, and
+go back to the database, as soon as the network version changes.
+"""
+import argparse
+import asyncio
+import datetime
+import time
+from tortoise import Tortoise
+from db_config.config import DATABASE_URL
+from services.network import build_static_network
+from services.snapshot import SNAPSHOT_FILE, Snapshot, write_snapshot
+from services.timetable import build_timetable, load_timetable_rows
+from utils.colors import colors
+from utils.network_version import get_network_version
+from main import fetch_service_day, get_routes, get_stations, get_transfers
+
+
+async def main(args):
+    total_begin_time = time.time()
+    service_dates = [datetime.datetime.strptime(date, "%Y-%m-%d") for date in args.dates]
+
+    version = get_network_version()
+    await Tortoise.init(db_url=DATABASE_URL, modules={"models": ["db_config.models"]})
+    try:
+        route_fetch = await get_routes()
+        stations_fetch = await get_stations()
+        transfers = await get_transfers()
+        network = build_static_network(route_fetch, stations_fetch, transfers)
+        timetables = []
+        for service_date in service_dates:
+            rows = await load_timetable_rows(fetch_service_day, service_date)
+            timetables.append(build_timetable(service_date, network, *rows))
+    finally:
+        await Tortoise.close_connections()
+
+    begin_time = time.time()
+    size = write_snapshot(args.output, version, route_fetch, stations_fetch, transfers, timetables)
+    print("-> Wrote snapshot in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+    begin_time = time.time()
+    Snapshot(args.output)
+    print("* Mapped it back in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    connections = sum(len(timetable) for timetable in timetables)
+    print(f"* Wrote {args.output}: {size / 1024 / 1024:.1f} MB, {len(timetables)} service days, {connections} connections, network version {version}")
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the network and its timetables as a binary snapshot.")
+    parser.add_argument("dates", nargs="+", help="Service days to export (YYYY-MM-DD)")
+    parser.add_argument("--output", default=SNAPSHOT_FILE, help="Output file")
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,8 @@
 import json
 import time
 from itertools import count
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, Query, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from tortoise.contrib.fastapi import register_tortoise
 from tortoise.expressions import Q
 from db_config.models import *
@@ -13,9 +13,24 @@ import heapq
 from services.graph import *
 from services.connectivity import *
 from services.mst import *
+from services.network import *
+from services.timetable_cache import *
+from services.journey import *
+from services.timetable import *
+from services.csa import *
+from services.raptor import *
+from services.isochrone import *
+from services.matrix import *
+from services.transfer_patterns import *
+from services.snapshot import *
+from services.calendar import *
+from services.stations import *
+from services.search_pool import *
+from services.single_flight import *
+from services.result_cache import *
+from services.lower_bound import *
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
-import copy
 from utils.colors import colors
 
 app = FastAPI()
@@ -68,60 +83,36 @@ async def get_routes(agency_id: Optional[str] = None) -> List[dict]:
     ]
 
 
-@app.get("/stations")
+async def fetch_stops():
+    """Fetches every stop with its routes, for the station catalog."""
+    begin_time = time.time()
+    stops = await Stop.all().prefetch_related("route_stops__route")
+    print("* Retrieved stops in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return stops
+
+
+station_catalog = StationCatalogCache(fetch_stops)
+
+
 async def get_stations():
     """
-    Calculates the barycenters of stations and returns associated route IDs.
+    Returns the stations with their barycenters and associated route IDs, from the station catalog.
     """
-    begin_time = time.time()
-    stops = await Stop.all().prefetch_related("route_stops__route")
+    return (await station_catalog.get()).stations
 
-    # Group stops by parent_station
-    grouped_stops = {}
-    for stop in stops:
-        parent_station = stop.parent_station
-        if parent_station not in grouped_stops:
-            grouped_stops[parent_station] = []
-        grouped_stops[parent_station].append(stop)
-
-    stations = []
-    for parent_station, stop_group in grouped_stops.items():
-        if not parent_station:
-            continue
-
-        total_lon = sum(stop.stop_lon for stop in stop_group)
-        total_lat = sum(stop.stop_lat for stop in stop_group)
-        count_stop = len(stop_group)
-        barycenter_lon = total_lon / count_stop
-        barycenter_lat = total_lat / count_stop
-
-        # Efficiently get distinct route IDs using prefetch_related data
-        route_ids = set(route_stop.route.route_id for stop in stop_group for route_stop in stop.route_stops)
-
-        # Read stations.json and get route_ids_with_sequences
-        with open("./utils/stations.json", "r") as f:
-            stations_data = json.load(f)
-            for station_data in stations_data:
-                if station_data["parent_station"] == parent_station:
-                    route_ids_with_sequences = station_data["route_ids_with_sequences"]
-                    break
-            else:
-                route_ids_with_sequences = []
-
-        stations.append(
-            {
-                "parent_station": parent_station,
-                "stop_name": stop_group[0].stop_name,
-                "barycenter_lon": barycenter_lon,
-                "barycenter_lat": barycenter_lat,
-                "route_ids": list(route_ids),
-                "stops": stop_group,
-                "route_ids_with_sequences": route_ids_with_sequences
-            }
-        )
-
-    print("* Retrieved stations in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
-    return stations
+
+@app.get("/stations")
+async def get_stations_response(if_none_match: Optional[str] = Header(None)):
+    """
+    Returns the stations with their barycenters and associated route IDs.
+
+    The body is serialized once per network version: a client sending back its ETag in
+    If-None-Match gets a 304 while the network doesn't change.
+    """
+    catalog = await station_catalog.get()
+    if catalog.matches(if_none_match):
+        return Response(status_code=304, headers={"ETag": catalog.etag})
+    return Response(content=catalog.body, media_type="application/json", headers={"ETag": catalog.etag})
 
 
 @app.get("/transfers")
@@ -149,15 +140,14 @@ async def get_transfers(from_stop_id: Optional[str] = Query(None), to_stop_id: O
 async def fetch_stop_times_and_trips(date_str: str, time_str: str):
     try:
         begin_time = time.time()
-        end_time_delta = int(time_str[0:2]) + 2
-        end_time_str = str(end_time_delta) + time_str[2:]
+        begin_secs = parse_time(time_str)
+        end_secs = begin_secs + 2 * 3600
 
         # Filtrer les StopTime après un certain horaire et les Trip et route disponibles à une date donnée
         stop_times = await StopTime.all().filter(
-            (Q(arrival_time__gte=time_str) & Q(arrival_time__lte=end_time_str)) |
-            (Q(departure_time__gte=time_str) & Q(departure_time__lte=end_time_str)),
-            trip__service__start_date__lte=date_str,
-            trip__service__end_date__gte=date_str
+            (Q(arrival_secs__gte=begin_secs) & Q(arrival_secs__lte=end_secs)) |
+            (Q(departure_secs__gte=begin_secs) & Q(departure_secs__lte=end_secs)),
+            trip__service_id__in=await service_calendar.get_active_services(date_str)
         ).prefetch_related('trip__route')
 
         print("* Retrieved stop times in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
@@ -174,575 +164,401 @@ async def fetch_stop_times_and_trips(date_str: str, time_str: str):
 #                       GRAPH ALGORITHMS
 # -----------------------------------------------------------------------------
 
-class MetroSystem:
-    def __init__(self):
-        self.stations = {}
+snapshot_cache = SnapshotCache()
 
 
-class Routes:
-    def __init__(self, route_id: str, route_name: str):
-        self.route_id = route_id
-        self.route_name = route_name
-        self.trips = {}
-
-
-class Station:
-    def __init__(self, station_id: str, station_name: str):
-        self.station_id = station_id
-        self.station_name = station_name
-        self.routes = {}
-        self.stops = []
-
-    def __str__(self):
-        return str({
-            "name": self.station_name,
-            "station_id": self.station_id
-        })
+async def load_static_network():
+    """Loads the stations, stops, routes and transfers of the network.
 
+    They come from the snapshot written by export_snapshot.py when it is up to date with the
+    network version, from the database otherwise.
+    """
+    snapshot = snapshot_cache.get()
+    if snapshot is not None:
+        return snapshot.network
 
-class Stops:
-    def __init__(self, stop_id: str, stop_name: str, station: Station):
-        self.stop_id = stop_id
-        self.stop_name = stop_name
-        self.parent_station = station
-        self.transfers = {}
-        self.stop_times = []
+    begin_time = time.time()
+    route_fetch = await get_routes()
+    print("* Retrieved routes in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    stations_fetch = await get_stations()
 
-    def __str__(self):
-        return str({
-            "stop_id": self.stop_id,
-            "stop_name": self.stop_name,
-        })
+    begin_time = time.time()
+    transfers = await get_transfers()
+    print("* Retrieved transfers in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
 
+    return build_static_network(route_fetch, stations_fetch, transfers)
 
-class Trips:
-    def __init__(self, trip_id: str, route: Routes, direction: int):
-        self.trip_id = trip_id
-        self.direction_id = direction
-        self.route = route
-        self.head_stop = None
-        self.stops = []
 
+static_network = StaticNetworkCache(load_static_network)
 
-class StopTimes:
-    def __init__(self, trip: Trips, stop: Stops, arrival_time: datetime.datetime, departure_time: datetime.datetime, stop_sequence: int):
-        self.stop = stop
-        self.trip = trip
-        self.arrival_time = arrival_time
-        self.departure_time = departure_time
-        self.stop_sequence = stop_sequence
-        self.next_stop_time = None
-        self.previous_stop_time = None
 
-    def __str__(self):
-        return str({
-            "arrival time": self.arrival_time,
-            "departure time": self.departure_time,
-        })
+@app.on_event("startup")
+async def warm_static_network():
+    await static_network.get()
 
 
-async def get_metro_graph(date: str, time_date: str, date_obj: datetime.datetime):
-    """Constructs a weighted graph representing the metro network for a given date.
+async def fetch_stop_times_bucket(date_str: str, hour: int):
+    """Fetches the stop times leaving during one hour of a service day.
 
     Args:
-        :param time_date:
-        :param date:
-        :param date_obj:
+        date_str: The service date (YYYYMMDD), only the trips of the services running that day are fetched.
+        hour: The hour of the service day, can go past 23 for the trips running after midnight.
 
     Returns:
-        A MetroSystem object representing the graph during the allocated 3 or 2 hours
-
+        The stop times as plain tuples, ready for TimetableCache.add_slice.
     """
-
-    # création du graphe de base (stations, arrêts et transferts) :
-    print(colors.YELLOW + colors.ITALIC + "- Building the graph ... " + colors.RESET)
-    start_time = time.time()
-
-    system = MetroSystem()
-
     begin_time = time.time()
-    route_fetch = await get_routes()
-    print("* Retrieved routes in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
-    stations_fetch = await get_stations()
-
-    all_routes = {}
-    all_stops = {}
-
-    for station in stations_fetch:
-        try:
-            current_station = system.stations[station["parent_station"]]
-            if current_station:
-                continue
-        except KeyError:
-            current_station = Station(station["parent_station"], station["stop_name"])
-            system.stations[current_station.station_id] = current_station
-
-        for route in station["route_ids"]:
-            try:
-                current_route = all_routes[route]
-            except KeyError:
-                corresponding_route = None
-                for route2 in route_fetch:
-                    if route == route2["route_id"]:
-                        corresponding_route = route2
-                        break
-                if not corresponding_route:
-                    raise HTTPException(status_code=404, detail=f"Route id not found in fetched data : {route}")
+    stop_times = await StopTime.filter(
+        departure_secs__gte=hour * 3600,
+        departure_secs__lt=(hour + 1) * 3600,
+        arrival_secs__not_isnull=True,
+        trip__service_id__in=await service_calendar.get_active_services(date_str)
+    ).values_list("trip_id", "trip__route__route_id", "trip__direction_id", "trip__trip_headsign", "stop_id", "stop_sequence", "arrival_secs", "departure_secs")
 
-                current_route = Routes(route, corresponding_route["route_long_name"])
-                all_routes[route] = current_route
+    print("* Retrieved stop times of " + date_str + " " + str(hour) + "h in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return stop_times
 
-            current_station.routes[route] = current_route
 
-        for stop in station["stops"]:
-            current_stop = Stops(stop.stop_id, stop.stop_name, current_station)
-            all_stops[current_stop.stop_id] = current_stop
-            current_station.stops.append(current_stop)
+timetable_cache = TimetableCache(fetch_stop_times_bucket)
 
-    begin_time = time.time()
-    transfers = await get_transfers()
-    print("* Retrieved transfers in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
 
-    for transfer in transfers:
-        try:
-            stop1 = all_stops[transfer["from_stop_id"]]
-            stop2 = all_stops[transfer["to_stop_id"]]
-        except KeyError:
-            raise HTTPException(status_code=404, detail="Stop not found while adding transfers.")
-
-        stop1.transfers[stop2] = transfer["min_transfer_time"]
-        stop2.transfers[stop1] = transfer["min_transfer_time"]
+@app.get("/timetable_cache")
+async def get_timetable_cache_stats():
+    return timetable_cache.stats()
 
-    # création des métros et de leurs horaires de passages
 
-    stop_times = await fetch_stop_times_and_trips(date, time_date)
+async def fetch_service_day(date_str: str, begin_secs: int = None, end_secs: int = None):
+    """Fetches the stop times of the services running on a day as plain tuples, ready for build_timetable.
 
-    all_trips = {}
+    Only the stop times leaving from begin_secs (included) to end_secs (excluded) are fetched, when given.
+    The stops without times, between two timepoints, are left out: the trains go from a timepoint to the next.
+    """
+    begin_time = time.time()
+    filters = {
+        "trip__service_id__in": await service_calendar.get_active_services(date_str),
+        "arrival_secs__not_isnull": True,
+        "departure_secs__not_isnull": True,
+    }
+    if begin_secs is not None:
+        filters["departure_secs__gte"] = begin_secs
+    if end_secs is not None:
+        filters["departure_secs__lt"] = end_secs
+    stop_times = await StopTime.filter(**filters).values_list("trip_id", "trip__route__route_id", "stop_id", "stop_sequence", "arrival_secs", "departure_secs")
 
-    for stop_time in stop_times:
+    print("* Retrieved stop times of " + date_str + " in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return stop_times
 
-        try:
-            current_route = all_routes[stop_time.trip.route_id]
-        except KeyError:
-            raise HTTPException(status_code=404, detail=f"route not found at creation of trip and stop_time : {stop_time.trip.route_id}\n\n")
 
-        try:
-            current_trip = current_route.trips[stop_time.trip_id]
-        except KeyError:
-            current_trip = Trips(stop_time.trip_id, current_route, stop_time.trip.direction_id)
-            current_route.trips[current_trip.trip_id] = current_trip
-            all_trips[current_trip.trip_id] = current_trip
-
-        current_stop = all_stops[stop_time.stop_id]
-        current_stop_time = StopTimes(current_trip, current_stop, get_date_from_stop_time_arrival(stop_time, date_obj), get_date_from_stop_time_departure(stop_time, date_obj), stop_time.stop_sequence)
-        current_stop.stop_times.append(current_stop_time)
-        current_trip.stops.append(current_stop_time)
-
-        if not current_trip.head_stop:
-            current_trip.head_stop = stop_time.trip.trip_headsign
-
-    for trip in all_trips.values():
-        for stop_time in trip.stops:
-            for stop_time2 in trip.stops:
-                if not stop_time.next_stop_time and stop_time.departure_time < stop_time2.arrival_time:
-                    stop_time.next_stop_time = stop_time2
-                elif stop_time.departure_time < stop_time2.arrival_time < stop_time.next_stop_time.arrival_time:
-                    stop_time.next_stop_time = stop_time2
-                elif not stop_time.previous_stop_time and stop_time.arrival_time > stop_time2.departure_time:
-                    stop_time.previous_stop_time = stop_time2
-                elif stop_time.arrival_time > stop_time2.departure_time > stop_time.previous_stop_time.departure_time:
-                    stop_time.previous_stop_time = stop_time2
-
-    print("-> Graph built in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
-    return system
+timetable_store = TimetableStore(fetch_service_day, snapshots=snapshot_cache)
+transfer_pattern_cache = TransferPatternCache()
 
+# Identical requests in flight at the same time share a single window build and a single search
+graph_builds = SingleFlight()
+shared_searches = SingleFlight()
 
-def get_date_from_stop_time_departure(next_time, date):
-    departure_time = next_time.departure_time
-    hour = int(departure_time[0:2])
-    minute = int(departure_time[3:5])
-    second = int(departure_time[6:8])
 
-    if hour > 23:
-        hour -= 24
-        date += timedelta(days=1)
+@app.get("/single_flight")
+async def get_single_flight_stats():
+    return {"graph_builds": graph_builds.stats(), "searches": shared_searches.stats()}
 
-    return datetime.datetime.combine(date.date(), datetime.time(hour, minute, second))
 
+result_cache = ResultCache()
 
-def get_date_from_stop_time_arrival(next_time, date):
-    arrival_time = next_time.arrival_time
-    hour = int(arrival_time[0:2])
-    minute = int(arrival_time[3:5])
-    second = int(arrival_time[6:8])
 
-    if hour > 23:
-        hour -= 24
-        date += timedelta(days=1)
+@app.get("/result_cache")
+async def get_result_cache_stats():
+    return result_cache.stats()
 
-    return datetime.datetime.combine(date.date(), datetime.time(hour, minute, second))
 
-
-def dijkstra(graph: MetroSystem, start: str, end: str, date: datetime, total_begin_time: time):
-    """Computes the shortest path between two stations using Dijkstra's algorithm with a starting date.
+async def get_metro_graph(begin: datetime.datetime, end: datetime.datetime):
+    """Constructs a weighted graph representing the metro network for a given time window.
 
     Args:
-        graph: The weighted graph representing the metro network.
-        start: The starting station ID.
-        end: The destination station ID.
-        date: The starting date
+        begin: The beginning of the time window
+        end: The end of the time window, the searches grow it as they need
 
     Returns:
-        A dictionary containing:
-            - Dictionary of the stations used
-            - Dictionary of the stops used
-            - Date at the end of journey
-    """
-    begin_time = time.time()
-
-    start_station = graph.stations[start]
-    end_station = graph.stations[end]
-
-    if not (start_station and end_station):
-        raise HTTPException(status_code=404, detail="Station not found")
-
-    queue = [(None, start_station, None, [[start_station], {}, date])]  # initialisation à la station de départ et à la date départ
-    predecessors_stops = {}
-    output = {}
-
-    while queue:
-        current_trip, current_station, current_stop, current_path = queue.pop(0)
-
-        if output and output[2] < current_path[2]:  # On vérifie si on a déjà une date d'arrivée potentielle et on la compare avec la date actuelle.
-            continue
+        A MetroSystem object representing the graph during the time window
 
-        if current_station == end_station:  # condition "finale"
-            if not output or output[2] > current_path[2]:
-                output = current_path
-                continue
-
-        for stop in current_station.stops:  # On vérifie chacun des arrêts de la station
-            transfer_time = 2
+    """
 
-            current_date = copy.deepcopy(current_path[2])
-            if current_stop and stop != current_stop:  # On calcule l'heure à laquelle on arrive à l'arrêt si on effectue un changement
-                if stop in current_path[1]:  # à condition qu'il ne soit pas déjà dans le chemin parcouru bien évidemment
-                    continue
+    print(colors.YELLOW + colors.ITALIC + "- Building the graph ... " + colors.RESET)
+    start_time = time.time()
 
-                try:
-                    transfer_time = current_stop.transfers[stop]
-                except KeyError:
-                    pass
-                current_date += timedelta(seconds=transfer_time)
+    # Stations, stops, routes and transfers are shared between requests, only the stop times are loaded here
+    network = await static_network.get()
 
-                # On regarde si on n'est pas déjà parvenu plus tôt à cet arrêt dans un autre parcours
-                try:
-                    current_record = predecessors_stops[stop]
-                except KeyError:
-                    current_record = None
+    # Les horaires de passages viennent du cache, lus sans copie à travers la fenêtre
+    # The requests for the same window share its loading, each search then grows its own copy
+    window = await graph_builds.run((network, begin, end), timetable_cache.get_window, network, begin, end)
+    system = MetroSystem(network, window.copy())
 
-                if current_record and current_record < current_date:
-                    continue
-                elif current_record and current_record > current_date:
-                    predecessors_stops[stop] = current_date
-                if not current_record:
-                    predecessors_stops[stop] = current_date
+    print("-> Graph built in: " + colors.BLUE + colors.BOLD + str(time.time() - start_time) + colors.RESET + " seconds")
+    return system
 
-            directions = {}  # On regarde toutes les directions possibles des trains passant à cet arrêt après la date actuelle
-            for stop_time in stop.stop_times:
-                try:
-                    current_first_train_for_direction = directions[stop_time.trip.head_stop]
-                    if current_first_train_for_direction.departure_time > stop_time.departure_time > current_date:
-                        directions[stop_time.trip.head_stop] = stop_time
-                except KeyError:
-                    if stop_time.departure_time > current_date:
-                        directions[stop_time.trip.head_stop] = stop_time
 
-            # On regarde l'arrêt suivant d'un train pour chaque direction, s'il y en a deux identiques, on ne retient qu'une seule des deux directions car cela veut dire que la séparation de la ligne n'a pas lieux à cet arrêt.
-            to_delete = []
-            for direction in directions:
-                if direction in to_delete:
-                    continue
-                for direction2 in directions:
-                    if direction != direction2 and directions[direction].next_stop_time == directions[direction2].next_stop_time:
-                        to_delete.append(direction2)
+async def get_travel_time_bound(network: StaticNetwork, date: datetime.datetime) -> TravelTimeBound:
+    """Returns the lower bound of the travel times guiding the A* searches around a date.
 
-            for key in to_delete:
-                del directions[key]
+    The speed limit of the bound is the one of the fastest ride of the service days a search
+    window around the date runs on, the day before and the day after included, and its shortcuts
+    the rides of those days taking no time.
+    """
+    service_date = datetime.datetime.combine(date.date(), datetime.time())
+    max_speed = 0
+    shortcuts = set()
+    for days in (-1, 0, 1):
+        timetable = await timetable_store.get(network, service_date + timedelta(days=days))
+        timetable_speed, timetable_shortcuts = get_timetable_speed_limit(timetable)
+        max_speed = max(max_speed, timetable_speed)
+        shortcuts.update(timetable_shortcuts)
+    return TravelTimeBound(network, max_speed, shortcuts)
+
+
+async def get_path_with_transfers(start_stop_id: str, end_stop_id: str, date: datetime, forward: bool, total_begin_time: time, engine: str = "dijkstra"):
+    """Get a path between two stops considering transfers.
 
-            # On va créer un nouveau parcours pour chacune des directions disponibles
-            for (direction, next_time) in directions.items():
+    Args:
+        start_stop_id: ID of the starting station
+        end_stop_id: ID of the destination station
+        date: The date for the trip
+        forward: True if the start date is provided, False if end date is provided instead
+        engine: "dijkstra" to search the graph of the time window, "astar" to search it guided by the distance
+            to the destination, "csa" to scan the flat timetable of the day,
+            "transfer_patterns" to only search the precomputed transfer patterns (forward only, falls back to "csa")
 
-                if not next_time.next_stop_time:  # On regarde si c'est un terminus
-                    continue
+    Returns:
+        A dictionary
+    """
+    if engine in ("csa", "transfer_patterns"):
+        network = await static_network.get()
+        timetable = await timetable_store.get(network, get_service_date(date, forward))
+        if not forward:
+            return await search_pool.run_timetable_search(csa_revert, timetable, start_stop_id, end_stop_id, date, total_begin_time)
+        if engine == "transfer_patterns":
+            index = transfer_pattern_cache.get(await service_calendar.get_signature(date.strftime("%Y%m%d")))
+            result = await search_pool.run(transfer_pattern_search, timetable, index, start_stop_id, end_stop_id, date, total_begin_time) if index else {}
+            if result and index.covers(date, result["arrival_date"]):
+                return result
+            print("-> No transfer pattern journey (index missing, built on another network version or other services, or journey too long), falling back to the full search")
+        return await search_pool.run_timetable_search(csa, timetable, start_stop_id, end_stop_id, date, total_begin_time)
+
+    bound = await get_travel_time_bound(await static_network.get(), date) if engine == "astar" else None
+
+    # The window starts with the hour of the query, the search loads the next hours as it reaches them
+    if not forward:
+        graph = await get_metro_graph(date - timedelta(hours=1), date)
+        result = await search_pool.run_graph_search(dijkstra_revert, graph, start_stop_id, end_stop_id, date, total_begin_time, bound)
+    else:
+        graph = await get_metro_graph(date, date + timedelta(hours=1))
+        result = await search_pool.run_graph_search(dijkstra, graph, start_stop_id, end_stop_id, date, total_begin_time, bound)
+    if bound is not None and result:
+        # How much the bound guided the search: its speed limit, and the rides taking no time it goes around
+        result["bound"] = bound.stats()
+    return result
 
-                # On vérifie qu'on ne crée pas de cycle au prochain arrêt
-                if next_time.next_stop_time.stop in current_path[1]:
-                    continue
 
-                # On compare avec le temps record enregistré pour le prochain arrêt
-                try:
-                    current_record = predecessors_stops[next_time.next_stop_time.stop]
-                except KeyError:
-                    current_record = None
+@app.get("/shortest_path/{forward}/{start_stop_id}/{end_stop_id}/{date}")
+async def get_shortest_path(forward: str, start_stop_id: str, end_stop_id: str, date: str, engine: str = Query("dijkstra", pattern="^(dijkstra|astar|csa|transfer_patterns)$")):
+    """Finds the shortest path between two stops.
 
-                if current_record and current_record < next_time.next_stop_time.arrival_time:
-                    continue
-                elif current_record and current_record > next_time.next_stop_time.arrival_time:  # On met à jour la meilleure date pour le prochain arrêt si elle est meilleure
-                    predecessors_stops[next_time.next_stop_time.stop] = next_time.next_stop_time.arrival_time
-                elif not current_record:  # ceci indique que c'est la première fois qu'on atteint cet arrêt au cours de l'algorithme
-                    predecessors_stops[next_time.next_stop_time.stop] = next_time.next_stop_time.arrival_time
+    Args:
+        start_stop_id: The starting station ID.
+        end_stop_id: The destination station ID.
+        date: The date and time of the journey (YYYY-MM-DD HH:MM:SS)
+        forward: "True" if the start date is provided, "False" if end date is provided instead
+        engine: The routing engine, "dijkstra" (default), "astar", "csa" or "transfer_patterns"
 
-                new_station = next_time.next_stop_time.stop.parent_station
+    Returns:
+        A JSONResponse containing the dictionary returned by the dijkstra algorithm.
+    """
+    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "DIJKSTRA'S ALGORITHM" + colors.RESET)
 
-                if current_path[0] and new_station in current_path[0]:
-                    continue
+    total_begin_time = time.time()
 
-                # On récupère le chemin parcouru jusque là et on ajoute les nouveaux éléments
-                new_path_stations = current_path[0].copy()
-                new_path_stations.append(new_station)
-                new_path_stops = current_path[1].copy()
-                new_path_time = next_time.next_stop_time.arrival_time
+    try:
+        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+        if forward == "True":
+            forward = True
+        else:
+            forward = False
 
-                # On ajoute aussi l'arrêt précédent si on a fait un changement de métro dans la station précédente
-                try:
-                    new_path_stops[next_time.stop]
-                except KeyError:
-                    new_path_stops[next_time.stop] = [next_time.arrival_time, next_time.departure_time]
-
-                # On ajoute le nouvel arrêt au chemin avec l'heure d'arrivée et de départ actuellement disponible à cet arrêt
-                new_path_stops[next_time.next_stop_time.stop] = [next_time.next_stop_time.arrival_time, next_time.next_stop_time.departure_time]
-
-                queue.append((next_time.next_stop_time.trip, new_station, next_time.next_stop_time.stop, [new_path_stations, new_path_stops, new_path_time]))
-
-    print("-> Executed Dijkstra's algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
-    if not output:
-        return {}
-
-    return {
-        "stations": [
-            {
-                "name": station.station_name
-            } for station in output[0]
-        ],
-        "stops": [
-            {
-                "station": stop.parent_station.station_id,
-                "arrival_time": times[0],
-                "departure_time": times[1]
-            } for (stop, times) in output[1].items()
-        ],
-        "arrival_date": output[2],
-        "total_execution_time": time.time() - total_begin_time
-    }
+        cache_key = ("shortest_path", engine, forward, start_stop_id, end_stop_id)
+        result = await result_cache.get_journey(cache_key, date_obj, forward)
+        if result is None:
+            result = await shared_searches.run(cache_key + (date_obj,), get_path_with_transfers, start_stop_id, end_stop_id, date_obj, forward, total_begin_time, engine)
+            await result_cache.set(cache_key, date_obj, result)
+        elif result:
+            # The time of this request, not the one of the request the journey was computed for
+            result = {**result, "total_execution_time": time.time() - total_begin_time}
+        print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
 
+        return result
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return JSONResponse(content={"error": e}, status_code=404)
 
-def dijkstra_revert(graph: MetroSystem, start: str, end: str, date: datetime, total_begin_time: time):
-    """Computes the shortest path between two stations using Dijkstra's algorithm with an ending date.
 
-        Args:
-            graph: The weighted graph representing the metro network.
-            start: The starting station ID.
-            end: The destination station ID.
-            date: The date of the journey
+@app.get("/pareto_paths/{start_stop_id}/{end_stop_id}/{date}")
+async def get_pareto_paths(start_stop_id: str, end_stop_id: str, date: str, max_transfers: int = Query(MAX_TRANSFERS, ge=0, le=10)):
+    """Finds the journeys between two stops that are optimal in arrival time and number of transfers.
 
-        Returns:
-            A dictionary containing:
-                - Dictionary of the stations used
-                - Dictionary of the stops used
-                - Time and the end of journey
-        """
-    begin_time = time.time()
+    Args:
+        start_stop_id: The starting station ID.
+        end_stop_id: The destination station ID.
+        date: The departure date and time (YYYY-MM-DD HH:MM:SS)
+        max_transfers: The maximum number of transfers of a journey.
 
-    start_station = graph.stations[end]
-    end_station = graph.stations[start]
+    Returns:
+        A JSONResponse containing the dictionary returned by the RAPTOR algorithm.
+    """
+    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "RAPTOR ALGORITHM" + colors.RESET)
 
-    if not (start_station and end_station):
-        raise HTTPException(status_code=404, detail="Station not found")
+    total_begin_time = time.time()
 
-    queue = [(None, start_station, None, [[start_station], {}, date])]  # initialisation à la station de départ et à la date d'arrivée
-    predecessors_stops = {}
-    output = {}
+    try:
+        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
 
-    while queue:
-        current_trip, current_station, current_stop, current_path = queue.pop(0)
+    network = await static_network.get()
+    timetable = await timetable_store.get(network, get_service_date(date_obj))
+    result = await search_pool.run_timetable_search(raptor, timetable, start_stop_id, end_stop_id, date_obj, total_begin_time, max_transfers)
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+    return result
 
-        if output and output[2] > current_path[2]:  # On vérifie si on a déjà une date de départ potentielle et on la compare avec la date actuelle.
-            continue
 
-        if current_station == end_station:  # condition "finale"
-            if not output or output[2] < current_path[2]:
-                output = current_path
-                continue
+@app.get("/profile/{start_stop_id}/{end_stop_id}/{date}")
+async def get_profile(start_stop_id: str, end_stop_id: str, date: str, window: int = Query(60, ge=1, le=24 * 60), max_duration: int = Query(180, ge=1, le=24 * 60)):
+    """Finds every optimal departure between two stops over a time interval, in a single search.
 
-        for stop in current_station.stops:  # On vérifie chacun des arrêts de la station
-            transfer_time = 2
+    Args:
+        start_stop_id: The starting station ID.
+        end_stop_id: The destination station ID.
+        date: The beginning of the departure interval (YYYY-MM-DD HH:MM:SS)
+        window: The length of the departure interval, in minutes.
+        max_duration: The longest journey considered, in minutes.
 
-            current_date = copy.deepcopy(current_path[2])
-            if current_stop and stop != current_stop:  # On calcule l'heure à laquelle on arrive à l'arrêt si on effectue un changement
-                if stop in current_path[1]:  # à condition qu'il ne soit pas déjà dans le chemin parcouru bien évidemment
-                    continue
+    Returns:
+        A JSONResponse containing the dictionary returned by the profile search.
+    """
+    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "PROFILE CONNECTION SCAN" + colors.RESET)
 
-                try:
-                    transfer_time = current_stop.transfers[stop]
-                except KeyError:
-                    pass
-                current_date -= timedelta(seconds=transfer_time)
+    total_begin_time = time.time()
 
-                # On regarde si on n'est pas déjà parvenu plus tard à cet arrêt dans un autre parcours
-                try:
-                    current_record = predecessors_stops[stop]
-                except KeyError:
-                    current_record = None
+    try:
+        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
 
-                if current_record and current_record > current_date:
-                    continue
-                elif current_record and current_record < current_date:
-                    predecessors_stops[stop] = current_date
-                if not current_record:
-                    predecessors_stops[stop] = current_date
+    network = await static_network.get()
+    timetable = await timetable_store.get(network, get_service_date(date_obj))
+    result = await search_pool.run_timetable_search(profile_csa, timetable, start_stop_id, end_stop_id, date_obj, date_obj + timedelta(minutes=window), max_duration * 60, total_begin_time)
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+    return result
 
-            directions = {}
-            # On regarde toutes les directions possibles des trains passant à cet arrêt avant l'heure actuelle.
-            for stop_time in stop.stop_times:
-                try:
-                    if stop_time.previous_stop_time:
-                        current_last_train_from_direction = directions[stop_time.previous_stop_time.stop]
-                        if current_last_train_from_direction.arrival_time < stop_time.arrival_time < current_date:
-                            directions[stop_time.previous_stop_time.stop] = stop_time
-                except KeyError:
-                    if stop_time.arrival_time < current_date:
-                        directions[stop_time.previous_stop_time.stop] = stop_time
 
-            # Si l'arrêt est déjà dans le chemin alors on peut ignorer cette direction
-            for stop2 in current_path[1]:
-                try:
-                    del directions[stop2]
-                except KeyError:
-                    pass
+@app.get("/isochrone/{parent_station}/{date}")
+async def get_isochrone(parent_station: str, date: str, max_duration: int = Query(MAX_ISOCHRONE_DURATION, ge=1, le=24 * 60), bands: Optional[str] = None):
+    """Finds the earliest arrival at every station reachable from a parent_station.
 
-            # On va créer un nouveau parcours pour chacune des directions disponibles
-            for (direction, previous_time) in directions.items():
+    Args:
+        parent_station: The parent_station ID to start from.
+        date: The departure date and time (YYYY-MM-DD HH:MM:SS)
+        max_duration: The longest travel time considered, in minutes.
+        bands: Optional isochrone bands in minutes, separated by commas (e.g. "10,20,30"),
+            the last one replaces max_duration.
 
-                if not previous_time.previous_stop_time:  # On regarde si c'est un terminus (départ).
-                    continue
+    Returns:
+        A JSONResponse containing the dictionary returned by the isochrone search.
+    """
+    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "ISOCHRONE" + colors.RESET)
 
-                # On vérifie qu'on ne crée pas de cycle au prochain arrêt précédent
-                if previous_time.previous_stop_time.stop in current_path[1]:
-                    continue
+    total_begin_time = time.time()
 
-                # On compare avec le temps record enregistré pour le précédent arrêt
-                try:
-                    current_record = predecessors_stops[previous_time.previous_stop_time.stop]
-                except KeyError:
-                    current_record = None
+    try:
+        date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
 
-                if current_record and current_record > previous_time.previous_stop_time.arrival_time:
-                    continue
-                elif current_record and current_record < previous_time.previous_stop_time.arrival_time:  # On met à jour la meilleure date pour le prochain arrêt si elle est meilleure
-                    predecessors_stops[previous_time.previous_stop_time.stop] = previous_time.previous_stop_time.arrival_time
-                elif not current_record:
-                    predecessors_stops[previous_time.previous_stop_time.stop] = previous_time.previous_stop_time.arrival_time
+    band_limits = parse_bands(bands) if bands else None
+    network = await static_network.get()
+    timetable = await timetable_store.get(network, get_service_date(date_obj))
+    result = await search_pool.run_timetable_search(isochrone, timetable, parent_station, date_obj, total_begin_time, max_duration, band_limits)
+    print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+    return result
 
-                new_station = previous_time.previous_stop_time.stop.parent_station
 
-                if current_path[0] and new_station in current_path[0]:
-                    continue
+matrix_pool = MatrixPool()
+search_pool = SearchPool()
 
-                # On récupère le chemin parcouru jusque là et on ajoute les nouveaux éléments
-                new_path_stations = current_path[0].copy()
-                new_path_stations.append(new_station)
-                new_path_stops = current_path[1].copy()
-                new_path_time = previous_time.previous_stop_time.departure_time
 
-                # On ajoute aussi l'arrêt précédent si on a fait un changement de métro dans la station précédente
-                try:
-                    new_path_stops[previous_time.stop]
-                except KeyError:
-                    new_path_stops[previous_time.stop] = [previous_time.arrival_time, previous_time.departure_time]
-
-                # On ajoute le nouvel arrêt au chemin avec l'heure d'arrivée et de départ actuellement disponible à cet arrêt
-                new_path_stops[previous_time.previous_stop_time.stop] = [previous_time.previous_stop_time.arrival_time, previous_time.previous_stop_time.departure_time]
-
-                queue.append((previous_time.previous_stop_time.trip, new_station, previous_time.previous_stop_time.stop, [new_path_stations, new_path_stops, new_path_time]))
-
-    print("-> Executed Dijkstra's reverse algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
-    if not output:
-        return {}
-
-    return {
-            "stations": [
-                {
-                    "name": station.station_name
-                } for station in output[0]
-            ],
-            "stops": [
-                {
-                    "station": stop.parent_station.station_id,
-                    "arrival_time": times[0],
-                    "departure_time": times[1]
-                } for (stop, times) in reversed(output[1].items())
-            ],
-            "departure_date": output[2],
-            "total_execution_time": time.time() - total_begin_time
-        }
+@app.on_event("startup")
+async def start_worker_processes():
+    # Started once, they are only started again when the network changes
+    network = await static_network.get()
+    matrix_pool.start(network)
+    search_pool.start(network)
 
 
-async def get_path_with_transfers(start_stop_id: str, end_stop_id: str, date: datetime, forward: bool, total_begin_time: time):
-    """Get a path between two stops considering transfers.
+@app.on_event("shutdown")
+async def stop_matrix_pool():
+    matrix_pool.shutdown()
+    search_pool.shutdown()
 
-    Args:
-        start_stop_id: ID of the starting station
-        end_stop_id: ID of the destination station
-        date: The date for the trip
-        forward: True if the start date is provided, False if end date is provided instead
 
-    Returns:
-        A dictionary
-    """
-    graph = await get_metro_graph(date.date().strftime("%Y%m%d"), date.time().strftime("%H%M%S"), date)
-    if not forward:
-        date += timedelta(hours=2)
-        result = dijkstra_revert(graph, start_stop_id, end_stop_id, date, total_begin_time)
-    else:
-        result = dijkstra(graph, start_stop_id, end_stop_id, date, total_begin_time)
-    return result
+@app.get("/search_pool")
+async def get_search_pool_stats():
+    return search_pool.stats()
 
 
-@app.get("/shortest_path/{forward}/{start_stop_id}/{end_stop_id}/{date}")
-async def get_shortest_path(forward: str, start_stop_id: str, end_stop_id: str, date: str):
-    """Finds the shortest path between two stops.
+@app.get("/matrix/{date}")
+async def get_matrix(date: str, origins: Optional[str] = None, destinations: Optional[str] = None, max_duration: int = Query(MAX_MATRIX_DURATION, ge=1, le=24 * 60), output_format: str = Query("rows", alias="format", pattern="^(rows|npy)$")):
+    """Computes the travel times between every origin and every destination, leaving at a given date.
 
     Args:
-        start_stop_id: The starting station ID.
-        end_stop_id: The destination station ID.
-        date: The date and time of the journey (YYYY-MM-DD HH:MM:SS)
-        forward: "True" if the start date is provided, "False" if end date is provided instead
+        date: The departure date and time (YYYY-MM-DD HH:MM:SS)
+        origins: The origin parent_station IDs, separated by commas. Every station if omitted,
+            in the order of /stations.
+        destinations: The destination parent_station IDs, same format as origins.
+        max_duration: The longest travel time considered, in minutes.
+        format: "rows" to stream one JSON line per origin, "npy" for a numpy int32 matrix.
 
     Returns:
-        A JSONResponse containing the dictionary returned by the dijkstra algorithm.
+        The travel times in seconds, -1 for the destinations not reached within max_duration.
     """
-    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "DIJKSTRA'S ALGORITHM" + colors.RESET)
+    print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "TRAVEL TIME MATRIX" + colors.RESET)
 
     total_begin_time = time.time()
 
     try:
         date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-        if forward == "True":
-            forward = True
-        else:
-            forward = False
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
 
-        if not forward:
-            date_obj -= timedelta(hours=2)
-        result = await get_path_with_transfers(start_stop_id, end_stop_id, date_obj, forward, total_begin_time)
+    network = await static_network.get()
+    timetable = await timetable_store.get(network, get_service_date(date_obj))
+    origin_ids, origin_stops = get_matrix_stations(timetable, origins.split(",") if origins else None)
+    destination_ids, destination_stops = get_matrix_stations(timetable, destinations.split(",") if destinations else None)
+    rows = matrix_pool.rows(timetable, origin_stops, destination_stops, date_obj, max_duration)
+
+    if output_format == "npy":
+        matrix = [row async for row in rows]
+        print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
+        return Response(content=matrix_to_npy(matrix), media_type="application/octet-stream", headers={"Content-Disposition": "attachment; filename=matrix.npy"})
+
+    async def stream_rows():
+        yield json.dumps({"destinations": destination_ids}) + "\n"
+        index = 0
+        async for row in rows:
+            yield json.dumps({"origin": origin_ids[index], "travel_times": row}) + "\n"
+            index += 1
         print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
 
-        return result
-    except ValueError:
-        return JSONResponse(content={"error": "Invalid date format. Please use YYYY-MM-DD HH:MM:SS."}, status_code=400)
-    except Exception as e:
-        return JSONResponse(content={"error": e}, status_code=404)
+    return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
 
 
 # -----------------------------------------------------------------------------
@@ -780,7 +596,7 @@ async def prim(graph: MetroSystem, start: str, date: datetime.date, total_begin_
     # On récupère tous les liens de la station de départ pour initialiser le programme
     for stop in start_station.stops:
         directions = {}
-        for stop_time in stop.stop_times:
+        for stop_time in graph.stop_times_at(stop):
             try:
                 if not stop_time.next_stop_time:
                     continue
@@ -822,7 +638,7 @@ async def prim(graph: MetroSystem, start: str, date: datetime.date, total_begin_
                     transfer_time = 10
                 next_arrival_time += timedelta(seconds=transfer_time)
 
-            for stop_time in stop.stop_times:
+            for stop_time in graph.stop_times_at(stop):
                 try:
                     if not stop_time.next_stop_time:
                         continue
@@ -860,10 +676,10 @@ async def get_prim_spanning_tree(parent_station: str, date: str):
 
     Args:
         parent_station: The parent_station ID to start from.
-        date: The date to compute the MST for (YYYY-MM-DD HH:MM:SS)
+        date: The date to compute the MST for (YYYY-MM-DD HH:MM:SS), rounded down to the result cache bucket
 
     Returns:
-        A JSONResponse containing the MST edges and its total weight.
+        A JSONResponse containing the MST edges, its total weight and the date it was computed for.
     """
 
     print(colors.UNDERLINE + colors.YELLOW + colors.BOLD + "PRIM'S ALGORITHM" + colors.RESET)
@@ -871,10 +687,17 @@ async def get_prim_spanning_tree(parent_station: str, date: str):
     total_begin_time = time.time()
 
     date_obj = datetime.datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-    graph = await get_metro_graph(date_obj.date().strftime("%Y%m%d"), date_obj.time().strftime("%H:%M:%S"), date_obj)  # Pass the time and date_obj
-    output, cost, connexe, total_execution_time = await prim(graph, parent_station, date_obj, total_begin_time)
+    # The next trains change with the date: the tree is computed for the start of the time bucket
+    # of the date, so that every query of the bucket shares it
+    date_obj = result_cache.get_bucket_date(date_obj)
+    content = await result_cache.get(("prim", parent_station), date_obj)
+    if content is None:
+        graph = await get_metro_graph(date_obj, date_obj + timedelta(hours=2))
+        output, cost, connexe, _ = await search_pool.run_graph_search(prim, graph, parent_station, date_obj, total_begin_time)
+        content = {"mst": output, "cost": cost, "connexe": connexe}
+        await result_cache.set(("prim", parent_station), date_obj, content)
     print(colors.UNDERLINE + "-> Total execution time: " + colors.GREEN + colors.BOLD + str(time.time() - total_begin_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
-    return JSONResponse(content={"mst": output, "cost": cost, "connexe": connexe, "total_execution_time": total_execution_time}, status_code=200)
+    return JSONResponse(content={**content, "date": str(date_obj), "total_execution_time": time.time() - total_begin_time}, status_code=200)
 
 # -----------------------------------------------------------------------------
 #                       RUN THE APP
@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import hashlib
+import time
+from db_config.models import Calendar, CalendarDate
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# exception_type values of calendar_dates.txt
+SERVICE_ADDED = 1
+SERVICE_REMOVED = 2
+
+
+class ServiceCalendar:
+    """Services running on each date, from the calendar weekday flags and the calendar_dates exceptions.
+
+    Services are numbered, and the services running on a date are stored as a bitset (a Python
+    int, bit n set if service n runs), precomputed for every date between the first start date and
+    the last end date of the calendar and for every exception date.
+
+    Attributes:
+        service_ids / service_index: The service ID of each service number, and the other way around.
+        active: The bitset of the services running on each date (YYYYMMDD).
+    """
+
+    def __init__(self, calendars: list, calendar_dates: list):
+        """Builds the bitsets.
+
+        Args:
+            calendars: (service_id, monday, ..., sunday, start_date, end_date) tuples.
+            calendar_dates: (service_id, date, exception_type) tuples.
+        """
+        self.service_ids = []
+        self.service_index = {}
+        self.active = {}
+        self.services = {}
+
+        weekday_masks = [0] * 7
+        starts = {}
+        ends = {}
+        for service_id, *days, start_date, end_date in calendars:
+            bit = 1 << self.get_service_number(service_id)
+            for weekday, runs in enumerate(days):
+                if runs:
+                    weekday_masks[weekday] |= bit
+            starts[start_date] = starts.get(start_date, 0) | bit
+            ends[end_date] = ends.get(end_date, 0) | bit
+
+        # Sweep the dates once, keeping the bitset of the services whose date range covers the day
+        if starts:
+            day = datetime.datetime.strptime(min(starts), "%Y%m%d")
+            last_day = datetime.datetime.strptime(max(ends), "%Y%m%d")
+            in_range = 0
+            while day <= last_day:
+                date_str = day.strftime("%Y%m%d")
+                in_range |= starts.get(date_str, 0)
+                self.active[date_str] = in_range & weekday_masks[day.weekday()]
+                in_range &= ~ends.get(date_str, 0)
+                day += datetime.timedelta(days=1)
+
+        for service_id, date_str, exception_type in calendar_dates:
+            bit = 1 << self.get_service_number(service_id)
+            if exception_type == SERVICE_ADDED:
+                self.active[date_str] = self.active.get(date_str, 0) | bit
+            elif exception_type == SERVICE_REMOVED:
+                self.active[date_str] = self.active.get(date_str, 0) & ~bit
+
+    def get_service_number(self, service_id: str) -> int:
+        try:
+            return self.service_index[service_id]
+        except KeyError:
+            self.service_index[service_id] = len(self.service_ids)
+            self.service_ids.append(service_id)
+            return self.service_index[service_id]
+
+    def get_bitset(self, date_str: str) -> int:
+        return self.active.get(date_str, 0)
+
+    def is_active(self, service_id: str, date_str: str) -> bool:
+        number = self.service_index.get(service_id)
+        return number is not None and bool(self.get_bitset(date_str) >> number & 1)
+
+    def get_active_services(self, date_str: str) -> list:
+        """Returns the IDs of the services running on a date (YYYYMMDD)."""
+        try:
+            return self.services[date_str]
+        except KeyError:
+            pass
+
+        services = []
+        bitset = self.get_bitset(date_str)
+        while bitset:
+            lowest_bit = bitset & -bitset
+            services.append(self.service_ids[lowest_bit.bit_length() - 1])
+            bitset ^= lowest_bit
+        self.services[date_str] = services
+        return services
+
+    def get_signature(self, date_str: str) -> str:
+        """Returns a hash of the set of services running on a date: two dates with the same signature share a timetable."""
+        return hashlib.sha1(",".join(sorted(self.get_active_services(date_str))).encode()).hexdigest()
+
+
+async def load_service_calendar() -> ServiceCalendar:
+    """Loads the calendar and calendar_dates tables from the database."""
+    begin_time = time.time()
+    calendars = await Calendar.all().values_list("service_id", *WEEKDAYS, "start_date", "end_date")
+    calendar_dates = await CalendarDate.all().values_list("service_id", "date", "exception_type")
+    print("* Retrieved calendar in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return ServiceCalendar(calendars, calendar_dates)
+
+
+class ServiceCalendarCache:
+    """Keeps the service calendar in memory, rebuilt only when the network version changes."""
+
+    def __init__(self, loader=load_service_calendar):
+        self.loader = loader
+        self.calendar = None
+        self.version = None
+        self.lock = asyncio.Lock()
+
+    async def get(self) -> ServiceCalendar:
+        version = get_network_version()
+        if self.calendar is not None and self.version == version:
+            return self.calendar
+
+        async with self.lock:
+            if self.calendar is None or self.version != version:
+                begin_time = time.time()
+                self.calendar = await self.loader()
+                self.version = version
+                print("* Built service calendar of " + str(len(self.calendar.service_ids)) + " services in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+        return self.calendar
+
+    async def get_active_services(self, date_str: str) -> list:
+        return (await self.get()).get_active_services(date_str)
+
+    async def get_signature(self, date_str: str) -> str:
+        return (await self.get()).get_signature(date_str)
+
+
+service_calendar = ServiceCalendarCache()
@@ -0,0 +1,324 @@
+import datetime
+import time
+from bisect import bisect_left, bisect_right
+from fastapi import HTTPException
+from services.timetable import Timetable
+from utils.colors import colors
+
+INFINITY = float("inf")
+
+
+def get_station_stops_or_404(timetable: Timetable, station_id: str):
+    try:
+        return timetable.get_station_stops(station_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Station not found")
+
+
+def get_trip_connections(timetable: Timetable, enter: int, exit: int):
+    """Returns the connections ridden on a trip, from the one boarded to the one alighted from."""
+    connections = [enter]
+    while connections[-1] != exit:
+        connections.append(timetable.next_connection[connections[-1]])
+    return connections
+
+
+def format_journey(timetable: Timetable, start: str, connections: list):
+    """Returns the stations and stops of a journey in the format of the dijkstra search."""
+    stations = [timetable.network.stations[start]]
+    stops = {}
+    for connection in connections:
+        dep_stop = timetable.get_stop(timetable.dep_stop[connection])
+        arr_stop = timetable.get_stop(timetable.arr_stop[connection])
+        stops.setdefault(dep_stop, [timetable.get_date(timetable.dep_arrival[connection]), timetable.get_date(timetable.dep_time[connection])])
+        stops[arr_stop] = [timetable.get_date(timetable.arr_time[connection]), timetable.get_date(timetable.arr_departure[connection])]
+        if arr_stop.parent_station is not stations[-1]:
+            stations.append(arr_stop.parent_station)
+
+    return (
+        [
+            {
+                "name": station.station_name
+            } for station in stations
+        ],
+        [
+            {
+                "station": stop.parent_station.station_id,
+                "arrival_time": times[0],
+                "departure_time": times[1]
+            } for (stop, times) in stops.items()
+        ]
+    )
+
+
+def scan_connections(timetable: Timetable, start_stops: list, end_stops: list, departure: int, until: int = INFINITY):
+    """Computes the earliest arrival at every stop, leaving the starting stops at a given time.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start_stops: The stop numbers we start from.
+        end_stops: The stop numbers of the destination, the scan stops once they are reached.
+            With no destination the whole day is scanned.
+        departure: The departure time, in seconds since the start of the service day.
+        until: The scan also stops at the first connection leaving at or after this time.
+
+    Returns:
+        The earliest arrival time at each stop, and how each stop was reached: a
+        (boarded connection, alighted connection) pair, the stop walked from, or None.
+    """
+    dep_stop, arr_stop, dep_time, arr_time, trip = timetable.dep_stop, timetable.arr_stop, timetable.dep_time, timetable.arr_time, timetable.trip
+    arrivals = [INFINITY] * len(timetable.stop_ids)
+    journeys = [None] * len(timetable.stop_ids)
+    trip_enter = [-1] * len(timetable.trip_ids)
+
+    for stop in start_stops:
+        arrivals[stop] = departure
+    end_arrival = min(until, min((arrivals[stop] for stop in end_stops), default=INFINITY))
+
+    for connection in range(bisect_left(dep_time, departure), len(dep_time)):
+        if end_arrival <= dep_time[connection]:
+            break
+
+        current_trip = trip[connection]
+        if trip_enter[current_trip] < 0:
+            if arrivals[dep_stop[connection]] > dep_time[connection]:
+                continue
+            trip_enter[current_trip] = connection
+
+        stop = arr_stop[connection]
+        if arr_time[connection] < arrivals[stop]:
+            arrivals[stop] = arr_time[connection]
+            journeys[stop] = (trip_enter[current_trip], connection)
+            for other_stop, transfer_time in timetable.footpaths(stop):
+                if arr_time[connection] + transfer_time < arrivals[other_stop]:
+                    arrivals[other_stop] = arr_time[connection] + transfer_time
+                    journeys[other_stop] = stop
+            end_arrival = min(until, min((arrivals[stop] for stop in end_stops), default=INFINITY))
+
+    return arrivals, journeys
+
+
+def csa(timetable: Timetable, start: str, end: str, date: datetime.datetime, total_begin_time: time):
+    """Computes the earliest arrival path between two stations with the Connection Scan Algorithm.
+
+    The connections of the day are scanned once, in order of departure, from the first one leaving
+    after the given date until the destination is reached.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The starting date
+
+    Returns:
+        The same dictionary as dijkstra, or an empty one if the destination can't be reached.
+    """
+    begin_time = time.time()
+
+    start_stops = get_station_stops_or_404(timetable, start)
+    end_stops = get_station_stops_or_404(timetable, end)
+    arrivals, journeys = scan_connections(timetable, start_stops, end_stops, timetable.get_seconds(date))
+
+    target = min(end_stops, key=lambda stop: arrivals[stop])
+    print("-> Executed Connection Scan Algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    if arrivals[target] == INFINITY:
+        return {}
+
+    legs = []
+    stop = target
+    while journeys[stop] is not None:
+        if isinstance(journeys[stop], int):  # transfer from another stop of the station
+            stop = journeys[stop]
+            continue
+        enter, exit = journeys[stop]
+        legs.append(get_trip_connections(timetable, enter, exit))
+        stop = timetable.dep_stop[enter]
+
+    stations, stops = format_journey(timetable, start, [connection for leg in reversed(legs) for connection in leg])
+    return {
+        "stations": stations,
+        "stops": stops,
+        "arrival_date": timetable.get_date(arrivals[target]),
+        "total_execution_time": time.time() - total_begin_time
+    }
+
+
+def csa_revert(timetable: Timetable, start: str, end: str, date: datetime.datetime, total_begin_time: time):
+    """Computes the latest departure path between two stations with the Connection Scan Algorithm.
+
+    The connections are scanned backward, in order of arrival, from the last one arriving before
+    the given date.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The date of the journey
+
+    Returns:
+        The same dictionary as dijkstra_revert, or an empty one if there is no journey.
+    """
+    begin_time = time.time()
+
+    start_stops = get_station_stops_or_404(timetable, start)
+    end_stops = get_station_stops_or_404(timetable, end)
+    arrival = timetable.get_seconds(date)
+
+    dep_stop, arr_stop, dep_time, arr_time, trip = timetable.dep_stop, timetable.arr_stop, timetable.dep_time, timetable.arr_time, timetable.trip
+    departures = [-INFINITY] * len(timetable.stop_ids)
+    journeys = [None] * len(timetable.stop_ids)  # (boarded connection, alighted connection) or stop walked to
+    trip_exit = [-1] * len(timetable.trip_ids)
+
+    for stop in end_stops:
+        departures[stop] = arrival
+    start_departure = max(departures[stop] for stop in start_stops)
+
+    by_arrival = timetable.by_arrival
+    last = bisect_right(by_arrival, arrival, key=lambda connection: arr_time[connection])
+    for position in range(last - 1, -1, -1):
+        connection = by_arrival[position]
+        if start_departure >= arr_time[connection]:
+            break
+
+        current_trip = trip[connection]
+        if trip_exit[current_trip] < 0:
+            if departures[arr_stop[connection]] < arr_time[connection]:
+                continue
+            trip_exit[current_trip] = connection
+
+        stop = dep_stop[connection]
+        if dep_time[connection] > departures[stop]:
+            departures[stop] = dep_time[connection]
+            journeys[stop] = (connection, trip_exit[current_trip])
+            for other_stop, transfer_time in timetable.footpaths(stop):
+                if dep_time[connection] - transfer_time > departures[other_stop]:
+                    departures[other_stop] = dep_time[connection] - transfer_time
+                    journeys[other_stop] = stop
+            start_departure = max(departures[stop] for stop in start_stops)
+
+    target = max(start_stops, key=lambda stop: departures[stop])
+    print("-> Executed reverse Connection Scan Algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    if departures[target] == -INFINITY:
+        return {}
+
+    connections = []
+    stop = target
+    while journeys[stop] is not None:
+        if isinstance(journeys[stop], int):  # transfer to another stop of the station
+            stop = journeys[stop]
+            continue
+        enter, exit = journeys[stop]
+        connections.extend(get_trip_connections(timetable, enter, exit))
+        stop = arr_stop[exit]
+
+    stations, stops = format_journey(timetable, start, connections)
+    return {
+        "stations": list(reversed(stations)),
+        "stops": stops,
+        "departure_date": timetable.get_date(departures[target]),
+        "total_execution_time": time.time() - total_begin_time
+    }
+
+
+def add_to_profile(profile: tuple, departure: int, arrival: int):
+    """Adds a (departure, arrival) pair to a profile, unless a pair leaving later arrives as early.
+
+    A profile is a pair of lists (departures, arrivals), both sorted in increasing order, so that
+    it only holds non-dominated pairs.
+    """
+    departures, arrivals = profile
+    position = bisect_left(departures, departure)
+    if position < len(departures) and arrivals[position] <= arrival:
+        return False
+
+    # Remove the pairs leaving earlier (or at the same time) and not arriving earlier
+    first = position
+    while first > 0 and arrivals[first - 1] >= arrival:
+        first -= 1
+    if position < len(departures) and departures[position] == departure:
+        position += 1
+    departures[first:position] = [departure]
+    arrivals[first:position] = [arrival]
+    return True
+
+
+def get_profile_arrival(profile: tuple, departure: int):
+    """Returns the earliest arrival of a profile when leaving at or after a given time."""
+    departures, arrivals = profile
+    position = bisect_left(departures, departure)
+    return arrivals[position] if position < len(departures) else INFINITY
+
+
+def profile_csa(timetable: Timetable, start: str, end: str, date: datetime.datetime, end_date: datetime.datetime, max_duration: int, total_begin_time: time):
+    """Computes every optimal (departure, arrival) pair between two stations over a time interval.
+
+    Profile variant of the Connection Scan Algorithm: the connections are scanned once, by
+    decreasing departure time, and each stop keeps the profile of its earliest arrivals at the
+    destination depending on the departure time.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The beginning of the departure interval.
+        end_date: The end of the departure interval.
+        max_duration: The longest journey considered, in seconds.
+
+    Returns:
+        A dictionary containing:
+            - profile: The non-dominated journeys, by departure date, each with its departure
+              date, arrival date and duration in seconds.
+            - total_execution_time
+    """
+    begin_time = time.time()
+
+    start_stops = get_station_stops_or_404(timetable, start)
+    end_stops = set(get_station_stops_or_404(timetable, end))
+    first_departure = timetable.get_seconds(date)
+    last_departure = timetable.get_seconds(end_date)
+
+    dep_stop, arr_stop, dep_time, arr_time, trip = timetable.dep_stop, timetable.arr_stop, timetable.dep_time, timetable.arr_time, timetable.trip
+    profiles = [([], []) for _ in timetable.stop_ids]
+    trip_arrivals = [INFINITY] * len(timetable.trip_ids)
+
+    # Nothing leaving after the earliest arrival of the last departure can improve the profile
+    arrivals, _ = scan_connections(timetable, start_stops, end_stops, last_departure)
+    first = bisect_left(dep_time, first_departure)
+    last = bisect_left(dep_time, min(min(arrivals[stop] for stop in end_stops), last_departure + max_duration))
+    for connection in range(last - 1, first - 1, -1):
+        stop = arr_stop[connection]
+        arrival = min(
+            arr_time[connection] if stop in end_stops else INFINITY,  # get off at the destination
+            trip_arrivals[trip[connection]],  # stay on the train
+            get_profile_arrival(profiles[stop], arr_time[connection]),  # change train at the stop
+        )
+        if arrival == INFINITY or arrival - dep_time[connection] > max_duration:
+            continue
+        if arrival < trip_arrivals[trip[connection]]:
+            trip_arrivals[trip[connection]] = arrival
+
+        stop = dep_stop[connection]
+        if stop in end_stops:
+            continue
+        add_to_profile(profiles[stop], dep_time[connection], arrival)
+        for other_stop, transfer_time in timetable.footpaths(stop):
+            add_to_profile(profiles[other_stop], dep_time[connection] - transfer_time, arrival)
+
+    # Merge the profiles of the stops of the starting station
+    profile = ([], [])
+    for stop in start_stops:
+        for departure, arrival in zip(*profiles[stop]):
+            if first_departure <= departure <= last_departure:
+                add_to_profile(profile, departure, arrival)
+
+    print("-> Executed profile Connection Scan Algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return {
+        "profile": [
+            {
+                "departure_date": timetable.get_date(departure),
+                "arrival_date": timetable.get_date(arrival),
+                "duration": arrival - departure
+            } for departure, arrival in zip(*profile)
+        ],
+        "total_execution_time": time.time() - total_begin_time
+    }
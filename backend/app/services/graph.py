@@ -1,12 +1,57 @@
 import datetime
 import heapq
-from db_config.models import Route, Trip, StopTime
+import math
+from tortoise import Tortoise
+from db_config.models import Stop, StopTime
+from services.calendar import service_calendar
+from services.lower_bound import get_lower_bounds, get_speed_limit
 from fastapi.responses import JSONResponse
 from typing import List, Dict, Optional
 
+# Stop times read at once from the server-side cursor of iter_route_stop_times
+STOP_TIMES_PREFETCH = 10000
+
+# Timed stop times of the trips of a route type running on some services, in trip and stop sequence order
+ROUTE_STOP_TIMES_QUERY = """
+    SELECT stop_times.trip_id, stop_times.stop_id, stop_times.stop_sequence, stop_times.arrival_secs, stop_times.departure_secs
+    FROM stop_times
+    JOIN trip ON trip.trip_id = stop_times.trip_id
+    JOIN route ON route.route_id = trip.route_id
+    WHERE route.route_type = $1 AND trip.service_id = ANY($2::varchar[])
+        AND stop_times.arrival_secs IS NOT NULL AND stop_times.departure_secs IS NOT NULL
+    ORDER BY stop_times.trip_id, stop_times.stop_sequence
+"""
+
+
+async def iter_route_stop_times(date_str: str, route_type: int = 1, prefetch: int = STOP_TIMES_PREFETCH):
+    """Streams the stop times of the trips of a route type running on a date, with a single query.
+
+    The rows are read through a server-side cursor, prefetch rows at a time, so that a whole day is
+    never held in memory.
+
+    Args:
+        date_str: The service date (YYYYMMDD).
+        route_type: The type of the routes (1 for the metro).
+        prefetch: The number of rows fetched per round trip.
+
+    Yields:
+        (trip_id, stop_id, stop_sequence, arrival_secs, departure_secs) records, in trip and stop sequence order.
+    """
+    active_services = await service_calendar.get_active_services(date_str)
+    connection_client = Tortoise.get_connection("default")
+    async with connection_client.acquire_connection() as connection:
+        # Cursors only live inside a transaction
+        async with connection.transaction():
+            async for row in connection.cursor(ROUTE_STOP_TIMES_QUERY, route_type, active_services, prefetch=prefetch):
+                yield row
+
+
 async def get_metro_graph(date: datetime.date):
     """Constructs a weighted graph representing the metro network for a given date.
 
+    The stop times of the day are streamed in trip and stop sequence order and every pair of
+    consecutive stops of a trip becomes an edge, in a single pass.
+
     Args:
         date: The date for which to construct the graph.
 
@@ -15,38 +60,13 @@ async def get_metro_graph(date: datetime.date):
             - keys: stop_id (station IDs)
             - values: a dictionary of neighboring stops and the corresponding travel time.
     """
-
-    # 1. Get all metro routes
-    metro_routes = await Route.filter(route_type=1)  # Route type 1 for Metro
-
-    # 2. Get all trips for metro routes on the specified date
-    trips = []
-    for route in metro_routes:
-        trips_for_route = await Trip.filter(route=route, service__start_date__lte=date.strftime("%Y%m%d"), service__end_date__gte=date.strftime("%Y%m%d")).prefetch_related("stop").all()
-        trips.extend(trips_for_route)
-
-    # 3. Get all stop times for the trips
-    stop_times = []
-    for trip in trips:
-        stop_times_for_trip = await StopTime.filter(trip=trip).order_by("stop_sequence").all()
-        stop_times.extend(stop_times_for_trip)
-
-    # 4. Create the graph
     graph = {}
-    for i in range(len(stop_times) - 1):
-        current_stop_id = stop_times[i].stop.stop_id
-        next_stop_id = stop_times[i + 1].stop.stop_id
-
+    previous_trip_id = previous_stop_id = previous_departure = None
+    async for trip_id, stop_id, _, arrival_secs, departure_secs in iter_route_stop_times(date.strftime("%Y%m%d")):
         # Check if stop_id is a 'StopPoint' to avoid adding connection to a 'StopArea'
-        if "StopPoint" in stop_times[i].stop.stop_id:
-            if current_stop_id not in graph:
-                graph[current_stop_id] = {}
-            # Calculate time difference
-            time_format = "%H:%M:%S"
-            arrival_time = datetime.datetime.strptime(stop_times[i + 1].arrival_time, time_format)
-            departure_time = datetime.datetime.strptime(stop_times[i].departure_time, time_format)
-            travel_time = (arrival_time - departure_time).total_seconds()
-            graph[current_stop_id][next_stop_id] = travel_time
+        if trip_id == previous_trip_id and "StopPoint" in previous_stop_id:
+            graph.setdefault(previous_stop_id, {})[stop_id] = arrival_secs - previous_departure
+        previous_trip_id, previous_stop_id, previous_departure = trip_id, stop_id, departure_secs
     return graph
 
 async def dijkstra(graph: Dict, start: str, end: str, date: datetime.date):
@@ -62,6 +82,7 @@ async def dijkstra(graph: Dict, start: str, end: str, date: datetime.date):
         A dictionary containing:
             - shortest_path: The list of stop_id's representing the shortest path.
             - total_time: The total travel time along the shortest path.
+            - settled_stops: The number of stops settled by the search.
     """
 
     distances = {stop: float("inf") for stop in graph}
@@ -71,9 +92,13 @@ async def dijkstra(graph: Dict, start: str, end: str, date: datetime.date):
     queue = [(0, start)]
     
     predecessors = {}  # Track predecessors for path reconstruction
+    settled = set()
     
     while queue:
         current_distance, current_stop = heapq.heappop(queue)
+        if current_stop in settled:
+            continue
+        settled.add(current_stop)
         
         if current_stop == end:
             break
@@ -94,7 +119,164 @@ async def dijkstra(graph: Dict, start: str, end: str, date: datetime.date):
         current_stop = predecessors.get(current_stop)
     
     shortest_path.reverse()
-    return {"shortest_path": shortest_path, "total_time": total_time}
+    return {"shortest_path": shortest_path, "total_time": total_time, "settled_stops": len(settled)}
+
+
+async def get_stop_coordinates(graph: Dict) -> Dict:
+    """Returns the (lat, lon) of the stops of a graph, by stop_id."""
+    stop_ids = set(graph)
+    for neighbors in graph.values():
+        stop_ids.update(neighbors)
+    rows = await Stop.filter(stop_id__in=list(stop_ids)).values_list("stop_id", "stop_lat", "stop_lon")
+    return {stop_id: (lat, lon) for stop_id, lat, lon in rows if lat is not None and lon is not None}
+
+
+def get_graph_speed_limit(graph: Dict, coordinates: Dict) -> tuple:
+    """Returns the speed of the fastest edge of a graph, in meters per second, and its edges taking no time (see get_speed_limit)."""
+    return get_speed_limit(coordinates, (
+        (stop, neighbor, travel_time)
+        for stop, neighbors in graph.items() for neighbor, travel_time in neighbors.items()
+        if stop in coordinates and neighbor in coordinates
+    ))
+
+
+def get_graph_lower_bounds(graph: Dict, coordinates: Dict, target: str, speed_limit: tuple = None) -> Dict:
+    """Returns a lower bound of the travel time from every stop of the graph to a target stop.
+
+    The bound is the distance to the target at the speed of the fastest edge of the graph, the
+    edges between two places taking no time being shortcuts, so it never overestimates. It is 0
+    everywhere when a stop has no coordinates.
+    """
+    nodes = set(graph)
+    for neighbors in graph.values():
+        nodes.update(neighbors)
+    if target not in coordinates or not nodes <= coordinates.keys():
+        return {}
+    if speed_limit is None:
+        speed_limit = get_graph_speed_limit(graph, coordinates)
+    max_speed, shortcuts = speed_limit
+    return get_lower_bounds(coordinates, target, max_speed, shortcuts)
+
+
+def get_path(predecessors: Dict, end: str) -> List[str]:
+    path = []
+    current_stop = end
+    while current_stop is not None:
+        path.append(current_stop)
+        current_stop = predecessors.get(current_stop)
+    path.reverse()
+    return path
+
+
+async def astar(graph: Dict, start: str, end: str, date: datetime.date, coordinates: Dict, speed_limit: tuple = None):
+    """Computes the shortest path between two stations with A*, guided by their distance to the destination.
+
+    The stops are settled in order of their distance from the start plus a lower bound of their
+    travel time to the destination, so the search heads for it instead of spreading evenly.
+
+    Args:
+        graph: The weighted graph representing the metro network.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The date of the journey
+        coordinates: The (lat, lon) of each stop, from get_stop_coordinates.
+        speed_limit: The highest speed of the network and its shortcuts, from get_graph_speed_limit, measured on the graph if None.
+
+    Returns:
+        The same dictionary as dijkstra.
+    """
+    heuristic = get_graph_lower_bounds(graph, coordinates, end, speed_limit)
+    distances = {start: 0}
+    predecessors = {}
+    settled = set()
+    queue = [(heuristic.get(start, 0), start)]
+
+    while queue:
+        _, current_stop = heapq.heappop(queue)
+        if current_stop in settled:
+            continue
+        settled.add(current_stop)
+        if current_stop == end:
+            break
+
+        for neighbor, travel_time in graph.get(current_stop, {}).items():
+            distance_to_neighbor = distances[current_stop] + travel_time
+            if distance_to_neighbor < distances.get(neighbor, math.inf):
+                distances[neighbor] = distance_to_neighbor
+                predecessors[neighbor] = current_stop
+                heapq.heappush(queue, (distance_to_neighbor + heuristic.get(neighbor, 0), neighbor))
+
+    if end not in settled:
+        return {"shortest_path": [], "total_time": math.inf, "settled_stops": len(settled)}
+    return {"shortest_path": get_path(predecessors, end), "total_time": distances[end], "settled_stops": len(settled)}
+
+
+async def bidirectional_search(graph: Dict, start: str, end: str, date: datetime.date, coordinates: Dict = None, speed_limit: tuple = None):
+    """Computes the shortest path between two stations searching from both ends at once.
+
+    A forward search from the start and a backward search from the destination on the reversed
+    edges grow until their smallest keys add up to the best path found through a stop reached by
+    both. With coordinates, both are guided like astar by the average of the bounds to the
+    destination and from the start, which keeps the two searches consistent with each other.
+
+    Args:
+        graph: The weighted graph representing the metro network.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The date of the journey
+        coordinates: The (lat, lon) of each stop, None for a bidirectional Dijkstra search.
+        speed_limit: The highest speed of the network and its shortcuts, from get_graph_speed_limit, measured on the graph if None.
+
+    Returns:
+        The same dictionary as dijkstra.
+    """
+    reverse_graph = {}
+    for stop, neighbors in graph.items():
+        for neighbor, travel_time in neighbors.items():
+            reverse_graph.setdefault(neighbor, {})[stop] = travel_time
+
+    # The shortcuts of the reversed graph go the other way
+    reverse_speed_limit = (speed_limit[0], [(to_stop, from_stop) for from_stop, to_stop in speed_limit[1]]) if speed_limit else None
+    to_end = get_graph_lower_bounds(graph, coordinates, end, speed_limit) if coordinates else {}
+    from_start = get_graph_lower_bounds(reverse_graph, coordinates, start, reverse_speed_limit) if to_end else {}
+    potentials = {stop: (to_end[stop] - from_start[stop]) / 2 for stop in to_end}
+
+    # One entry per direction: graph, distances, predecessors (successors backward), settled stops, queue, sign of the potentials
+    searches = [
+        (graph, {start: 0}, {}, set(), [(potentials.get(start, 0), start)], 1),
+        (reverse_graph, {end: 0}, {}, set(), [(-potentials.get(end, 0), end)], -1),
+    ]
+    best_time = math.inf
+    meeting_stop = None
+    if start == end:
+        best_time, meeting_stop = 0, start
+
+    while searches[0][4] and searches[1][4] and searches[0][4][0][0] + searches[1][4][0][0] < best_time:
+        # Grows the search with the smallest key
+        direction = 0 if searches[0][4][0][0] <= searches[1][4][0][0] else 1
+        edges, distances, previous, settled, queue, sign = searches[direction]
+        other_distances = searches[1 - direction][1]
+
+        _, current_stop = heapq.heappop(queue)
+        if current_stop in settled:
+            continue
+        settled.add(current_stop)
+
+        for neighbor, travel_time in edges.get(current_stop, {}).items():
+            distance_to_neighbor = distances[current_stop] + travel_time
+            if distance_to_neighbor < distances.get(neighbor, math.inf):
+                distances[neighbor] = distance_to_neighbor
+                previous[neighbor] = current_stop
+                heapq.heappush(queue, (distance_to_neighbor + sign * potentials.get(neighbor, 0), neighbor))
+            if neighbor in other_distances and distances[neighbor] + other_distances[neighbor] < best_time:
+                best_time = distances[neighbor] + other_distances[neighbor]
+                meeting_stop = neighbor
+
+    settled_stops = len(searches[0][3]) + len(searches[1][3])
+    if meeting_stop is None:
+        return {"shortest_path": [], "total_time": math.inf, "settled_stops": settled_stops}
+    path = get_path(searches[0][2], meeting_stop) + get_path(searches[1][2], meeting_stop)[::-1][1:]
+    return {"shortest_path": path, "total_time": best_time, "settled_stops": settled_stops}
 
 async def get_path_by_line(start_stop_id: str, end_stop_id: str, date: datetime.date):
     """Get a path between two stops using a specific metro line
@@ -159,10 +341,7 @@ async def get_path_by_line(start_stop_id: str, end_stop_id: str, date: datetime.
         next_stop_id = path[i + 1]
 
         # Calculate time difference
-        time_format = "%H:%M:%S"
-        arrival_time = datetime.datetime.strptime(path_stop_times[i + 1].arrival_time, time_format)
-        departure_time = datetime.datetime.strptime(path_stop_times[i].departure_time, time_format)
-        travel_time = (arrival_time - departure_time).total_seconds()
+        travel_time = path_stop_times[i + 1].arrival_secs - path_stop_times[i].departure_secs
         total_time += travel_time
 
     return {"shortest_path": path, "total_time": total_time}
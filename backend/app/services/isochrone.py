@@ -0,0 +1,83 @@
+import datetime
+import time
+from bisect import bisect_left
+from fastapi import HTTPException
+from services.csa import INFINITY, scan_connections
+from services.timetable import Timetable
+from utils.colors import colors
+
+# Longest travel time considered when no bands are given, in minutes
+MAX_ISOCHRONE_DURATION = 120
+
+
+def parse_bands(bands: str):
+    """Parses comma separated band limits in minutes ("10,20,30") into a sorted list."""
+    try:
+        limits = sorted({int(band) for band in bands.split(",") if band.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid bands, expected minutes separated by commas")
+    if not limits or limits[0] <= 0:
+        raise HTTPException(status_code=400, detail="Invalid bands, expected minutes separated by commas")
+    return limits
+
+
+def isochrone(timetable: Timetable, start: str, date: datetime.datetime, total_begin_time: time, max_duration: int = MAX_ISOCHRONE_DURATION, bands: list = None):
+    """Computes the earliest arrival at every station from one station, in a single search.
+
+    One connection scan without destination, stopped once the trains leave after the longest
+    travel time considered.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start: The starting station ID.
+        date: The starting date
+        max_duration: The longest travel time considered, in minutes.
+        bands: Optional sorted band limits, in minutes: every station gets the first band it is within.
+
+    Returns:
+        A dictionary containing:
+            - stations: The reachable stations by arrival date, each with its ID, name, arrival
+              date, travel time in seconds and band.
+            - bands: The station IDs of each band, if bands were given.
+            - total_execution_time
+    """
+    begin_time = time.time()
+
+    if start not in timetable.network.stations:
+        raise HTTPException(status_code=404, detail="Station not found")
+    if bands:
+        max_duration = bands[-1]
+
+    departure = timetable.get_seconds(date)
+    limit = departure + max_duration * 60
+    arrivals, _ = scan_connections(timetable, timetable.get_station_stops(start), [], departure, limit)
+
+    reachable = []
+    for station_id, station in timetable.network.stations.items():
+        arrival = min(arrivals[timetable.stop_index[stop.stop_id]] for stop in station.stops)
+        if arrival <= limit:
+            reachable.append((arrival, station))
+    reachable.sort(key=lambda item: item[0])
+
+    stations = []
+    for arrival, station in reachable:
+        duration = arrival - departure
+        stations.append({
+            "station_id": station.station_id,
+            "name": station.station_name,
+            "arrival_date": timetable.get_date(arrival),
+            "duration": duration,
+            "band": bands[bisect_left(bands, duration / 60)] if bands else None
+        })
+
+    print("-> Executed isochrone Connection Scan in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    result = {"stations": stations}
+    if bands:
+        result["bands"] = [
+            {
+                "minutes": band,
+                "stations": [station["station_id"] for station in stations if station["band"] == band]
+            } for band in bands
+        ]
+    result["total_execution_time"] = time.time() - total_begin_time
+    return result
@@ -0,0 +1,297 @@
+import datetime
+import heapq
+import time
+from datetime import timedelta
+from itertools import count
+from fastapi import HTTPException
+from services.lower_bound import TravelTimeBound
+from services.network import MetroSystem, Station, Stops, get_transfer_time
+from utils.colors import colors
+
+
+def get_heuristic(bound: TravelTimeBound, target: Station) -> dict:
+    """Returns the lower bound of the travel time from every station to a target, as timedeltas."""
+    if bound is None:
+        return {}
+    return {station: timedelta(seconds=seconds) for station, seconds in bound.get_times_to(target).items()}
+
+
+def get_stations_or_404(graph: MetroSystem, start: str, end: str):
+    try:
+        return graph.stations[start], graph.stations[end]
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Station not found")
+
+
+def get_path_stops(rides: list):
+    """Returns the stops of a journey with their arrival and departure times, in travel order.
+
+    Args:
+        rides: The stop times boarded along the journey, each one riding to its next stop time.
+    """
+    stops = {}
+    for stop_time in rides:
+        stops.setdefault(stop_time.stop, [stop_time.arrival_time, stop_time.departure_time])
+        next_stop_time = stop_time.next_stop_time
+        stops[next_stop_time.stop] = [next_stop_time.arrival_time, next_stop_time.departure_time]
+    return stops
+
+
+def get_path_stations(start_station: Station, rides: list):
+    stations = [start_station]
+    for stop_time in rides:
+        station = stop_time.next_stop_time.stop.parent_station
+        if station is not stations[-1]:
+            stations.append(station)
+    return stations
+
+
+async def dijkstra(graph: MetroSystem, start: str, end: str, date: datetime.datetime, total_begin_time: time, bound: TravelTimeBound = None):
+    """Computes the earliest arrival path between two stations, leaving at a given date.
+
+    The search is label setting: every stop is settled once, in order of arrival time, and
+    only keeps its best arrival time and the stop time it was reached with. The path is
+    rebuilt from these predecessors once the destination is settled.
+
+    The time window of the graph grows an hour at a time when the next stop to settle is past
+    its end. The settled stops whose next trains could leave after the old end are then
+    scanned again on the new hour.
+
+    With a bound the search is an A*: the stops are settled in order of arrival time plus a lower
+    bound of the time left to the destination, so it turns away from the stops leading away from it.
+    The bound being consistent, each stop is still settled with its earliest arrival.
+
+    Args:
+        graph: The weighted graph representing the metro network.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The starting date
+        bound: The lower bound of the travel times between stations, None for a plain Dijkstra search.
+
+    Returns:
+        A dictionary containing:
+            - Dictionary of the stations used
+            - Dictionary of the stops used
+            - Date at the end of journey
+    """
+    begin_time = time.time()
+
+    start_station, end_station = get_stations_or_404(graph, start, end)
+    heuristic = get_heuristic(bound, end_station)
+    no_time = timedelta(0)
+
+    counter = count()
+    arrivals = {}
+    predecessors = {}  # stop -> stop time boarded to reach it, or the stop it was reached from by a transfer
+    queue = []
+    for stop in start_station.stops:
+        arrivals[stop] = date
+        heapq.heappush(queue, (date + heuristic.get(start_station, no_time), next(counter), stop))
+
+    settled = set()
+    pending = []  # settled stops whose trains were not all read, the window ending too early
+
+    def ride_from(stop):
+        # Trains leaving the stop once we are there, staying on board included
+        stop_times, complete = graph.fastest_stop_times_from(stop, arrivals[stop])
+        if not complete:
+            pending.append(stop)
+        for stop_time in stop_times:
+            next_stop_time = stop_time.next_stop_time
+            next_stop = next_stop_time.stop
+            if next_stop in settled:
+                continue
+            if next_stop not in arrivals or next_stop_time.arrival_time < arrivals[next_stop]:
+                arrivals[next_stop] = next_stop_time.arrival_time
+                predecessors[next_stop] = stop_time
+                heapq.heappush(queue, (next_stop_time.arrival_time + heuristic.get(next_stop.parent_station, no_time), next(counter), next_stop))
+
+    target = None
+    while queue or pending:
+        # The trains after the end of the window arrive after it, their key can't be smaller
+        if pending and (not queue or queue[0][0] >= graph.end_date):
+            if not graph.can_extend():
+                if not queue:
+                    break
+            else:
+                await graph.extend()
+                stops = pending[:]
+                pending.clear()
+                for stop in stops:
+                    ride_from(stop)
+                continue
+
+        _, _, stop = heapq.heappop(queue)
+        if stop in settled:
+            continue
+        settled.add(stop)
+        current_date = arrivals[stop]
+
+        if stop.parent_station is end_station:
+            target = stop
+            break
+
+        # Changement de quai dans la même station
+        for other_stop in stop.parent_station.stops:
+            if other_stop is stop or other_stop in settled:
+                continue
+            transfer_date = current_date + timedelta(seconds=get_transfer_time(stop, other_stop))
+            if other_stop not in arrivals or transfer_date < arrivals[other_stop]:
+                arrivals[other_stop] = transfer_date
+                predecessors[other_stop] = stop
+                heapq.heappush(queue, (transfer_date + heuristic.get(stop.parent_station, no_time), next(counter), other_stop))
+
+        ride_from(stop)
+
+    print("-> Executed Dijkstra's algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    if not target:
+        return {}
+
+    rides = []
+    stop = target
+    while stop in predecessors:
+        predecessor = predecessors[stop]
+        if isinstance(predecessor, Stops):  # transfer from another stop of the station
+            stop = predecessor
+        else:
+            rides.append(predecessor)
+            stop = predecessor.stop
+    rides.reverse()
+
+    return {
+        "stations": [
+            {
+                "name": station.station_name
+            } for station in get_path_stations(start_station, rides)
+        ],
+        "stops": [
+            {
+                "station": stop.parent_station.station_id,
+                "arrival_time": times[0],
+                "departure_time": times[1]
+            } for (stop, times) in get_path_stops(rides).items()
+        ],
+        "arrival_date": arrivals[target],
+        "total_execution_time": time.time() - total_begin_time
+    }
+
+
+async def dijkstra_revert(graph: MetroSystem, start: str, end: str, date: datetime.datetime, total_begin_time: time, bound: TravelTimeBound = None):
+    """Computes the latest departure path between two stations, arriving before a given date.
+
+    Same label setting search as dijkstra, run backward in time from the destination: every
+    stop keeps the latest date at which we can be there and still arrive on time. The time
+    window of the graph grows backward when the next stop to settle is before its beginning.
+    With a bound, the lower bound of the time from the start to each stop guides it as in dijkstra.
+
+        Args:
+            graph: The weighted graph representing the metro network.
+            start: The starting station ID.
+            end: The destination station ID.
+            date: The date of the journey
+            bound: The lower bound of the travel times between stations, None for a plain Dijkstra search.
+
+        Returns:
+            A dictionary containing:
+                - Dictionary of the stations used
+                - Dictionary of the stops used
+                - Time and the end of journey
+        """
+    begin_time = time.time()
+
+    start_station, end_station = get_stations_or_404(graph, start, end)
+    heuristic = get_heuristic(bound, start_station)
+    no_time = timedelta(0)
+
+    counter = count()
+    departures = {}
+    successors = {}  # stop -> stop time boarded there, or the stop it transfers to
+    queue = []  # ordered by time before the arrival date, latest departures first
+    for stop in end_station.stops:
+        departures[stop] = date
+        heapq.heappush(queue, (heuristic.get(end_station, no_time), next(counter), stop))
+
+    settled = set()
+    pending = []  # settled stops whose trains were not all read, the window beginning too late
+
+    def ride_to(stop):
+        # Trains arriving at the stop in time, coming from their previous stop
+        stop_times, complete = graph.latest_stop_times_to(stop, departures[stop])
+        if not complete:
+            pending.append(stop)
+        for stop_time in stop_times:
+            previous_stop_time = stop_time.previous_stop_time
+            previous_stop = previous_stop_time.stop
+            if previous_stop in settled:
+                continue
+            if previous_stop not in departures or previous_stop_time.departure_time > departures[previous_stop]:
+                departures[previous_stop] = previous_stop_time.departure_time
+                successors[previous_stop] = previous_stop_time
+                heapq.heappush(queue, (date - previous_stop_time.departure_time + heuristic.get(previous_stop.parent_station, no_time), next(counter), previous_stop))
+
+    target = None
+    while queue or pending:
+        if pending and (not queue or date - queue[0][0] <= graph.begin_date):
+            if not graph.can_extend():
+                if not queue:
+                    break
+            else:
+                await graph.extend_back()
+                stops = pending[:]
+                pending.clear()
+                for stop in stops:
+                    ride_to(stop)
+                continue
+
+        _, _, stop = heapq.heappop(queue)
+        if stop in settled:
+            continue
+        settled.add(stop)
+        current_date = departures[stop]
+
+        if stop.parent_station is start_station:
+            target = stop
+            break
+
+        for other_stop in stop.parent_station.stops:
+            if other_stop is stop or other_stop in settled:
+                continue
+            transfer_date = current_date - timedelta(seconds=get_transfer_time(other_stop, stop))
+            if other_stop not in departures or transfer_date > departures[other_stop]:
+                departures[other_stop] = transfer_date
+                successors[other_stop] = stop
+                heapq.heappush(queue, (date - transfer_date + heuristic.get(stop.parent_station, no_time), next(counter), other_stop))
+
+        ride_to(stop)
+
+    print("-> Executed Dijkstra's reverse algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    if not target:
+        return {}
+
+    rides = []
+    stop = target
+    while stop in successors:
+        successor = successors[stop]
+        if isinstance(successor, Stops):  # transfer to another stop of the station
+            stop = successor
+        else:
+            rides.append(successor)
+            stop = successor.next_stop_time.stop
+
+    # Les stations sont listées depuis l'arrivée, comme le parcours de la recherche
+    return {
+            "stations": [
+                {
+                    "name": station.station_name
+                } for station in reversed(get_path_stations(start_station, rides))
+            ],
+            "stops": [
+                {
+                    "station": stop.parent_station.station_id,
+                    "arrival_time": times[0],
+                    "departure_time": times[1]
+                } for (stop, times) in get_path_stops(rides).items()
+            ],
+            "departure_date": departures[target],
+            "total_execution_time": time.time() - total_begin_time
+        }
@@ -0,0 +1,158 @@
+import heapq
+import math
+import os
+from utils.colors import colors
+
+# Mean radius of the Earth, in meters
+EARTH_RADIUS = 6371000
+
+# Speed of the fastest train assumed by the A* searches when there was no ride to measure it on,
+# in meters per second (80 km/h)
+MAX_METRO_SPEED = float(os.getenv("MAX_METRO_SPEED", 80 / 3.6))
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Returns the great-circle distance between two points given in degrees, in meters."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def get_speed_limit(coordinates: dict, rides) -> tuple:
+    """Returns the highest speed of some rides between nodes, and the rides covering a distance in no time.
+
+    A ride covering a distance in no time (times rounded to the minute) has no speed: it is left
+    out of the speed limit and returned as a shortcut, see get_lower_bounds.
+
+    Args:
+        coordinates: The (lat, lon) of each node.
+        rides: (from node, to node, travel time in seconds) tuples, between nodes with coordinates.
+
+    Returns:
+        The highest speed in meters per second, 0 if no ride takes time, and the list of
+        (from node, to node) shortcuts.
+    """
+    max_speed = 0
+    shortcuts = []
+    for from_node, to_node, travel_time in rides:
+        distance = haversine(*coordinates[from_node], *coordinates[to_node])
+        if travel_time > 0:
+            max_speed = max(max_speed, distance / travel_time)
+        elif distance > 0:
+            shortcuts.append((from_node, to_node))
+    return max_speed, shortcuts
+
+
+def get_lower_bounds(coordinates: dict, target, max_speed: float, shortcuts=()) -> dict:
+    """Returns for every node a lower bound of its travel time to a target: their distance at max_speed.
+
+    The bound is admissible and consistent as long as no ride between two nodes is faster than
+    max_speed, as the distance follows the triangle inequality. The rides taking no time are
+    shortcuts: the bound of a node is then its shortest time to the target at max_speed, taking
+    shortcuts on the way. It is a distance in a graph where every ride costs at most its travel
+    time, so it stays admissible and consistent.
+
+    Args:
+        coordinates: The (lat, lon) of each node.
+        target: The target node.
+        max_speed: The highest speed of the network, in meters per second, MAX_METRO_SPEED if 0.
+        shortcuts: The (from node, to node) rides taking no time.
+
+    Returns:
+        The lower bound of each node, in seconds.
+    """
+    max_speed = max_speed or MAX_METRO_SPEED
+
+    def get_time(node, other):
+        return haversine(*coordinates[node], *coordinates[other]) / max_speed
+
+    bounds = {node: get_time(node, target) for node in coordinates}
+    if not shortcuts:
+        return bounds
+
+    # Shortest time from the ends of the shortcuts to the target, by a Dijkstra search between them
+    ends = {node for shortcut in shortcuts for node in shortcut}
+    times = {node: bounds[node] for node in ends}
+    queue = [(time_left, node) for node, time_left in times.items()]
+    heapq.heapify(queue)
+    settled = set()
+    while queue:
+        time_left, node = heapq.heappop(queue)
+        if node in settled:
+            continue
+        settled.add(node)
+        for other in ends - settled:
+            other_time = get_time(other, node) + time_left
+            if other_time < times[other]:
+                times[other] = other_time
+                heapq.heappush(queue, (other_time, other))
+        for from_node, to_node in shortcuts:
+            if to_node == node and time_left < times[from_node]:
+                times[from_node] = time_left
+                heapq.heappush(queue, (time_left, from_node))
+
+    starts = {from_node for from_node, _ in shortcuts}
+    for node in coordinates:
+        bounds[node] = min(bounds[node], min(get_time(node, start) + times[start] for start in starts))
+    return bounds
+
+
+def get_timetable_speed_limit(timetable) -> tuple:
+    """Returns the speed of the fastest connection of a timetable between the stations of its stops, and its shortcuts.
+
+    It is computed once per timetable, on the fastest connection between each pair of stops, see
+    get_speed_limit. The connections covering a distance in no time are reported, the A* searches
+    being less guided near them.
+    """
+    if timetable.speed_limit is None:
+        fastest = {}
+        for dep_stop, arr_stop, dep_time, arr_time in zip(timetable.dep_stop, timetable.arr_stop, timetable.dep_time, timetable.arr_time):
+            key = (dep_stop, arr_stop)
+            if arr_time - dep_time < fastest.get(key, math.inf):
+                fastest[key] = arr_time - dep_time
+
+        rides = {}
+        for (dep_stop, arr_stop), travel_time in fastest.items():
+            from_station = timetable.get_stop(dep_stop).parent_station
+            to_station = timetable.get_stop(arr_stop).parent_station
+            if from_station.coordinates and to_station.coordinates:
+                key = (from_station, to_station)
+                rides[key] = min(travel_time, rides.get(key, math.inf))
+        coordinates = {station: station.coordinates for key in rides for station in key}
+        timetable.speed_limit = get_speed_limit(coordinates, ((from_station, to_station, travel_time) for (from_station, to_station), travel_time in rides.items()))
+
+        shortcuts = timetable.speed_limit[1]
+        if shortcuts:
+            print(colors.RED + "* " + str(len(shortcuts)) + " rides of " + timetable.service_date.strftime("%Y%m%d") + " cover a distance in no time, the A* bound takes them as shortcuts: "
+                  + ", ".join(from_station.station_id + " -> " + to_station.station_id for from_station, to_station in shortcuts[:5]) + colors.RESET)
+    return timetable.speed_limit
+
+
+class TravelTimeBound:
+    """Lower bound of the travel time between the stations of a network, used to guide the A* searches.
+
+    The stations are placed at their barycenter: the transfers inside a station don't move on the
+    map, and a ride between two stations can't be faster than max_speed, unless it is one of the
+    shortcuts taking no time (see get_lower_bounds). If a station has no coordinates, the bound is
+    0 everywhere: the searches then run as plain Dijkstra.
+    """
+
+    def __init__(self, network, max_speed: float, shortcuts=()):
+        self.max_speed = max_speed
+        self.shortcuts = list(shortcuts)
+        self.coordinates = {station: station.coordinates for station in network.stations.values()}
+        if not all(self.coordinates.values()):
+            self.coordinates = {}
+
+    def get_times_to(self, target) -> dict:
+        """Returns the lower bound of the travel time from every station to a target station, in seconds."""
+        if not self.coordinates:
+            return {}
+        return get_lower_bounds(self.coordinates, target, self.max_speed, self.shortcuts)
+
+    def stats(self) -> dict:
+        return {
+            "max_speed": self.max_speed or MAX_METRO_SPEED,
+            "shortcuts": len(self.shortcuts),
+            "guided": bool(self.coordinates),
+        }
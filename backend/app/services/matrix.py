@@ -0,0 +1,138 @@
+import asyncio
+import datetime
+import io
+import math
+import os
+from array import array
+import numpy as np
+from fastapi import HTTPException
+from services.csa import INFINITY, scan_connections
+from services.search_pool import TimetableProcesses, get_worker_timetable
+from services.timetable import Timetable
+
+# Number of worker processes computing the rows of a matrix
+MATRIX_WORKERS = int(os.getenv("MATRIX_WORKERS", os.cpu_count() or 1))
+
+# Longest travel time considered by default, in minutes
+MAX_MATRIX_DURATION = 180
+
+# Travel time of the unreachable destinations
+UNREACHABLE = -1
+
+
+def get_search_timetable(timetable: Timetable) -> Timetable:
+    """Returns a copy of a timetable holding only the arrays used by scan_connections.
+
+    The copy has no network, route patterns or backward index, so it is cheap to send to the
+    worker processes of a one-off build: the arrays are pickled as raw bytes. Arrays mapped from a
+    snapshot are copied, memoryviews can't be pickled.
+    """
+    search_timetable = Timetable(timetable.service_date, None)
+    search_timetable.stop_ids = timetable.stop_ids
+    search_timetable.trip_ids = timetable.trip_ids
+    for name in ("dep_stop", "arr_stop", "dep_time", "arr_time", "trip", "footpath_start", "footpath_to", "footpath_time"):
+        values = getattr(timetable, name)
+        if isinstance(values, memoryview):
+            values = array("i", values.tobytes())
+        setattr(search_timetable, name, values)
+    return search_timetable
+
+
+def get_matrix_stations(timetable: Timetable, station_ids: list):
+    """Returns the stop numbers of each station, all the stations of the network if none is given."""
+    if not station_ids:
+        station_ids = list(timetable.network.stations)
+    try:
+        return station_ids, [timetable.get_station_stops(station_id) for station_id in station_ids]
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Station not found: {e.args[0]}")
+
+
+def compute_travel_times(timetable: Timetable, start_stops: list, destinations: list, departure: int, max_duration: int):
+    """Computes the travel times from one station to every destination, in seconds.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start_stops: The stop numbers of the origin.
+        destinations: The stop numbers of each destination.
+        departure: The departure time, in seconds since the start of the service day.
+        max_duration: The longest travel time considered, in seconds.
+
+    Returns:
+        A list with the travel time of each destination, UNREACHABLE past max_duration.
+    """
+    arrivals, _ = scan_connections(timetable, start_stops, [], departure, departure + max_duration)
+    row = []
+    for stops in destinations:
+        arrival = min(arrivals[stop] for stop in stops)
+        row.append(arrival - departure if arrival != INFINITY and arrival - departure <= max_duration else UNREACHABLE)
+    return row
+
+
+def _compute_rows(path: str, origins: list, destinations: list, departure: int, max_duration: int):
+    timetable = get_worker_timetable(path)
+    return [compute_travel_times(timetable, start_stops, destinations, departure, max_duration) for start_stops in origins]
+
+
+class MatrixPool:
+    """Pool of worker processes computing the rows of the travel time matrices.
+
+    The workers map the timetables from files, as the ones of SearchPool do (see
+    TimetableProcesses): only the stop numbers of the origins and destinations go through the
+    pipes, and the workers serve the matrices of every service day.
+    """
+
+    def __init__(self, max_workers: int = MATRIX_WORKERS):
+        self.max_workers = max_workers
+        self.processes = TimetableProcesses(max_workers)
+
+    def start(self, network):
+        """Starts the worker processes ahead of the first matrix."""
+        self.processes.start(network)
+
+    def shutdown(self):
+        """Stops the workers, the rows not computed yet are cancelled. Only called when the app stops."""
+        self.processes.shutdown()
+
+    async def rows(self, timetable: Timetable, origins: list, destinations: list, date: datetime.datetime, max_duration: int = MAX_MATRIX_DURATION):
+        """Computes a travel time matrix, one row per origin, in the order of the origins.
+
+        The origins are split into chunks spread over the workers, and the rows are yielded as
+        soon as their chunk is done.
+
+        Args:
+            timetable: The flat timetable of the service day.
+            origins: The stop numbers of each origin.
+            destinations: The stop numbers of each destination.
+            date: The departure date.
+            max_duration: The longest travel time considered, in minutes.
+
+        Yields:
+            The travel times of each origin to the destinations, in seconds.
+        """
+        loop = asyncio.get_running_loop()
+        executor, path = self.processes.acquire(timetable)
+        departure = timetable.get_seconds(date)
+
+        # A few chunks per worker, so that the workers finishing early take the next ones
+        chunk_size = max(math.ceil(len(origins) / (self.max_workers * 4)), 1)
+        futures = [
+            loop.run_in_executor(executor, _compute_rows, path, origins[index:index + chunk_size], destinations, departure, max_duration * 60)
+            for index in range(0, len(origins), chunk_size)
+        ]
+        try:
+            for future in futures:
+                for row in await future:
+                    yield row
+        finally:
+            # The client went away: only the chunks of this matrix are dropped
+            for future in futures:
+                future.cancel()
+            self.processes.release(path)
+
+
+def matrix_to_npy(rows: list) -> bytes:
+    """Encodes the rows of a travel time matrix as a .npy file of int32."""
+    buffer = io.BytesIO()
+    np.save(buffer, np.array(rows, dtype=np.int32).reshape(len(rows), -1))
+    return buffer.getvalue()
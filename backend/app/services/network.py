@@ -0,0 +1,211 @@
+import asyncio
+import datetime
+import time
+from fastapi import HTTPException
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+# Time to change platform inside a station when the transfers table has no entry, in seconds
+DEFAULT_TRANSFER_TIME = 2
+
+
+class StaticNetwork:
+    def __init__(self):
+        self.stations = {}
+        self.stops = {}
+        self.routes = {}
+
+
+class MetroSystem:
+    """The stations of the network, with a view over the stop times of a time window.
+
+    The stop times are not copied: the window (a TimetableWindow) reads them from the compact
+    timetable slices when a search asks for the stop times of a stop, and loads the next hours
+    when the search grows it.
+
+    Attributes:
+        loop: The event loop the window loads its stop times on, when the search runs on the event
+            loop of another thread (set by SearchPool.run_graph_search).
+    """
+
+    def __init__(self, network: StaticNetwork = None, window=None):
+        self.network = network
+        self.stations = network.stations if network else {}
+        self.window = window
+        self.loop = None
+
+    async def run_on_loop(self, coroutine):
+        if self.loop is None or self.loop is asyncio.get_running_loop():
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self.loop))
+
+    @property
+    def begin_date(self) -> datetime.datetime:
+        return self.window.begin_date
+
+    @property
+    def end_date(self) -> datetime.datetime:
+        return self.window.end_date
+
+    def can_extend(self) -> bool:
+        return self.window is not None and self.window.can_extend()
+
+    async def extend(self):
+        """Loads the next hour of stop times."""
+        await self.run_on_loop(self.window.extend())
+
+    async def extend_back(self):
+        """Loads the previous hour of stop times."""
+        await self.run_on_loop(self.window.extend_back())
+
+    def stop_times_at(self, stop):
+        """Returns the stop times of the current time window passing at the given stop."""
+        return self.window.stop_times_at(stop) if self.window else []
+
+    def fastest_stop_times_from(self, stop, leaving_after: datetime.datetime):
+        """Returns, for each next stop, the stop time leaving the given stop after a date that reaches it first.
+
+        Returns:
+            The stop times, and False if a train leaving after the end of the window could reach a next stop first.
+        """
+        return self.window.fastest_stop_times_from(stop, leaving_after) if self.window else ([], True)
+
+    def latest_stop_times_to(self, stop, arriving_before: datetime.datetime):
+        """Returns, for each previous stop, the stop time arriving at the given stop before a date that leaves it last.
+
+        Returns:
+            The stop times, and False if a train leaving before the beginning of the window could leave a previous stop last.
+        """
+        return self.window.latest_stop_times_to(stop, arriving_before) if self.window else ([], True)
+
+
+class Routes:
+    def __init__(self, route_id: str, route_name: str):
+        self.route_id = route_id
+        self.route_name = route_name
+
+
+class Station:
+    def __init__(self, station_id: str, station_name: str, coordinates: tuple = None):
+        self.station_id = station_id
+        self.station_name = station_name
+        self.coordinates = coordinates  # (lat, lon) of the barycenter of the stops
+        self.routes = {}
+        self.stops = []
+
+    def __str__(self):
+        return str({
+            "name": self.station_name,
+            "station_id": self.station_id
+        })
+
+
+class Stops:
+    def __init__(self, stop_id: str, stop_name: str, station: Station):
+        self.stop_id = stop_id
+        self.stop_name = stop_name
+        self.parent_station = station
+        self.transfers = {}
+
+    def __str__(self):
+        return str({
+            "stop_id": self.stop_id,
+            "stop_name": self.stop_name,
+        })
+
+
+class Trips:
+    def __init__(self, trip_id: str, route: Routes, direction: int):
+        self.trip_id = trip_id
+        self.direction_id = direction
+        self.route = route
+        self.head_stop = None
+
+
+def get_transfer_time(from_stop: Stops, to_stop: Stops):
+    return from_stop.transfers.get(to_stop, DEFAULT_TRANSFER_TIME)
+
+
+def build_static_network(route_fetch: list, stations_fetch: list, transfers: list):
+    """Builds the time independent part of the metro network.
+
+    Args:
+        route_fetch: The routes, as returned by the /routes endpoint.
+        stations_fetch: The stations, as returned by the /stations endpoint.
+        transfers: The transfers, as returned by the /transfers endpoint.
+
+    Returns:
+        A StaticNetwork holding every station, stop and route, with the transfers between stops.
+    """
+    network = StaticNetwork()
+    routes_by_id = {route["route_id"]: route for route in route_fetch}
+
+    for station in stations_fetch:
+        if station["parent_station"] in network.stations:
+            continue
+
+        coordinates = (station["barycenter_lat"], station["barycenter_lon"]) if station.get("barycenter_lat") is not None else None
+        current_station = Station(station["parent_station"], station["stop_name"], coordinates)
+        network.stations[current_station.station_id] = current_station
+
+        for route in station["route_ids"]:
+            try:
+                current_route = network.routes[route]
+            except KeyError:
+                try:
+                    corresponding_route = routes_by_id[route]
+                except KeyError:
+                    raise HTTPException(status_code=404, detail=f"Route id not found in fetched data : {route}")
+
+                current_route = Routes(route, corresponding_route["route_long_name"])
+                network.routes[route] = current_route
+
+            current_station.routes[route] = current_route
+
+        for stop in station["stops"]:
+            current_stop = Stops(stop.stop_id, stop.stop_name, current_station)
+            network.stops[current_stop.stop_id] = current_stop
+            current_station.stops.append(current_stop)
+
+    for transfer in transfers:
+        try:
+            stop1 = network.stops[transfer["from_stop_id"]]
+            stop2 = network.stops[transfer["to_stop_id"]]
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Stop not found while adding transfers.")
+
+        stop1.transfers[stop2] = transfer["min_transfer_time"]
+        stop2.transfers[stop1] = transfer["min_transfer_time"]
+
+    return network
+
+
+class StaticNetworkCache:
+    """Keeps the static network in memory and shares it read-only between requests.
+
+    The network is built on first use and rebuilt only when the network version changes,
+    or after an explicit call to invalidate().
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.network = None
+        self.version = None
+        self.lock = asyncio.Lock()
+
+    async def get(self) -> StaticNetwork:
+        version = get_network_version()
+        if self.network is not None and self.version == version:
+            return self.network
+
+        # Only one request rebuilds the network, the others wait for it
+        async with self.lock:
+            if self.network is None or self.version != version:
+                begin_time = time.time()
+                self.network = await self.loader()
+                self.version = version
+                print("* Built static network in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+        return self.network
+
+    def invalidate(self):
+        self.network = None
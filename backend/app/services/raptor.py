@@ -0,0 +1,213 @@
+import datetime
+import time
+from array import array
+from bisect import bisect_left
+from services.csa import INFINITY, format_journey, get_station_stops_or_404
+from services.timetable import Timetable
+from utils.colors import colors
+
+# Default maximum number of transfers of a journey
+MAX_TRANSFERS = 5
+
+
+class RoutePattern:
+    """Trips sharing the same sequence of stops, none of them overtaking another.
+
+    Attributes:
+        stops: The stop numbers of the pattern, in order.
+        trips: The trip numbers, sorted by departure.
+        first_connections: The first connection of each trip.
+        arrivals / departures: One array per stop of the pattern, with the time of each trip.
+    """
+
+    def __init__(self, stops: tuple):
+        self.stops = stops
+        self.trips = []
+        self.first_connections = []
+        self.arrivals = [array("i") for _ in stops]
+        self.departures = [array("i") for _ in stops]
+
+    def can_append(self, departures: list):
+        return not self.trips or all(departure >= self.departures[position][-1] for position, departure in enumerate(departures))
+
+    def append(self, trip: int, first_connection: int, arrivals: list, departures: list):
+        self.trips.append(trip)
+        self.first_connections.append(first_connection)
+        for position in range(len(self.stops)):
+            self.arrivals[position].append(arrivals[position])
+            self.departures[position].append(departures[position])
+
+
+def get_route_patterns(timetable: Timetable):
+    """Groups the trips of a timetable into route patterns, built once per timetable.
+
+    Returns:
+        The list of RoutePattern, and for each stop number the (pattern, position) pairs serving it.
+    """
+    if timetable.patterns is not None:
+        return timetable.patterns
+
+    # First connection of each trip, the others follow with next_connection
+    first_connections = {}
+    for connection in range(len(timetable) - 1, -1, -1):
+        first_connections[timetable.trip[connection]] = connection
+
+    trips = []
+    for trip, first_connection in first_connections.items():
+        stops, arrivals, departures = [timetable.dep_stop[first_connection]], [timetable.dep_arrival[first_connection]], [timetable.dep_time[first_connection]]
+        connection = first_connection
+        while connection >= 0:
+            stops.append(timetable.arr_stop[connection])
+            arrivals.append(timetable.arr_time[connection])
+            departures.append(timetable.arr_departure[connection])
+            connection = timetable.next_connection[connection]
+        trips.append((departures[0], trip, first_connection, tuple(stops), arrivals, departures))
+    trips.sort()
+
+    patterns = []
+    patterns_by_stops = {}
+    for _, trip, first_connection, stops, arrivals, departures in trips:
+        candidates = patterns_by_stops.setdefault(stops, [])
+        for pattern in candidates:
+            if pattern.can_append(departures):
+                break
+        else:
+            pattern = RoutePattern(stops)
+            candidates.append(pattern)
+            patterns.append(pattern)
+        pattern.append(trip, first_connection, arrivals, departures)
+
+    stop_patterns = [[] for _ in timetable.stop_ids]
+    for index, pattern in enumerate(patterns):
+        for position, stop in enumerate(pattern.stops):
+            stop_patterns[stop].append((index, position))
+
+    timetable.patterns = (patterns, stop_patterns)
+    return timetable.patterns
+
+
+def get_ride_connections(timetable: Timetable, pattern: RoutePattern, trip_index: int, board: int, alight: int):
+    connection = pattern.first_connections[trip_index]
+    for _ in range(board):
+        connection = timetable.next_connection[connection]
+
+    connections = []
+    for _ in range(alight - board):
+        connections.append(connection)
+        connection = timetable.next_connection[connection]
+    return connections
+
+
+def raptor(timetable: Timetable, start: str, end: str, date: datetime.datetime, total_begin_time: time, max_transfers: int = MAX_TRANSFERS):
+    """Computes the Pareto-optimal journeys between two stations with the RAPTOR algorithm.
+
+    Round k scans, route pattern by route pattern, the stops improved at round k - 1, so after
+    round k every stop holds its earliest arrival with at most k trips. A journey is kept when
+    it arrives earlier than every journey with fewer transfers.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The starting date
+        max_transfers: The maximum number of transfers of a journey.
+
+    Returns:
+        A dictionary containing:
+            - journeys: The Pareto-optimal journeys, by increasing number of transfers, each with
+              its number of transfers, stations, stops and arrival date.
+            - total_execution_time
+    """
+    begin_time = time.time()
+
+    start_stops = get_station_stops_or_404(timetable, start)
+    end_stops = get_station_stops_or_404(timetable, end)
+    departure = timetable.get_seconds(date)
+    patterns, stop_patterns = get_route_patterns(timetable)
+
+    best = [INFINITY] * len(timetable.stop_ids)
+    labels = [[INFINITY] * len(timetable.stop_ids)]
+    parents = [[None] * len(timetable.stop_ids)]  # (pattern, trip index, boarding position, alighting position) or stop walked from
+    for stop in start_stops:
+        labels[0][stop] = best[stop] = departure
+    marked = set(start_stops)
+
+    for _ in range(max_transfers + 1):
+        previous_labels = labels[-1]
+        current_labels = list(previous_labels)
+        current_parents = [None] * len(timetable.stop_ids)
+        labels.append(current_labels)
+        parents.append(current_parents)
+
+        # Each pattern is scanned from its first marked stop
+        queue = {}
+        for stop in marked:
+            for index, position in stop_patterns[stop]:
+                if position < queue.get(index, len(patterns[index].stops)):
+                    queue[index] = position
+        marked = set()
+
+        end_arrival = min(best[stop] for stop in end_stops)
+        for index, first_position in queue.items():
+            pattern = patterns[index]
+            trip_index = None
+            board = None
+            for position in range(first_position, len(pattern.stops)):
+                stop = pattern.stops[position]
+                if trip_index is not None:
+                    arrival = pattern.arrivals[position][trip_index]
+                    if arrival < best[stop] and arrival < end_arrival:
+                        current_labels[stop] = best[stop] = arrival
+                        current_parents[stop] = (pattern, trip_index, board, position)
+                        marked.add(stop)
+
+                # Catch an earlier trip of the pattern if the stop was reached in time at the previous round
+                if previous_labels[stop] < INFINITY and (trip_index is None or previous_labels[stop] <= pattern.departures[position][trip_index]):
+                    earliest = bisect_left(pattern.departures[position], previous_labels[stop])
+                    if earliest < len(pattern.trips) and (trip_index is None or earliest < trip_index):
+                        trip_index = earliest
+                        board = position
+
+        for stop in list(marked):
+            for other_stop, transfer_time in timetable.footpaths(stop):
+                arrival = current_labels[stop] + transfer_time
+                if arrival < best[other_stop]:
+                    current_labels[other_stop] = best[other_stop] = arrival
+                    current_parents[other_stop] = stop
+                    marked.add(other_stop)
+
+        if not marked:
+            break
+
+    journeys = []
+    end_arrival = INFINITY
+    for rounds in range(1, len(labels)):
+        target = min(end_stops, key=lambda stop: labels[rounds][stop])
+        if labels[rounds][target] >= end_arrival:
+            continue
+        end_arrival = labels[rounds][target]
+
+        legs = []
+        stop = target
+        for current_round in range(rounds, 0, -1):
+            if isinstance(parents[current_round][stop], int):  # transfer from another stop of the station
+                stop = parents[current_round][stop]
+            if parents[current_round][stop] is None:  # reached at an earlier round, with fewer trips
+                continue
+            pattern, trip_index, board, alight = parents[current_round][stop]
+            legs.append(get_ride_connections(timetable, pattern, trip_index, board, alight))
+            stop = pattern.stops[board]
+
+        stations, stops = format_journey(timetable, start, [connection for leg in reversed(legs) for connection in leg])
+        journeys.append({
+            "transfers": max(len(legs) - 1, 0),
+            "stations": stations,
+            "stops": stops,
+            "arrival_date": timetable.get_date(end_arrival),
+        })
+
+    print("-> Executed RAPTOR algorithm in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return {
+        "journeys": journeys,
+        "total_execution_time": time.time() - total_begin_time
+    }
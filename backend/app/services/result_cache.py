@@ -0,0 +1,192 @@
+import datetime
+import os
+import pickle
+import time
+from collections import OrderedDict
+from utils.network_version import get_network_version
+
+# Where the results are kept: "memory" for each API worker, "redis" to share them between workers
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+
+# Redis server of the "redis" backend (a local redis-server or any server speaking its protocol)
+RESULT_CACHE_REDIS_URL = os.getenv("RESULT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Length of the time buckets the query dates are rounded to, in seconds
+RESULT_CACHE_BUCKET = int(os.getenv("RESULT_CACHE_BUCKET", 60))
+
+# Time a result is kept, in seconds
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 300))
+
+# Results kept by the "memory" backend, the least recently used ones are evicted first
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 10000))
+
+
+class MemoryResultBackend:
+    """LRU dictionary of results with an expiration date, in the memory of the API worker."""
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE, ttl: int = RESULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value):
+        self.entries[key] = (time.time() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisResultBackend:
+    """Results shared by the API workers through Redis, pickled, expiring after the TTL.
+
+    The size is bounded by the server: run it with a maxmemory and the allkeys-lru policy. If the
+    server can't be reached, the requests are computed as if the cache was empty.
+    """
+
+    def __init__(self, url: str = RESULT_CACHE_REDIS_URL, ttl: int = RESULT_CACHE_TTL):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise ImportError("The redis result cache requires the redis package (pip install redis)")
+        self.redis = redis
+        self.client = redis.asyncio.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, key: str):
+        try:
+            value = await self.client.get(key)
+        except self.redis.RedisError as e:
+            print(f"Result cache unavailable: {e}")
+            return None
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key: str, value):
+        try:
+            await self.client.set(key, pickle.dumps(value), ex=self.ttl)
+        except self.redis.RedisError as e:
+            print(f"Result cache unavailable: {e}")
+
+    def clear(self):
+        # The keys hold the network version, the ones of the previous versions just expire
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def get_result_backend(name: str = RESULT_CACHE_BACKEND):
+    if name == "memory":
+        return MemoryResultBackend()
+    if name == "redis":
+        return RedisResultBackend()
+    raise ValueError(f"Unknown result cache backend: {name}")
+
+
+class ResultCache:
+    """Cache of the search results, by request and time bucket of the query date.
+
+    The queries of a same bucket share an entry, holding the date of the query it was computed for.
+    A journey is only returned for a query it answers exactly: a forward journey computed from an
+    earlier date which doesn't leave before the requested date (an earlier date can only find
+    earlier or equal arrivals), and symmetrically a backward journey computed for a later date which
+    doesn't arrive after it. Otherwise the journey is computed again and replaces the entry. The
+    other results are only returned for the date they were computed for, which callers can round
+    down to the start of its bucket (get_bucket_date) to share them across the bucket.
+
+    The keys hold the network version: a new version clears the memory backend, and the entries of
+    the older versions are no longer read from Redis.
+    """
+
+    def __init__(self, backend=None, bucket: int = RESULT_CACHE_BUCKET):
+        self.backend = backend if backend is not None else get_result_backend()
+        self.bucket = bucket
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get_key(self, key: tuple, date: datetime.datetime) -> str:
+        version = get_network_version()
+        if version != self.version:
+            self.backend.clear()
+            self.version = version
+        bucket = int(date.timestamp()) // self.bucket
+        return f"result:{version}:" + ":".join(str(part) for part in key) + f":{bucket}"
+
+    def get_bucket_date(self, date: datetime.datetime) -> datetime.datetime:
+        """Returns the first date of the time bucket of a date, for the results computed once per bucket."""
+        return datetime.datetime.fromtimestamp(int(date.timestamp()) // self.bucket * self.bucket)
+
+    async def get(self, key: tuple, date: datetime.datetime):
+        """Returns the result stored for the time bucket of a date if it was computed for that exact date, or None.
+
+        For the results depending on every stop time after the date (a spanning tree), an entry of
+        another date of the bucket can differ.
+        """
+        entry = await self.backend.get(self.get_key(key, date))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        computed_date, result = entry
+        if computed_date != date:
+            self.stale += 1
+            return None
+        self.hits += 1
+        return result
+
+    async def set(self, key: tuple, date: datetime.datetime, result):
+        await self.backend.set(self.get_key(key, date), (date, result))
+
+    async def get_journey(self, key: tuple, date: datetime.datetime, forward: bool):
+        """Returns the journey stored for the time bucket of a date if it is the one a search at that date would find.
+
+        Args:
+            key: The request, without its date.
+            date: The departure date if forward, else the arrival date.
+            forward: The direction of the search.
+        """
+        entry = await self.backend.get(self.get_key(key, date))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        computed_date, journey = entry
+        stops = journey.get("stops") if journey else None
+        if forward:
+            valid = computed_date <= date and (not stops or stops[0]["departure_time"] >= date)
+        else:
+            valid = computed_date >= date and (not stops or stops[-1]["arrival_time"] <= date)
+        if not valid:
+            self.stale += 1
+            return None
+        self.hits += 1
+        return journey
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "bucket": self.bucket,
+            "ttl": self.backend.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
@@ -0,0 +1,263 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
+from services.network import StaticNetwork
+from services.snapshot import Snapshot, write_snapshot
+from services.timetable import Timetable
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+# Where the searches run: "thread" for a pool of threads, "process" to also run the timetable
+# searches in forked worker processes, "inline" to run them on the event loop
+SEARCH_EXECUTOR = os.getenv("SEARCH_EXECUTOR", "thread")
+
+# Number of threads, and of worker processes in "process" mode
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", os.cpu_count() or 1))
+
+# Searches queued or running at the same time, the next ones are answered 503
+SEARCH_QUEUE_LIMIT = int(os.getenv("SEARCH_QUEUE_LIMIT", 32))
+
+# Longest time a search waits for a free worker, in seconds, before it is answered 503
+SEARCH_QUEUE_TIMEOUT = float(os.getenv("SEARCH_QUEUE_TIMEOUT", 10))
+
+# Timetables each worker process keeps mapped, and the API process keeps written for them
+SEARCH_PROCESS_TIMETABLES = int(os.getenv("SEARCH_PROCESS_TIMETABLES", 2))
+
+# Where the timetables are written for the worker processes, in memory when /dev/shm exists
+SEARCH_TIMETABLE_DIR = os.getenv("SEARCH_TIMETABLE_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+# Static network of the current worker process, received once when the process starts
+_worker_network = None
+
+# Timetables mapped by the current worker process, by file
+_worker_timetables = OrderedDict()
+
+
+class SearchQueueTimeout(Exception):
+    pass
+
+
+class SearchError(Exception):
+    """An HTTPException raised by a search in a worker process, which can't be unpickled as it is."""
+
+    def __init__(self, status_code: int, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _run_search(function, queued_at: float, args: tuple):
+    if time.time() - queued_at > SEARCH_QUEUE_TIMEOUT:
+        raise SearchQueueTimeout()
+    try:
+        return function(*args)
+    except HTTPException as e:
+        raise SearchError(e.status_code, e.detail)
+
+
+def _init_worker(network: StaticNetwork):
+    global _worker_network
+    _worker_network = network
+
+
+def get_worker_timetable(path: str) -> Timetable:
+    """Returns the timetable written by TimetableProcesses in a file, mapped by the current worker process on first use."""
+    try:
+        timetable = _worker_timetables.pop(path)
+    except KeyError:
+        snapshot = Snapshot(path)
+        timetable = snapshot.get_timetable(snapshot.service_dates[0])
+        timetable.network = _worker_network
+    _worker_timetables[path] = timetable
+    while len(_worker_timetables) > SEARCH_PROCESS_TIMETABLES:
+        _worker_timetables.popitem(last=False)
+    return timetable
+
+
+def _run_timetable_search(function, path: str, queued_at: float, args: tuple):
+    return _run_search(function, queued_at, (get_worker_timetable(path),) + args)
+
+
+def _run_graph_search(function, queued_at: float, args: tuple):
+    return _run_search(lambda *search_args: asyncio.run(function(*search_args)), queued_at, args)
+
+
+class TimetableProcesses:
+    """Worker processes running searches on timetables they map from files, shared by every worker.
+
+    The workers are started from the forkserver, a clean process without the event loop, threads
+    or database connections of the API, and receive the static network once. A timetable is written
+    once, in the snapshot format, the first time a search needs it, and every worker maps that
+    file on its first search of the timetable: its arrays are in memory once, however many workers
+    read them. The workers are only started again when the network changes.
+
+    The files of the SEARCH_PROCESS_TIMETABLES last timetables are kept, the older ones are removed
+    once no search reads them anymore.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.network = None
+        self.executor = None
+        self.directory = None
+        self.files = OrderedDict()  # timetable -> file
+        self.users = {}  # file -> number of searches reading it
+        self.next_number = 0
+
+    def start(self, network: StaticNetwork):
+        """Starts the worker processes for a network, stopping the ones of the previous network."""
+        self.stop()
+        begin_time = time.time()
+        self.network = network
+        self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("forkserver"), initializer=_init_worker, initargs=(network,))
+        print("* Started " + str(self.max_workers) + " worker processes in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+    def get_file(self, timetable: Timetable) -> str:
+        path = self.files.pop(timetable, None)
+        if path is None:
+            begin_time = time.time()
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="timetables-", dir=SEARCH_TIMETABLE_DIR)
+            path = os.path.join(self.directory, f"{timetable.service_date:%Y%m%d}-{self.next_number}.snapshot")
+            self.next_number += 1
+            write_snapshot(path, get_network_version(), [], [], [], [timetable])
+            print("* Wrote timetable for the worker processes in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+        self.files[timetable] = path
+        while len(self.files) > SEARCH_PROCESS_TIMETABLES:
+            _, old_path = self.files.popitem(last=False)
+            self.remove_unused(old_path)
+        return path
+
+    def acquire(self, timetable: Timetable):
+        """Returns the executor and the file of a timetable, which stays until release() is called."""
+        if timetable.network is not self.network:
+            self.start(timetable.network)
+        path = self.get_file(timetable)
+        self.users[path] = self.users.get(path, 0) + 1
+        return self.executor, path
+
+    def release(self, path: str):
+        self.users[path] -= 1
+        if not self.users[path]:
+            del self.users[path]
+            self.remove_unused(path)
+
+    def remove_unused(self, path: str):
+        if path not in self.users and path not in self.files.values():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed with the directory when the app stopped
+
+    def stop(self):
+        """Stops sending searches to the workers, the searches already sent still run."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = None
+        self.network = None
+        files, self.files = self.files, OrderedDict()
+        for path in files.values():
+            self.remove_unused(path)
+
+    def shutdown(self):
+        """Stops the workers, the searches not started yet are cancelled. Only called when the app stops."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.network = None
+        self.files = OrderedDict()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+
+class SearchPool:
+    """Runs the route searches out of the event loop, so that a long search doesn't hold the other requests.
+
+    The timetable searches (csa, raptor, profile, isochrone) are plain functions of a Timetable:
+    they run in a thread pool, or in "process" mode in long-lived worker processes mapping the
+    timetables from files (see TimetableProcesses).
+
+    The graph searches (dijkstra, prim) are coroutines reading a MetroSystem whose window loads
+    stop times from the database: they run in a thread with an event loop of their own, and the
+    window is extended on the event loop of the request (MetroSystem.loop).
+
+    Past SEARCH_QUEUE_LIMIT searches queued or running, or after SEARCH_QUEUE_TIMEOUT seconds
+    waiting for a worker, the requests are answered 503 instead of piling up.
+    """
+
+    def __init__(self, mode: str = SEARCH_EXECUTOR, max_workers: int = SEARCH_WORKERS, queue_limit: int = SEARCH_QUEUE_LIMIT):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown search executor: {mode}")
+        self.mode = mode
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.threads = ThreadPoolExecutor(max_workers, thread_name_prefix="search") if mode != "inline" else None
+        self.processes = TimetableProcesses(max_workers) if mode == "process" else None
+        self.pending = 0
+        self.rejected = 0
+
+    def start(self, network: StaticNetwork):
+        """Starts the worker processes of "process" mode ahead of the first search."""
+        if self.processes is not None:
+            self.processes.start(network)
+
+    async def submit(self, executor, function, *args):
+        if self.pending >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Too many searches in progress, retry later", headers={"Retry-After": "1"})
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except SearchQueueTimeout:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="The search waited too long for a worker, retry later", headers={"Retry-After": "1"})
+        except SearchError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        finally:
+            self.pending -= 1
+
+    async def run(self, function, *args):
+        """Runs a search function in the thread pool."""
+        if self.mode == "inline":
+            return function(*args)
+        return await self.submit(self.threads, _run_search, function, time.time(), args)
+
+    async def run_timetable_search(self, function, timetable: Timetable, *args):
+        """Runs a search function taking the timetable as first argument, in a worker process in "process" mode."""
+        if self.mode != "process":
+            return await self.run(function, timetable, *args)
+        executor, path = self.processes.acquire(timetable)
+        try:
+            return await self.submit(executor, _run_timetable_search, function, path, time.time(), args)
+        finally:
+            self.processes.release(path)
+
+    async def run_graph_search(self, function, graph, *args):
+        """Runs a search coroutine taking a MetroSystem as first argument in a worker thread."""
+        if self.mode == "inline":
+            return await function(graph, *args)
+        graph.loop = asyncio.get_running_loop()
+        return await self.submit(self.threads, _run_graph_search, function, time.time(), (graph,) + args)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "queue_limit": self.queue_limit,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self.threads is not None:
+            self.threads.shutdown(wait=False, cancel_futures=True)
+        if self.processes is not None:
+            self.processes.shutdown()
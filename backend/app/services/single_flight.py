@@ -0,0 +1,48 @@
+import asyncio
+
+
+class SingleFlight:
+    """Runs a single coroutine at a time for each key, the concurrent calls with the same key share its result.
+
+    A burst of identical requests (same stops, date and direction) then costs one graph build and
+    one search instead of one per request. Nothing is kept once the coroutine is done: the next call
+    runs it again. The coroutine runs in a task of its own, so a caller going away (a client
+    disconnecting) doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key, function, *args):
+        """Returns the result of function(*args), or of the call with the same key already in flight.
+
+        Args:
+            key: A hashable normalized form of the request.
+            function: A coroutine function.
+
+        Raises:
+            The exception raised by the coroutine, to every caller sharing it.
+        """
+        self.calls += 1
+        task = self.tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function(*args))
+            self.tasks[key] = task
+
+            def forget(done_task):
+                if self.tasks.get(key) is done_task:
+                    del self.tasks[key]
+
+            task.add_done_callback(forget)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.tasks),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
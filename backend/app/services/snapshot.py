@@ -0,0 +1,245 @@
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from types import SimpleNamespace
+from services.network import build_static_network
+from services.raptor import RoutePattern, get_route_patterns
+from services.timetable import Timetable
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+# Written by export_snapshot.py, mapped by the API workers
+SNAPSHOT_FILE = os.getenv(
+    "SNAPSHOT_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "network.snapshot"),
+)
+
+SNAPSHOT_MAGIC = b"METROSNP"
+SNAPSHOT_FORMAT = 1
+
+# Magic, format, network version, metadata length, CRC32 of everything after the header
+SNAPSHOT_HEADER = struct.Struct("<8sIQQI")
+
+# Connection arrays of a Timetable stored in the snapshot
+TIMETABLE_ARRAYS = (
+    "dep_stop", "arr_stop", "dep_time", "arr_time", "trip", "dep_arrival", "arr_departure",
+    "next_connection", "by_arrival", "footpath_start", "footpath_to", "footpath_time",
+)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_pattern_arrays(timetable: Timetable):
+    """Flattens the route patterns of a timetable into int arrays.
+
+    The stops and trips of pattern p are stored between stop_start[p] and stop_start[p + 1], and
+    trip_start[p] and trip_start[p + 1]. Its arrival and departure times are blocks of
+    len(stops) * len(trips) values starting at time_start[p], one row of trips per position.
+    """
+    patterns, _ = get_route_patterns(timetable)
+    arrays = {name: array("i") for name in ("stop_start", "stops", "trip_start", "trips", "first_connections", "time_start", "arrivals", "departures")}
+    for pattern in patterns:
+        arrays["stop_start"].append(len(arrays["stops"]))
+        arrays["trip_start"].append(len(arrays["trips"]))
+        arrays["time_start"].append(len(arrays["arrivals"]))
+        arrays["stops"].extend(pattern.stops)
+        arrays["trips"].extend(pattern.trips)
+        arrays["first_connections"].extend(pattern.first_connections)
+        for position in range(len(pattern.stops)):
+            arrays["arrivals"].extend(pattern.arrivals[position])
+            arrays["departures"].extend(pattern.departures[position])
+    arrays["stop_start"].append(len(arrays["stops"]))
+    arrays["trip_start"].append(len(arrays["trips"]))
+    arrays["time_start"].append(len(arrays["arrivals"]))
+    return arrays
+
+
+def write_snapshot(path: str, network_version: int, route_fetch: list, stations_fetch: list, transfers: list, timetables: list):
+    """Writes the compiled network and the timetables of some service days as a binary snapshot.
+
+    The file is a fixed header, a JSON metadata block (stations, stops, routes, transfers, trip IDs
+    and the position of every array), then the int32 arrays of each day, 8 bytes aligned, which
+    the workers map without copying them.
+
+    Args:
+        path: The snapshot file, replaced atomically.
+        network_version: The network version the data was read at.
+        route_fetch, stations_fetch, transfers: The data build_static_network was called with.
+        timetables: The Timetable of each exported service day, built on that network.
+
+    Returns:
+        The size of the file, in bytes.
+    """
+    chunks = []
+    data_size = 0
+
+    def add_array(values: array):
+        nonlocal data_size
+        offset = data_size // 4
+        data = values.tobytes()
+        chunks.append(data)
+        data_size += len(data)
+        return [offset, len(values)]
+
+    days = []
+    for timetable in timetables:
+        days.append({
+            "service_date": timetable.service_date.strftime("%Y%m%d"),
+            "stop_ids": timetable.stop_ids,
+            "trip_ids": timetable.trip_ids,
+            "trip_routes": timetable.trip_routes,
+            "arrays": {name: add_array(getattr(timetable, name)) for name in TIMETABLE_ARRAYS},
+            "patterns": {name: add_array(values) for name, values in get_pattern_arrays(timetable).items()},
+        })
+
+    metadata = json.dumps({
+        "byteorder": sys.byteorder,
+        "routes": [{"route_id": route["route_id"], "route_long_name": route["route_long_name"]} for route in route_fetch],
+        "stations": [
+            {
+                "parent_station": station["parent_station"],
+                "stop_name": station["stop_name"],
+                "barycenter_lat": station.get("barycenter_lat"),
+                "barycenter_lon": station.get("barycenter_lon"),
+                "route_ids": list(station["route_ids"]),
+                "stops": [{"stop_id": stop.stop_id, "stop_name": stop.stop_name} for stop in station["stops"]],
+            } for station in stations_fetch
+        ],
+        "transfers": [{"from_stop_id": transfer["from_stop_id"], "to_stop_id": transfer["to_stop_id"], "min_transfer_time": transfer["min_transfer_time"]} for transfer in transfers],
+        "days": days,
+    }).encode()
+    metadata += b" " * (-(SNAPSHOT_HEADER.size + len(metadata)) % 8)
+
+    checksum = zlib.crc32(metadata)
+    for chunk in chunks:
+        checksum = zlib.crc32(chunk, checksum)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, network_version, len(metadata), checksum))
+        f.write(metadata)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_file, path)
+    return os.path.getsize(path)
+
+
+class Snapshot:
+    """A snapshot file mapped read-only in memory.
+
+    The timetable arrays are memoryviews over the mapping: every worker mapping the same file
+    shares the pages of the page cache, nothing is copied or parsed but the metadata.
+
+    Attributes:
+        network_version: The network version the snapshot was written at.
+        network: The StaticNetwork rebuilt from the metadata.
+        service_dates: The service days the snapshot holds a timetable for.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mapping) < SNAPSHOT_HEADER.size:
+            raise SnapshotError("truncated header")
+        magic, snapshot_format, self.network_version, metadata_size, checksum = SNAPSHOT_HEADER.unpack_from(self.mapping)
+        if magic != SNAPSHOT_MAGIC or snapshot_format != SNAPSHOT_FORMAT:
+            raise SnapshotError("unknown file format")
+        if zlib.crc32(memoryview(self.mapping)[SNAPSHOT_HEADER.size:]) != checksum:
+            raise SnapshotError("checksum mismatch")
+
+        data_start = SNAPSHOT_HEADER.size + metadata_size
+        metadata = json.loads(bytes(self.mapping[SNAPSHOT_HEADER.size:data_start]))
+        if metadata["byteorder"] != sys.byteorder:
+            raise SnapshotError("written on a machine with another byte order")
+
+        self.data = memoryview(self.mapping)[data_start:].cast("i")
+        self.network = build_static_network(
+            metadata["routes"],
+            [dict(station, stops=[SimpleNamespace(**stop) for stop in station["stops"]]) for station in metadata["stations"]],
+            metadata["transfers"],
+        )
+        self.days = {datetime.datetime.strptime(day["service_date"], "%Y%m%d"): day for day in metadata["days"]}
+        self.service_dates = sorted(self.days)
+
+    def get_array(self, position: list):
+        offset, length = position
+        return self.data[offset:offset + length]
+
+    def get_timetable(self, service_date: datetime.datetime):
+        """Returns the timetable of a service day over the mapped arrays, or None if the snapshot doesn't hold it."""
+        day = self.days.get(service_date)
+        if day is None:
+            return None
+
+        timetable = Timetable(service_date, self.network)
+        timetable.stop_ids = day["stop_ids"]
+        timetable.stop_index = {stop_id: number for number, stop_id in enumerate(timetable.stop_ids)}
+        timetable.trip_ids = day["trip_ids"]
+        timetable.trip_routes = day["trip_routes"]
+        for name in TIMETABLE_ARRAYS:
+            setattr(timetable, name, self.get_array(day["arrays"][name]))
+        timetable.patterns = self.get_route_patterns(timetable, day["patterns"])
+        return timetable
+
+    def get_route_patterns(self, timetable: Timetable, positions: dict):
+        arrays = {name: self.get_array(position) for name, position in positions.items()}
+        patterns = []
+        for index in range(len(arrays["stop_start"]) - 1):
+            pattern = RoutePattern(arrays["stops"][arrays["stop_start"][index]:arrays["stop_start"][index + 1]])
+            trip_start, trip_end = arrays["trip_start"][index], arrays["trip_start"][index + 1]
+            pattern.trips = arrays["trips"][trip_start:trip_end]
+            pattern.first_connections = arrays["first_connections"][trip_start:trip_end]
+            time_start, trips = arrays["time_start"][index], trip_end - trip_start
+            pattern.arrivals = [arrays["arrivals"][time_start + position * trips:time_start + (position + 1) * trips] for position in range(len(pattern.stops))]
+            pattern.departures = [arrays["departures"][time_start + position * trips:time_start + (position + 1) * trips] for position in range(len(pattern.stops))]
+            patterns.append(pattern)
+
+        stop_patterns = [[] for _ in timetable.stop_ids]
+        for index, pattern in enumerate(patterns):
+            for position, stop in enumerate(pattern.stops):
+                stop_patterns[stop].append((index, position))
+        return patterns, stop_patterns
+
+
+class SnapshotCache:
+    """Keeps the snapshot mapped, remapped when the file changes.
+
+    get() returns None when there is no snapshot, when it can't be read, or when it was written
+    at another network version: the callers then load the network from the database.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+        self.snapshot = None
+        self.mtime = None
+
+    def get(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+        if mtime != self.mtime:
+            self.mtime = mtime
+            begin_time = time.time()
+            try:
+                self.snapshot = Snapshot(self.path)
+            except (OSError, ValueError, KeyError, SnapshotError) as e:
+                print(colors.RED + "* Ignoring snapshot " + self.path + ": " + str(e) + colors.RESET)
+                self.snapshot = None
+                return None
+            print("* Mapped snapshot in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+        if self.snapshot is None or self.snapshot.network_version != get_network_version():
+            return None
+        return self.snapshot
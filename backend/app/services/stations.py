@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import orjson
+from fastapi.encoders import jsonable_encoder
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+# Route sequences drawn on the map for each station, generated with the GTFS data
+STATIONS_FILE = os.getenv(
+    "STATIONS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "stations.json"),
+)
+
+
+def load_route_sequences(path: str = STATIONS_FILE) -> dict:
+    """Reads the route_ids_with_sequences of every station from stations.json, by parent_station."""
+    with open(path, "r") as f:
+        return {station["parent_station"]: station["route_ids_with_sequences"] for station in json.load(f)}
+
+
+def build_stations(stops: list, route_sequences: dict) -> list:
+    """Groups the stops by parent station, with the barycenter and the routes of each station.
+
+    Args:
+        stops: The Stop objects, with their route_stops and routes prefetched.
+        route_sequences: The route_ids_with_sequences of each parent_station.
+
+    Returns:
+        The stations, in the format of the /stations endpoint.
+    """
+    grouped_stops = {}
+    for stop in stops:
+        grouped_stops.setdefault(stop.parent_station, []).append(stop)
+
+    stations = []
+    for parent_station, stop_group in grouped_stops.items():
+        if not parent_station:
+            continue
+
+        count_stop = len(stop_group)
+        stations.append(
+            {
+                "parent_station": parent_station,
+                "stop_name": stop_group[0].stop_name,
+                "barycenter_lon": sum(stop.stop_lon for stop in stop_group) / count_stop,
+                "barycenter_lat": sum(stop.stop_lat for stop in stop_group) / count_stop,
+                "route_ids": list(set(route_stop.route.route_id for stop in stop_group for route_stop in stop.route_stops)),
+                "stops": stop_group,
+                "route_ids_with_sequences": route_sequences.get(parent_station, [])
+            }
+        )
+    return stations
+
+
+class StationCatalog:
+    """The stations of the network, built once and kept with their serialized JSON body.
+
+    Attributes:
+        stations: The stations, in the format of the /stations endpoint.
+        by_parent_station: The same stations, by parent_station.
+        body: The stations serialized with orjson, as sent by /stations.
+        etag: The entity tag of the body.
+    """
+
+    def __init__(self, stations: list):
+        self.stations = stations
+        self.by_parent_station = {station["parent_station"]: station for station in stations}
+        self.body = orjson.dumps(jsonable_encoder(stations))
+        self.etag = '"' + hashlib.blake2b(self.body, digest_size=16).hexdigest() + '"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """Tells whether an If-None-Match header names the current body."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or "W/" + self.etag in tags
+
+
+class StationCatalogCache:
+    """Keeps the station catalog in memory, rebuilt only when the network version changes.
+
+    The loader returns the Stop objects with their routes; stations.json is read again with them.
+    """
+
+    def __init__(self, loader, path: str = STATIONS_FILE):
+        self.loader = loader
+        self.path = path
+        self.catalog = None
+        self.version = None
+        self.lock = asyncio.Lock()
+
+    async def get(self) -> StationCatalog:
+        version = get_network_version()
+        if self.catalog is not None and self.version == version:
+            return self.catalog
+
+        async with self.lock:
+            if self.catalog is None or self.version != version:
+                begin_time = time.time()
+                stops = await self.loader()
+                self.catalog = StationCatalog(build_stations(stops, load_route_sequences(self.path)))
+                self.version = version
+                print("* Built station catalog in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+        return self.catalog
+
+    def invalidate(self):
+        self.catalog = None
@@ -0,0 +1,239 @@
+import asyncio
+import datetime
+import os
+import time
+from array import array
+from collections import OrderedDict
+from services.network import StaticNetwork, get_transfer_time
+from services.timetable_cache import SERVICE_DAY_HOURS
+from utils.colors import colors
+
+# Number of service days kept in memory
+TIMETABLE_DAYS = int(os.getenv("TIMETABLE_DAYS", 3))
+
+
+def parse_time(time_str: str) -> int:
+    """Converts a GTFS time (HH:MM:SS, hours can go past 23) to seconds since the start of the service day."""
+    return int(time_str[0:2]) * 3600 + int(time_str[3:5]) * 60 + int(time_str[6:8])
+
+
+def get_service_date(date: datetime.datetime, forward: bool = True) -> datetime.datetime:
+    """Returns the service day whose timetable a search leaving at (forward) or arriving by a date runs on.
+
+    The timetable of a day covers the departures from its midnight to SERVICE_DAY_HOURS later. A
+    search arriving before the end of the previous service day runs on the timetable of that day,
+    which also holds the journeys leaving before midnight.
+    """
+    service_date = datetime.datetime.combine(date.date(), datetime.time())
+    if not forward and date <= service_date + datetime.timedelta(hours=SERVICE_DAY_HOURS - 24):
+        service_date -= datetime.timedelta(days=1)
+    return service_date
+
+
+class Timetable:
+    """Flat timetable of a service day, from its midnight to SERVICE_DAY_HOURS later.
+
+    Stops and trips are numbered, and every elementary connection (a train going from a stop to
+    the next one) is stored in contiguous arrays sorted by departure time. Times are seconds since
+    the start of the service day. Besides the trips of the day, the timetable holds the trips of the
+    previous day still running after midnight and the first trips of the next day, as
+    TimetableWindow does: the searches around midnight see every train running then.
+
+    Attributes:
+        stop_ids / stop_index: The stop ID of each stop number, and the other way around.
+        trip_ids / trip_routes: The trip ID and route ID of each trip number, a trip running on the
+            day and on the previous or next one has a number for each.
+        dep_stop, arr_stop, dep_time, arr_time, trip: One entry per connection.
+        dep_arrival: Arrival time of the train at the departure stop of the connection.
+        arr_departure: Departure time of the train from the arrival stop of the connection.
+        next_connection: Index of the next connection of the same trip, -1 at the terminus.
+        by_arrival: Connection indices sorted by arrival time, for the backward scans.
+        footpath_start, footpath_to, footpath_time: Transfers leaving each stop, the ones of stop s
+            are stored between footpath_start[s] and footpath_start[s + 1].
+        patterns: The route patterns used by RAPTOR, built on first use.
+        speed_limit: The speed of the fastest connection and the connections taking no time, computed
+            by get_timetable_speed_limit.
+    """
+
+    def __init__(self, service_date: datetime.datetime, network: StaticNetwork):
+        self.service_date = service_date
+        self.network = network
+        self.stop_ids = []
+        self.stop_index = {}
+        self.trip_ids = []
+        self.trip_routes = []
+        self.dep_stop = array("i")
+        self.arr_stop = array("i")
+        self.dep_time = array("i")
+        self.arr_time = array("i")
+        self.trip = array("i")
+        self.dep_arrival = array("i")
+        self.arr_departure = array("i")
+        self.next_connection = array("i")
+        self.by_arrival = array("i")
+        self.footpath_start = array("i")
+        self.footpath_to = array("i")
+        self.footpath_time = array("i")
+        self.patterns = None
+        self.speed_limit = None
+
+    def __len__(self):
+        return len(self.dep_time)
+
+    def get_date(self, seconds: int) -> datetime.datetime:
+        return self.service_date + datetime.timedelta(seconds=seconds)
+
+    def get_seconds(self, date: datetime.datetime) -> int:
+        return int((date - self.service_date).total_seconds())
+
+    def get_stop(self, stop_number: int):
+        return self.network.stops[self.stop_ids[stop_number]]
+
+    def get_station_stops(self, station_id: str):
+        """Returns the stop numbers of a station."""
+        return [self.stop_index[stop.stop_id] for stop in self.network.stations[station_id].stops]
+
+    def footpaths(self, stop_number: int):
+        for index in range(self.footpath_start[stop_number], self.footpath_start[stop_number + 1]):
+            yield self.footpath_to[index], self.footpath_time[index]
+
+
+async def load_timetable_rows(loader, service_date: datetime.datetime):
+    """Loads the stop times of a service day, and the ones of the previous and next days its timetable holds.
+
+    Args:
+        loader: An async function (date_str, begin_secs, end_secs) returning the stop times of the
+            services running on a day, leaving between two times of that day (None for no limit).
+        service_date: Midnight of the service day.
+
+    Returns:
+        The rows of the day, of the previous day after midnight, and of the next day before
+        SERVICE_DAY_HOURS - 24, ready for build_timetable.
+    """
+    rows = await loader(service_date.strftime("%Y%m%d"), None, None)
+    previous_rows = await loader((service_date - datetime.timedelta(days=1)).strftime("%Y%m%d"), 24 * 3600, None)
+    next_rows = await loader((service_date + datetime.timedelta(days=1)).strftime("%Y%m%d"), None, (SERVICE_DAY_HOURS - 24) * 3600)
+    return rows, previous_rows, next_rows
+
+
+def build_timetable(service_date: datetime.datetime, network: StaticNetwork, rows, previous_rows=(), next_rows=()) -> Timetable:
+    """Builds the flat timetable of a service day.
+
+    Args:
+        service_date: Midnight of the service day.
+        network: The static network, for the stops and the transfers.
+        rows: (trip_id, route_id, stop_id, stop_sequence, arrival_secs, departure_secs) tuples.
+        previous_rows / next_rows: The same tuples for the previous and next service days, only their
+            connections leaving between the midnight of the day and SERVICE_DAY_HOURS are kept.
+
+    Returns:
+        A Timetable.
+    """
+    timetable = Timetable(service_date, network)
+
+    for stop_id in network.stops:
+        timetable.stop_index[stop_id] = len(timetable.stop_ids)
+        timetable.stop_ids.append(stop_id)
+
+    trips = {}
+    trip_offsets = []
+    for offset, day_rows in ((0, rows), (-24 * 3600, previous_rows), (24 * 3600, next_rows)):
+        for trip_id, route_id, stop_id, stop_sequence, arrival_secs, departure_secs in day_rows:
+            if stop_id not in timetable.stop_index:
+                continue
+            try:
+                stops = trips[(offset, trip_id)]
+            except KeyError:
+                stops = trips[(offset, trip_id)] = []
+                timetable.trip_ids.append(trip_id)
+                timetable.trip_routes.append(route_id)
+                trip_offsets.append(offset)
+            stops.append((stop_sequence, timetable.stop_index[stop_id], arrival_secs + offset, departure_secs + offset))
+
+    connections = []
+    end = SERVICE_DAY_HOURS * 3600
+    for trip_number, (trip_id, offset) in enumerate(zip(timetable.trip_ids, trip_offsets)):
+        stops = sorted(trips[(offset, trip_id)])
+        for (_, dep_stop, dep_arrival, dep_time), (_, arr_stop, arr_time, arr_departure) in zip(stops, stops[1:]):
+            if offset and not 0 <= dep_time < end:
+                continue
+            connections.append((dep_time, arr_time, dep_stop, arr_stop, trip_number, dep_arrival, arr_departure))
+    connections.sort()
+
+    last_connection = {}
+    for index, (dep_time, arr_time, dep_stop, arr_stop, trip_number, dep_arrival, arr_departure) in enumerate(connections):
+        timetable.dep_time.append(dep_time)
+        timetable.arr_time.append(arr_time)
+        timetable.dep_stop.append(dep_stop)
+        timetable.arr_stop.append(arr_stop)
+        timetable.trip.append(trip_number)
+        timetable.dep_arrival.append(dep_arrival)
+        timetable.arr_departure.append(arr_departure)
+        timetable.next_connection.append(-1)
+        if trip_number in last_connection:
+            timetable.next_connection[last_connection[trip_number]] = index
+        last_connection[trip_number] = index
+
+    timetable.by_arrival = array("i", sorted(range(len(connections)), key=lambda index: (timetable.arr_time[index], index)))
+
+    # Transfers between the stops of a same station, with the same times as the graph search
+    for stop_id in timetable.stop_ids:
+        timetable.footpath_start.append(len(timetable.footpath_to))
+        stop = network.stops[stop_id]
+        for other_stop in stop.parent_station.stops:
+            if other_stop is not stop:
+                timetable.footpath_to.append(timetable.stop_index[other_stop.stop_id])
+                timetable.footpath_time.append(get_transfer_time(stop, other_stop))
+    timetable.footpath_start.append(len(timetable.footpath_to))
+
+    return timetable
+
+
+class TimetableStore:
+    """Keeps the flat timetables of the last used service days.
+
+    The loader is an async function (date_str, begin_secs, end_secs), see load_timetable_rows.
+
+    When a snapshot cache is given, the days held by a valid snapshot of the network in use are
+    mapped from it instead of being loaded and built.
+    """
+
+    def __init__(self, loader, max_days: int = TIMETABLE_DAYS, snapshots=None):
+        self.loader = loader
+        self.max_days = max_days
+        self.snapshots = snapshots
+        self.network = None
+        self.timetables = OrderedDict()
+        self.locks = {}
+
+    async def get(self, network: StaticNetwork, service_date: datetime.datetime) -> Timetable:
+        if network is not self.network:
+            self.timetables.clear()
+            self.network = network
+
+        if service_date in self.timetables:
+            self.timetables.move_to_end(service_date)
+            return self.timetables[service_date]
+
+        lock = self.locks.setdefault(service_date, asyncio.Lock())
+        async with lock:
+            if service_date not in self.timetables:
+                timetable = self.get_snapshot_timetable(network, service_date)
+                if timetable is None:
+                    rows = await load_timetable_rows(self.loader, service_date)
+                    begin_time = time.time()
+                    timetable = build_timetable(service_date, network, *rows)
+                    print("* Built timetable of " + service_date.strftime("%Y%m%d") + " in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+                self.timetables[service_date] = timetable
+                while len(self.timetables) > self.max_days:
+                    self.timetables.popitem(last=False)
+        self.locks.pop(service_date, None)
+        return self.timetables[service_date]
+
+    def get_snapshot_timetable(self, network: StaticNetwork, service_date: datetime.datetime):
+        if self.snapshots is None:
+            return None
+        snapshot = self.snapshots.get()
+        if snapshot is None or snapshot.network is not network:
+            return None
+        return snapshot.get_timetable(service_date)
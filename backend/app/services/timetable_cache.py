@@ -0,0 +1,529 @@
+import asyncio
+import datetime
+import os
+import sys
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import timedelta
+from services.network import *
+
+# Memory budget of the cache, in MB
+TIMETABLE_CACHE_SIZE = int(os.getenv("TIMETABLE_CACHE_SIZE", 256))
+
+# Hours a service day runs for, GTFS times go past 24:00:00 for the trips running after midnight
+SERVICE_DAY_HOURS = int(os.getenv("SERVICE_DAY_HOURS", 30))
+
+# Longest time window a search can grow, in hours
+MAX_WINDOW_HOURS = int(os.getenv("MAX_WINDOW_HOURS", 24))
+
+# Longest time a train stays at a stop, in seconds: a train arriving at the end of a window can
+# leave during the next hour, whose slice is then loaded too
+MAX_DWELL_TIME = int(os.getenv("MAX_DWELL_TIME", 600))
+
+
+class ServiceDay:
+    """Trips of one service day, numbered, and the loaded hour slices of the day.
+
+    Attributes:
+        trip_ids / trip_index: The trip ID of each trip number, and the other way around.
+        trip_routes / trip_directions / trip_headsigns: The route, direction and headsign of each trip number.
+        buckets: The loaded TimetableSlice of each hour.
+        next_stops / previous_stops: The stop numbers a train goes to from each stop number, and
+            comes from, in the slices loaded so far.
+    """
+
+    def __init__(self, service_date: datetime.datetime, stops: list):
+        self.service_date = service_date
+        self.stops = stops
+        self.trip_ids = []
+        self.trip_index = {}
+        self.trip_routes = []
+        self.trip_directions = array("i")
+        self.trip_headsigns = []
+        self.trips = {}
+        self.buckets = {}
+        self.next_stops = {}
+        self.previous_stops = {}
+
+    def add_trip(self, trip_id: str, route: Routes, direction_id: int, headsign: str) -> int:
+        try:
+            return self.trip_index[trip_id]
+        except KeyError:
+            self.trip_index[trip_id] = len(self.trip_ids)
+            self.trip_ids.append(trip_id)
+            self.trip_routes.append(route)
+            self.trip_directions.append(direction_id or 0)
+            self.trip_headsigns.append(headsign)
+            return self.trip_index[trip_id]
+
+    def get_trip(self, trip_number: int) -> Trips:
+        """Returns the Trips object of a trip number, only created when a search looks at it."""
+        try:
+            return self.trips[trip_number]
+        except KeyError:
+            trip = Trips(self.trip_ids[trip_number], self.trip_routes[trip_number], self.trip_directions[trip_number])
+            trip.head_stop = self.trip_headsigns[trip_number]
+            self.trips[trip_number] = trip
+            return trip
+
+    def add_slice(self, timetable_slice):
+        """Adds a slice to the day, and records the stops its trains go to and come from."""
+        self.buckets[timetable_slice.hour] = timetable_slice
+
+        def link(from_stop, to_stop):
+            self.next_stops.setdefault(from_stop, set()).add(to_stop)
+            self.previous_stops.setdefault(to_stop, set()).add(from_stop)
+
+        stop, next_row = timetable_slice.stop, timetable_slice.next_row
+        for row in range(len(timetable_slice)):
+            if next_row[row] >= 0:
+                link(stop[row], stop[next_row[row]])
+
+        # Trains coming from, or going to, the other loaded hours
+        for first, last in timetable_slice.trip_rows.values():
+            previous_stop_time = StopTimeView(timetable_slice, first).previous_stop_time
+            if previous_stop_time:
+                link(previous_stop_time.slice.stop[previous_stop_time.row], stop[first])
+            next_stop_time = StopTimeView(timetable_slice, last).next_stop_time
+            if next_stop_time:
+                link(stop[last], next_stop_time.slice.stop[next_stop_time.row])
+
+
+class TimetableSlice:
+    """Stop times leaving during one hour of a service day, stored as integer columns.
+
+    The rows are sorted by trip then stop sequence, so the next stop time of a row is the next
+    row when it belongs to the same trip, or the first row of the trip in a later slice. Times
+    are seconds since the start of the service day.
+
+    Attributes:
+        trip, stop, stop_sequence, arrival, departure: One entry per stop time.
+        next_row / previous_row: The next and previous rows of the same trip in the slice, -1 if none.
+        stop_rows: The rows of each stop number, by departure time.
+        max_dwell: The longest time a train stays at a stop, in seconds.
+        trip_rows: The first and last rows of each trip number.
+    """
+
+    def __init__(self, day: ServiceDay, hour: int, rows: list):
+        self.day = day
+        self.hour = hour
+        self.trip = array("i", (row[0] for row in rows))
+        self.stop = array("i", (row[2] for row in rows))
+        self.stop_sequence = array("i", (row[1] for row in rows))
+        self.arrival = array("i", (row[3] for row in rows))
+        self.departure = array("i", (row[4] for row in rows))
+
+        self.next_row = array("i", [-1]) * len(rows)
+        self.previous_row = array("i", [-1]) * len(rows)
+
+        stop_rows = {}
+        self.trip_rows = {}
+        for index, (trip, _, stop, _, _) in enumerate(rows):
+            stop_rows.setdefault(stop, []).append(index)
+            if trip in self.trip_rows:
+                first, last = self.trip_rows[trip]
+                self.next_row[last] = index
+                self.previous_row[index] = last
+                self.trip_rows[trip] = (first, index)
+            else:
+                self.trip_rows[trip] = (index, index)
+        self.stop_rows = {stop: array("i", sorted(indices, key=self.departure.__getitem__)) for stop, indices in stop_rows.items()}
+        self.max_dwell = max((departure - arrival for arrival, departure in zip(self.arrival, self.departure)), default=0)
+
+    def __len__(self):
+        return len(self.trip)
+
+    def size(self) -> int:
+        """Memory used by the slice, in bytes."""
+        columns = (self.trip, self.stop, self.stop_sequence, self.arrival, self.departure, self.next_row, self.previous_row)
+        return (
+            sum(sys.getsizeof(column) for column in columns)
+            + sys.getsizeof(self.stop_rows) + sum(sys.getsizeof(rows) for rows in self.stop_rows.values())
+            + sys.getsizeof(self.trip_rows) + len(self.trip_rows) * sys.getsizeof((0, 0))
+        )
+
+
+class StopTimeView:
+    """A row of a TimetableSlice, with the attributes of a stop time (stop, trip, times, next and previous stop times) computed on access."""
+
+    __slots__ = ("slice", "row")
+
+    def __init__(self, timetable_slice: TimetableSlice, row: int):
+        self.slice = timetable_slice
+        self.row = row
+
+    @property
+    def stop(self) -> Stops:
+        return self.slice.day.stops[self.slice.stop[self.row]]
+
+    @property
+    def trip(self) -> Trips:
+        return self.slice.day.get_trip(self.slice.trip[self.row])
+
+    @property
+    def arrival_time(self) -> datetime.datetime:
+        return self.slice.day.service_date + timedelta(seconds=self.slice.arrival[self.row])
+
+    @property
+    def departure_time(self) -> datetime.datetime:
+        return self.slice.day.service_date + timedelta(seconds=self.slice.departure[self.row])
+
+    @property
+    def stop_sequence(self) -> int:
+        return self.slice.stop_sequence[self.row]
+
+    @property
+    def next_stop_time(self):
+        timetable_slice = self.slice
+        next_row = timetable_slice.next_row[self.row]
+        if next_row >= 0:
+            return StopTimeView(timetable_slice, next_row)
+
+        # The train leaves its next stop later, so the next stop time is in a later slice. The event
+        # loop adds and evicts slices while the searches read them in worker threads: each hour is
+        # read once, and the buckets are never iterated
+        trip = timetable_slice.trip[self.row]
+        buckets = timetable_slice.day.buckets
+        for hour in range(timetable_slice.hour + 1, SERVICE_DAY_HOURS):
+            next_slice = buckets.get(hour)
+            if next_slice is not None and trip in next_slice.trip_rows:
+                return StopTimeView(next_slice, next_slice.trip_rows[trip][0])
+        return None
+
+    @property
+    def previous_stop_time(self):
+        timetable_slice = self.slice
+        previous_row = timetable_slice.previous_row[self.row]
+        if previous_row >= 0:
+            return StopTimeView(timetable_slice, previous_row)
+
+        trip = timetable_slice.trip[self.row]
+        buckets = timetable_slice.day.buckets
+        for hour in range(timetable_slice.hour - 1, -1, -1):
+            previous_slice = buckets.get(hour)
+            if previous_slice is not None and trip in previous_slice.trip_rows:
+                return StopTimeView(previous_slice, previous_slice.trip_rows[trip][1])
+        return None
+
+    def __str__(self):
+        return str({
+            "arrival time": self.arrival_time,
+            "departure time": self.departure_time,
+        })
+
+
+class TimetableWindow:
+    """The stop times of the slices covering a time window, read through StopTimeView objects.
+
+    Times are seconds since the service date of the window. A search grows the window an hour at a
+    time, forward or backward, when its frontier reaches the end of the loaded hours, so only the
+    slices it gets to are loaded. Each hour is covered by the slices of every service day running
+    at that time: journeys cross midnight on the trips of the next day as well as on the trips of
+    the previous one still running past 24:00:00.
+
+    The cache doesn't evict the slices of a window as long as the window is referenced.
+    """
+
+    def __init__(self, cache, service_date: datetime.datetime, begin: int, end: int):
+        self.cache = cache
+        self.service_date = service_date
+        self.stop_numbers = cache.stop_numbers
+        self.begin = begin
+        self.end = end
+        self.first_hour = begin // 3600
+        self.last_hour = self.first_hour - 1
+        self.slices = []  # (slice, seconds from the service date of the window to the one of the slice), by hour
+        cache.windows.add(self)
+
+    @property
+    def begin_date(self) -> datetime.datetime:
+        return self.service_date + timedelta(seconds=self.begin)
+
+    @property
+    def end_date(self) -> datetime.datetime:
+        return self.service_date + timedelta(seconds=self.end)
+
+    async def load(self):
+        """Loads the slices of the hours of the window that are not loaded yet."""
+        while self.first_hour > self.begin // 3600:
+            self.first_hour -= 1
+            await self.load_hour(self.first_hour, 0)
+        while self.last_hour < (self.end + MAX_DWELL_TIME) // 3600:
+            self.last_hour += 1
+            await self.load_hour(self.last_hour, len(self.slices))
+
+    async def load_hour(self, hour: int, position: int):
+        """Inserts the slices of an hour in the window at a position, each one as soon as it is loaded so that the cache keeps it."""
+        # Service days starting at most SERVICE_DAY_HOURS before the hour
+        for days in range(-((SERVICE_DAY_HOURS - 1 - hour) // 24), hour // 24 + 1):
+            timetable_slice = await self.cache.get_slice(self.service_date + timedelta(days=days), hour - 24 * days)
+            self.slices.insert(position, (timetable_slice, days * 24 * 3600))
+            position += 1
+
+    def copy(self):
+        """Returns a window over the same slices, which grows on its own."""
+        window = TimetableWindow(self.cache, self.service_date, self.begin, self.end)
+        window.first_hour = self.first_hour
+        window.last_hour = self.last_hour
+        window.slices = list(self.slices)
+        return window
+
+    def can_extend(self) -> bool:
+        return self.end - self.begin < MAX_WINDOW_HOURS * 3600
+
+    async def extend(self):
+        """Grows the window by an hour, forward in time."""
+        self.end += 3600
+        await self.load()
+
+    async def extend_back(self):
+        """Grows the window by an hour, backward in time."""
+        self.begin -= 3600
+        await self.load()
+
+    def stop_times_at(self, stop: Stops):
+        """Returns the stop times arriving at or leaving the given stop during the window."""
+        stop_number = self.stop_numbers[stop.stop_id]
+        stop_times = []
+        for timetable_slice, offset in self.slices:
+            begin, end = self.begin - offset, self.end - offset
+            arrival, departure = timetable_slice.arrival, timetable_slice.departure
+            for row in timetable_slice.stop_rows.get(stop_number, ()):
+                if begin <= arrival[row] <= end or begin <= departure[row] <= end:
+                    stop_times.append(StopTimeView(timetable_slice, row))
+        return stop_times
+
+    def fastest_stop_times_from(self, stop: Stops, leaving_after: datetime.datetime):
+        """Returns, for each next stop, the stop time leaving the given stop that reaches it first.
+
+        Only the stop times of the window leaving at or after the given date are considered. The
+        rows are read by departure time on the integer columns, and the scan stops once every next
+        stop is reached earlier than the train being read leaves. A view is only created for the
+        stop times returned.
+
+        Returns:
+            The stop times, and whether they are final: False when a train leaving after the end of
+            the window could still reach a next stop first.
+        """
+        stop_number = self.stop_numbers[stop.stop_id]
+        low = int((leaving_after - self.service_date).total_seconds())
+        fastest = {}  # next stop number -> (arrival, slice, row)
+        next_stops = set()
+        day = None
+        bound = None
+        for timetable_slice, offset in self.slices:
+            if timetable_slice.day is not day:
+                day = timetable_slice.day
+                next_stops.update(day.next_stops.get(stop_number, ()))
+                if len(fastest) < len(next_stops):
+                    bound = None
+            begin, end = self.begin - offset, self.end - offset
+            arrival, departure, next_row = timetable_slice.arrival, timetable_slice.departure, timetable_slice.next_row
+            rows = timetable_slice.stop_rows.get(stop_number, ())
+            for row in rows[bisect_left(rows, low - offset, key=departure.__getitem__):]:
+                if bound is not None and departure[row] + offset >= bound:
+                    break
+                if not (begin <= arrival[row] <= end or begin <= departure[row] <= end):
+                    continue
+                if next_row[row] >= 0:
+                    next_stop, next_arrival = timetable_slice.stop[next_row[row]], arrival[next_row[row]]
+                else:
+                    next_stop_time = StopTimeView(timetable_slice, row).next_stop_time
+                    if next_stop_time is None:
+                        continue
+                    next_stop, next_arrival = next_stop_time.slice.stop[next_stop_time.row], next_stop_time.slice.arrival[next_stop_time.row]
+                next_arrival += offset
+                if next_stop not in fastest or next_arrival < fastest[next_stop][0]:
+                    fastest[next_stop] = (next_arrival, timetable_slice, row)
+                    if len(fastest) >= len(next_stops):
+                        bound = max(best_arrival for best_arrival, _, _ in fastest.values())
+        stop_times = [StopTimeView(timetable_slice, row) for _, timetable_slice, row in fastest.values()]
+        return stop_times, bound is not None and bound <= self.end
+
+    def latest_stop_times_to(self, stop: Stops, arriving_before: datetime.datetime):
+        """Returns, for each previous stop, the stop time arriving at the given stop that leaves it last.
+
+        Only the stop times of the window arriving at or before the given date are considered.
+        Same scan as fastest_stop_times_from, backward in time.
+
+        Returns:
+            The stop times, and whether they are final: False when a train leaving its previous
+            stop before the beginning of the window could still leave it last.
+        """
+        stop_number = self.stop_numbers[stop.stop_id]
+        high = int((arriving_before - self.service_date).total_seconds())
+        latest = {}  # previous stop number -> (departure, slice, row)
+        previous_stops = set()
+        day = None
+        bound = None
+        for timetable_slice, offset in reversed(self.slices):
+            if timetable_slice.day is not day:
+                day = timetable_slice.day
+                previous_stops.update(day.previous_stops.get(stop_number, ()))
+                if len(latest) < len(previous_stops):
+                    bound = None
+            begin, end = self.begin - offset, self.end - offset
+            arrival, departure, previous_row = timetable_slice.arrival, timetable_slice.departure, timetable_slice.previous_row
+            rows = timetable_slice.stop_rows.get(stop_number, ())
+            # A train arriving in time leaves at most max_dwell seconds later
+            for row in reversed(rows[:bisect_right(rows, high - offset + timetable_slice.max_dwell, key=departure.__getitem__)]):
+                if bound is not None and departure[row] + offset <= bound:
+                    break
+                if arrival[row] > high - offset or not (begin <= arrival[row] <= end or begin <= departure[row] <= end):
+                    continue
+                if previous_row[row] >= 0:
+                    previous_stop, previous_departure = timetable_slice.stop[previous_row[row]], departure[previous_row[row]]
+                else:
+                    previous_stop_time = StopTimeView(timetable_slice, row).previous_stop_time
+                    if previous_stop_time is None:
+                        continue
+                    previous_stop, previous_departure = previous_stop_time.slice.stop[previous_stop_time.row], previous_stop_time.slice.departure[previous_stop_time.row]
+                previous_departure += offset
+                if previous_stop not in latest or previous_departure > latest[previous_stop][0]:
+                    latest[previous_stop] = (previous_departure, timetable_slice, row)
+                    if len(latest) >= len(previous_stops):
+                        bound = min(best_departure for best_departure, _, _ in latest.values())
+        stop_times = [StopTimeView(timetable_slice, row) for _, timetable_slice, row in latest.values()]
+        return stop_times, bound is not None and bound >= self.begin
+
+
+class TimetableCache:
+    """LRU cache of compact timetable slices, by service date and hour of departure.
+
+    Each slice holds the stop times leaving during one hour of a service day as integer columns.
+    The slices of a same day share the numbering of their trips, so the stop times of a trip
+    follow each other across slices, and a request just reads the slices covering its window.
+
+    The least recently used slices are evicted past the memory budget, except the ones of the
+    windows still in use: a search running in a worker thread keeps every hour it has loaded.
+    """
+
+    def __init__(self, loader, max_size: int = TIMETABLE_CACHE_SIZE * 1024 * 1024):
+        self.loader = loader
+        self.max_size = max_size
+        self.size = 0
+        self.network = None
+        self.stops = []
+        self.stop_numbers = {}
+        self.days = {}
+        self.slices = OrderedDict()
+        self.windows = weakref.WeakSet()
+        self.locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.days.clear()
+        self.slices.clear()
+        self.size = 0
+
+    def set_network(self, network: StaticNetwork):
+        # The stops of an older network must not be mixed with the new ones
+        self.clear()
+        self.network = network
+        self.stops = list(network.stops.values())
+        self.stop_numbers = {stop.stop_id: number for number, stop in enumerate(self.stops)}
+
+    async def get_window(self, network: StaticNetwork, begin: datetime.datetime, end: datetime.datetime) -> TimetableWindow:
+        """Returns the stop times arriving at or leaving a stop between two dates.
+
+        Args:
+            network: The static network the stop times are attached to.
+            begin: The beginning of the time window.
+            end: The end of the time window, the window can grow later on.
+
+        Returns:
+            A TimetableWindow over the slices of the window.
+        """
+        if network is not self.network:
+            self.set_network(network)
+
+        service_date = datetime.datetime.combine(begin.date(), datetime.time())
+        window = TimetableWindow(self, service_date, int((begin - service_date).total_seconds()), int((end - service_date).total_seconds()))
+        await window.load()
+        return window
+
+    async def get_slice(self, service_date: datetime.datetime, hour: int) -> TimetableSlice:
+        key = (service_date, hour)
+        if key in self.slices:
+            self.hits += 1
+            self.slices.move_to_end(key)
+            return self.slices[key]
+
+        # Requests missing the same slice wait for a single database query
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key in self.slices:
+                self.hits += 1
+                self.slices.move_to_end(key)
+                return self.slices[key]
+
+            self.misses += 1
+            rows = await self.loader(service_date.strftime("%Y%m%d"), hour)
+            timetable_slice = self.add_slice(service_date, hour, rows)
+        self.locks.pop(key, None)
+        return timetable_slice
+
+    def add_slice(self, service_date: datetime.datetime, hour: int, rows) -> TimetableSlice:
+        """Stores the stop times of one hour as a slice.
+
+        Args:
+            service_date: Midnight of the service day.
+            hour: The hour of the service day, can go past 23.
+            rows: (trip_id, route_id, direction_id, trip_headsign, stop_id, stop_sequence, arrival_secs, departure_secs) tuples.
+        """
+        day = self.days.get(service_date)
+        if day is None:
+            day = self.days[service_date] = ServiceDay(service_date, self.stops)
+
+        compact_rows = []
+        for trip_id, route_id, direction_id, headsign, stop_id, stop_sequence, arrival_secs, departure_secs in rows:
+            try:
+                route = self.network.routes[route_id]
+            except KeyError:
+                raise HTTPException(status_code=404, detail=f"route not found at creation of trip and stop_time : {route_id}\n\n")
+
+            trip = day.add_trip(trip_id, route, direction_id, headsign)
+            compact_rows.append((trip, stop_sequence, self.stop_numbers[stop_id], arrival_secs, departure_secs))
+        compact_rows.sort()
+
+        timetable_slice = TimetableSlice(day, hour, compact_rows)
+        day.add_slice(timetable_slice)
+        self.slices[(service_date, hour)] = timetable_slice
+        self.size += timetable_slice.size()
+        self.evict()
+        return timetable_slice
+
+    def evict(self):
+        if self.size <= self.max_size:
+            return
+
+        # The slices of the windows in use are kept, as well as the most recent slice, even if it is
+        # bigger than the whole budget
+        pinned = {id(timetable_slice) for window in self.windows for timetable_slice, _ in window.slices}
+        for key in list(self.slices)[:-1]:
+            if self.size <= self.max_size:
+                break
+            timetable_slice = self.slices[key]
+            if id(timetable_slice) in pinned:
+                continue
+            del self.slices[key]
+            self.size -= timetable_slice.size()
+
+            service_date, hour = key
+            day = self.days[service_date]
+            del day.buckets[hour]
+            if not day.buckets:
+                del self.days[service_date]
+
+    def stats(self):
+        return {
+            "slices": len(self.slices),
+            "windows": len(self.windows),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,366 @@
+import datetime
+import gzip
+import heapq
+import json
+import os
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from services.csa import format_journey, get_station_stops_or_404
+from services.matrix import MATRIX_WORKERS, get_search_timetable
+from services.raptor import get_ride_connections, get_route_patterns
+from services.timetable import Timetable
+from utils.colors import colors
+from utils.network_version import get_network_version
+
+# Written by build_transfer_patterns.py, read by the API workers
+TRANSFER_PATTERNS_FILE = os.getenv(
+    "TRANSFER_PATTERNS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "transfer_patterns.json.gz"),
+)
+
+# Longest journey considered during the precomputation, in minutes: the longer journeys are left to the full search
+TRANSFER_PATTERN_MAX_DURATION = 180
+
+# Timetable and station of every stop in the current worker process
+_worker_timetable = None
+_worker_stop_stations = None
+
+
+class TransferPatternIndex:
+    """Transfer patterns of the optimal journeys between every pair of stations.
+
+    A transfer pattern is the sequence of stations where a journey boards a train: the origin,
+    every transfer station, then the destination.
+
+    Attributes:
+        network_version: The network version the patterns were computed on.
+        service_date: The service day the patterns were computed on.
+        service_signature: The signature of the services running that day, see ServiceCalendar.get_signature.
+        max_duration: The longest journey the patterns were computed for, in minutes.
+        patterns: origin station ID -> destination station ID -> list of station ID tuples.
+    """
+
+    def __init__(self, network_version: int, service_date: datetime.datetime, service_signature: str, max_duration: int, patterns: dict):
+        self.network_version = network_version
+        self.service_date = service_date
+        self.service_signature = service_signature
+        self.max_duration = max_duration
+        self.patterns = patterns
+
+    def get(self, start: str, end: str):
+        return self.patterns.get(start, {}).get(end, [])
+
+    def covers(self, date: datetime.datetime, arrival_date: datetime.datetime) -> bool:
+        """Tells if a journey found on the patterns is optimal: the optimal journey is only in the index if it is not too long.
+
+        If the journey found lasts at most max_duration, the optimal one, arriving no later, lasts
+        at most max_duration too: its pattern is in the index, and the journey found is as good.
+        """
+        return arrival_date - date <= datetime.timedelta(minutes=self.max_duration)
+
+    def is_stale(self, service_signature: str) -> bool:
+        """Tells if the patterns can miss journeys of a day: the network changed, or other services run that day."""
+        return self.network_version != get_network_version() or self.service_signature != service_signature
+
+
+def save_transfer_patterns(index: TransferPatternIndex, path: str = TRANSFER_PATTERNS_FILE):
+    """Writes the index as gzipped JSON, the stations being numbered to keep the file small.
+
+    Returns:
+        The size of the file, in bytes.
+    """
+    stations = sorted({station for destinations in index.patterns.values() for patterns in destinations.values() for pattern in patterns for station in pattern})
+    numbers = {station: number for number, station in enumerate(stations)}
+    content = {
+        "network_version": index.network_version,
+        "service_date": index.service_date.strftime("%Y%m%d"),
+        "service_signature": index.service_signature,
+        "max_duration": index.max_duration,
+        "stations": stations,
+        "patterns": {
+            numbers[start]: {
+                numbers[end]: [[numbers[station] for station in pattern] for pattern in patterns]
+                for end, patterns in destinations.items()
+            } for start, destinations in index.patterns.items()
+        }
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + ".tmp"
+    with gzip.open(tmp_file, "wt") as f:
+        json.dump(content, f, separators=(",", ":"))
+    os.replace(tmp_file, path)
+    return os.path.getsize(path)
+
+
+def load_transfer_patterns(path: str = TRANSFER_PATTERNS_FILE) -> TransferPatternIndex:
+    with gzip.open(path, "rt") as f:
+        content = json.load(f)
+
+    stations = content["stations"]
+    patterns = {
+        stations[int(start)]: {
+            stations[int(end)]: [tuple(stations[station] for station in pattern) for pattern in end_patterns]
+            for end, end_patterns in destinations.items()
+        } for start, destinations in content["patterns"].items()
+    }
+    return TransferPatternIndex(content["network_version"], datetime.datetime.strptime(content["service_date"], "%Y%m%d"), content.get("service_signature"), content.get("max_duration", TRANSFER_PATTERN_MAX_DURATION), patterns)
+
+
+class TransferPatternCache:
+    """Keeps the transfer pattern index in memory, reloaded when the file changes.
+
+    get() returns None when there is no index, or when it was computed on another network
+    version or on a day running other services than the query date, the caller then falls back
+    to a full search.
+    """
+
+    def __init__(self, path: str = TRANSFER_PATTERNS_FILE):
+        self.path = path
+        self.index = None
+        self.mtime = None
+
+    def get(self, service_signature: str):
+        """Returns the index if it is valid for a date.
+
+        Args:
+            service_signature: The signature of the services running on the query date.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return None
+
+        if mtime != self.mtime:
+            begin_time = time.time()
+            self.index = load_transfer_patterns(self.path)
+            self.mtime = mtime
+            print("* Loaded transfer patterns in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+
+        if self.index.is_stale(service_signature):
+            return None
+        return self.index
+
+
+def add_journey(profile: tuple, departure: int, arrival: int, pattern: tuple):
+    """Adds a journey to the profile of a stop, unless a journey arriving as early leaves as late from the origin.
+
+    A profile is a tuple of lists (arrivals, departures, patterns), sorted by arrival, so that the
+    departures from the origin are increasing too.
+    """
+    arrivals, departures, patterns = profile
+    position = bisect_right(arrivals, arrival)
+    if position and departures[position - 1] >= departure:
+        return
+
+    # Remove the journeys arriving as late or later and not leaving later
+    first = bisect_left(arrivals, arrival)
+    last = position
+    while last < len(arrivals) and departures[last] <= departure:
+        last += 1
+    arrivals[first:last] = [arrival]
+    departures[first:last] = [departure]
+    patterns[first:last] = [pattern]
+
+
+def get_origin_patterns(timetable: Timetable, stop_stations: list, start: str, start_stops: list, max_duration: int):
+    """Returns the transfer patterns of the optimal journeys from a station to every other one, over the service day.
+
+    One-to-all profile variant of the Connection Scan Algorithm: the connections are scanned once,
+    by increasing departure time, and each stop keeps the journeys from the origin that no other
+    one leaves later and arrives earlier than, with their transfer pattern. Leaving the origin at
+    any time, the earliest arrival is the one of the first journey leaving at or after it: the
+    patterns of these journeys cover every departure time, not only some sampled ones.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        stop_stations: The station ID of each stop number.
+        start: The starting station ID.
+        start_stops: The stop numbers of the origin.
+        max_duration: The longest journey considered, in seconds.
+
+    Returns:
+        A dictionary destination station ID -> sorted list of transfer patterns.
+    """
+    dep_stop, arr_stop, dep_time, arr_time, trip = timetable.dep_stop, timetable.arr_stop, timetable.dep_time, timetable.arr_time, timetable.trip
+    start_stops = set(start_stops)
+    profiles = {}  # stop -> (arrivals, departures from the origin, patterns)
+    boardings = {}  # trip -> (departure from the origin, pattern) of the latest journey on board
+
+    for connection in range(len(dep_time)):
+        stop = dep_stop[connection]
+        boarding = boardings.get(trip[connection])
+        if stop in start_stops:
+            if boarding is None or boarding[0] < dep_time[connection]:
+                boarding = boardings[trip[connection]] = (dep_time[connection], (start,))
+        elif stop in profiles:
+            # Latest journey reaching the stop before the train leaves
+            arrivals, departures, patterns = profiles[stop]
+            position = bisect_right(arrivals, dep_time[connection]) - 1
+            if position >= 0 and (boarding is None or boarding[0] < departures[position]):
+                boarding = boardings[trip[connection]] = (departures[position], patterns[position] + (stop_stations[stop],))
+        if boarding is None:
+            continue
+
+        departure, pattern = boarding
+        stop = arr_stop[connection]
+        if arr_time[connection] - departure > max_duration or stop in start_stops:
+            continue
+        add_journey(profiles.setdefault(stop, ([], [], [])), departure, arr_time[connection], pattern)
+        for other_stop, transfer_time in timetable.footpaths(stop):
+            if other_stop not in start_stops:
+                add_journey(profiles.setdefault(other_stop, ([], [], [])), departure, arr_time[connection] + transfer_time, pattern)
+
+    # Keep the journeys no other stop of the same station improves on
+    station_journeys = {}
+    for stop, profile in profiles.items():
+        station_journeys.setdefault(stop_stations[stop], []).extend(zip(*profile))
+
+    destinations = {}
+    for station, journeys in station_journeys.items():
+        journeys.sort(key=lambda journey: (journey[0], -journey[1]))
+        latest_departure = -1
+        patterns = set()
+        for _, departure, pattern in journeys:
+            if departure > latest_departure:
+                latest_departure = departure
+                patterns.add(pattern + (station,))
+        destinations[station] = sorted(patterns)
+    return destinations
+
+
+def _init_worker(timetable: Timetable, stop_stations: list):
+    global _worker_timetable, _worker_stop_stations
+    _worker_timetable = timetable
+    _worker_stop_stations = stop_stations
+
+
+def _compute_origin_patterns(start: str, start_stops: list, max_duration: int):
+    return start, get_origin_patterns(_worker_timetable, _worker_stop_stations, start, start_stops, max_duration)
+
+
+def build_transfer_patterns(timetable: Timetable, network_version: int, service_signature: str, max_duration: int = TRANSFER_PATTERN_MAX_DURATION, max_workers: int = MATRIX_WORKERS):
+    """Computes the transfer patterns of every origin station over a service day.
+
+    The patterns of each origin come from a single profile scan of the day (see get_origin_patterns),
+    so the index holds the optimal journey of every query time up to max_duration. The origins are
+    spread over a pool of worker processes.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        network_version: The network version the timetable was built on.
+        service_signature: The signature of the services running on the service day.
+        max_duration: The longest journey considered, in minutes.
+        max_workers: The number of worker processes.
+
+    Returns:
+        A TransferPatternIndex.
+    """
+    stop_stations = [timetable.get_stop(stop).parent_station.station_id for stop in range(len(timetable.stop_ids))]
+
+    patterns = {}
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(get_search_timetable(timetable), stop_stations)) as executor:
+        futures = [
+            executor.submit(_compute_origin_patterns, station_id, timetable.get_station_stops(station_id), max_duration * 60)
+            for station_id in timetable.network.stations
+        ]
+        for future in futures:
+            start, destinations = future.result()
+            patterns[start] = destinations
+    return TransferPatternIndex(network_version, timetable.service_date, service_signature, max_duration, patterns)
+
+
+def transfer_pattern_search(timetable: Timetable, index: TransferPatternIndex, start: str, end: str, date: datetime.datetime, total_begin_time: time):
+    """Computes the earliest arrival path between two stations on the query graph of their transfer patterns.
+
+    The query graph links each station of a pattern to the next one. It is searched like the
+    dijkstra search, stop by stop, every edge being evaluated with the first train of the route
+    patterns going directly from a station to the next one.
+
+    Args:
+        timetable: The flat timetable of the service day.
+        index: The transfer patterns.
+        start: The starting station ID.
+        end: The destination station ID.
+        date: The starting date
+
+    Returns:
+        The same dictionary as csa, or an empty one if the query graph has no journey.
+    """
+    begin_time = time.time()
+
+    start_stops = get_station_stops_or_404(timetable, start)
+    end_stops = set(get_station_stops_or_404(timetable, end))
+    route_patterns, stop_patterns = get_route_patterns(timetable)
+
+    successors = {}
+    for pattern in index.get(start, end):
+        for station, next_station in zip(pattern, pattern[1:]):
+            successors.setdefault(station, set()).add(next_station)
+
+    counter = count()
+    arrivals = {}
+    parents = {}  # stop -> (route pattern, trip index, boarding position, alighting position) or stop walked from
+    queue = []
+    for stop in start_stops:
+        arrivals[stop] = timetable.get_seconds(date)
+        heapq.heappush(queue, (arrivals[stop], next(counter), stop))
+
+    settled = set()
+    target = None
+    while queue:
+        current_time, _, stop = heapq.heappop(queue)
+        if stop in settled:
+            continue
+        settled.add(stop)
+
+        if stop in end_stops:
+            target = stop
+            break
+
+        for other_stop, transfer_time in timetable.footpaths(stop):
+            if other_stop not in arrivals or current_time + transfer_time < arrivals[other_stop]:
+                arrivals[other_stop] = current_time + transfer_time
+                parents[other_stop] = stop
+                heapq.heappush(queue, (arrivals[other_stop], next(counter), other_stop))
+
+        for next_station in successors.get(timetable.get_stop(stop).parent_station.station_id, ()):
+            next_stops = set(timetable.get_station_stops(next_station))
+            for pattern_index, position in stop_patterns[stop]:
+                route_pattern = route_patterns[pattern_index]
+                trip_index = bisect_left(route_pattern.departures[position], current_time)
+                if trip_index == len(route_pattern.trips):
+                    continue
+                for alight in range(position + 1, len(route_pattern.stops)):
+                    next_stop = route_pattern.stops[alight]
+                    if next_stop in next_stops:
+                        arrival = route_pattern.arrivals[alight][trip_index]
+                        if next_stop not in arrivals or arrival < arrivals[next_stop]:
+                            arrivals[next_stop] = arrival
+                            parents[next_stop] = (route_pattern, trip_index, position, alight)
+                            heapq.heappush(queue, (arrival, next(counter), next_stop))
+                        break
+
+    print("-> Executed transfer pattern search in: " + colors.BLUE + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    if target is None:
+        return {}
+
+    legs = []
+    stop = target
+    while stop in parents:
+        if isinstance(parents[stop], int):  # transfer from another stop of the station
+            stop = parents[stop]
+            continue
+        route_pattern, trip_index, board, alight = parents[stop]
+        legs.append(get_ride_connections(timetable, route_pattern, trip_index, board, alight))
+        stop = route_pattern.stops[board]
+
+    stations, stops = format_journey(timetable, start, [connection for leg in reversed(legs) for connection in leg])
+    return {
+        "stations": stations,
+        "stops": stops,
+        "arrival_date": timetable.get_date(arrivals[target]),
+        "total_execution_time": time.time() - total_begin_time
+    }
@@ -1,14 +1,265 @@
+import argparse
 import pandas as pd
 import os
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from colors import colors
 
-def clean_gtfs_data(gtfs_folder, cleaned_gtfs_folder):
-    """Cleans GTFS data to include only RATP data and writes to a new folder.
+# Rows of a GTFS file held in memory at once: the peak memory of the cleaning is bounded by it
+# and by the key sets (route, trip and stop IDs) kept between files
+CHUNK_SIZE = 1000000
+
+# Files cleaned at the same time, each in its own process
+CLEANING_WORKERS = int(os.getenv("CLEANING_WORKERS", min(4, os.cpu_count() or 1)))
+
+# What clean_gtfs_data keeps by default: the RATP metro
+DEFAULT_AGENCY_IDS = ("IDFM:Operator_100",)
+DEFAULT_ROUTE_TYPES = (1,)
+
+# Compact types of the columns of each file: categories for the IDs and the times repeated over
+# the rows, small integers for the sequences and the enums the GTFS requires. The optional
+# columns, which may be empty, are left to pandas (nullable integers would parse three times slower).
+GTFS_DTYPES = {
+    "agency": {"agency_id": "category"},
+    "routes": {"route_id": "category", "agency_id": "category", "route_type": "int16"},
+    "trips": {"route_id": "category", "service_id": "category", "shape_id": "category", "block_id": "category"},
+    "calendar": {
+        "service_id": "category", "monday": "int8", "tuesday": "int8", "wednesday": "int8", "thursday": "int8",
+        "friday": "int8", "saturday": "int8", "sunday": "int8", "start_date": "category", "end_date": "category",
+    },
+    "calendar_dates": {"service_id": "category", "date": "category", "exception_type": "int8"},
+    "stop_times": {
+        "trip_id": "category", "stop_id": "category", "arrival_time": "category", "departure_time": "category",
+        "stop_sequence": "int32", "local_zone_id": "category", "stop_headsign": "category",
+    },
+    "stops": {"parent_station": "category", "stop_timezone": "category", "level_id": "category"},
+    "pathways": {"from_stop_id": "category", "to_stop_id": "category", "pathway_mode": "int8", "is_bidirectional": "int8"},
+    "transfers": {"from_stop_id": "category", "to_stop_id": "category", "transfer_type": "int8"},
+    "stop_extensions": {"object_id": "category", "object_system": "category"},
+}
+
+
+class ParquetOutput:
+    """Appends the chunks of a cleaned file to a Parquet file, one row group per chunk.
+
+    The schema is taken from the first chunk, with int32 dictionary indices so that the categories
+    of every chunk fit, and string columns for the ones that were only empty in it.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.schema = None
+        self.writer = None
+
+    def write(self, chunk):
+        pa = self.pa
+        # The categories of the rows filtered out would otherwise be kept in the dictionaries
+        chunk = chunk.apply(lambda column: column.cat.remove_unused_categories() if isinstance(column.dtype, pd.CategoricalDtype) else column)
+        if self.schema is None:
+            fields = []
+            for field in pa.Schema.from_pandas(chunk, preserve_index=False):
+                if pa.types.is_dictionary(field.type):
+                    field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                elif pa.types.is_null(field.type):
+                    field = field.with_type(pa.string())
+                fields.append(field)
+            self.schema = pa.schema(fields)
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def filter_gtfs_file(gtfs_folder, cleaned_gtfs_folder, name, keep, collect=(), write_parquet=False, chunk_size=CHUNK_SIZE):
+    """Streams a GTFS file through a filter, chunk by chunk, to the cleaned folder.
+
+    Args:
+        gtfs_folder: The directory containing the GTFS files.
+        cleaned_gtfs_folder: The directory to write the cleaned GTFS files.
+        name: The name of the file, without its extension.
+        keep: A function returning the boolean mask of the rows of a chunk to keep.
+        collect: Columns whose values, in the rows kept, are returned.
+        write_parquet: Whether to write a Parquet file next to the CSV file.
+        chunk_size: The number of rows read at once.
+
+    Returns:
+        The set of values of each collected column.
+    """
+    begin_time = time.time()
+    collected = {column: set() for column in collect}
+    input_file = f"{gtfs_folder}/{name}.txt"
+    parquet_output = ParquetOutput(f"{cleaned_gtfs_folder}/{name}.parquet") if write_parquet else None
+    rows = 0
+    kept = 0
+
+    with open(f"{cleaned_gtfs_folder}/{name}.txt", "w", newline="") as output:
+        for chunk in pd.read_csv(input_file, dtype=GTFS_DTYPES.get(name), chunksize=chunk_size):
+            rows += len(chunk)
+            chunk = chunk[keep(chunk)]
+            kept += len(chunk)
+            for column in collect:
+                collected[column].update(chunk[column].dropna().unique())
+
+            chunk.to_csv(output, header=output.tell() == 0, index=False)
+            if parquet_output:
+                parquet_output.write(chunk)
+
+        # A file without any row still gets its header
+        if output.tell() == 0:
+            pd.read_csv(input_file, nrows=0).to_csv(output, index=False)
+    if parquet_output:
+        parquet_output.close()
+
+    print("* Cleaned " + name + ".txt (" + str(kept) + " of " + str(rows) + " rows kept) in: " + colors.YELLOW + colors.BOLD + str(time.time() - begin_time) + colors.RESET + " seconds")
+    return collected
+
+
+class CleaningOptions:
+    """Where and what clean_gtfs_data keeps, sent along to every step.
+
+    Attributes:
+        agency_ids: The agencies whose routes are kept, or None for all of them.
+        route_types: The route types kept (1 for the metro), or None for all of them.
+    """
+
+    def __init__(self, gtfs_folder, cleaned_gtfs_folder, agency_ids=DEFAULT_AGENCY_IDS, route_types=DEFAULT_ROUTE_TYPES, write_parquet=False, chunk_size=CHUNK_SIZE):
+        self.gtfs_folder = gtfs_folder
+        self.cleaned_gtfs_folder = cleaned_gtfs_folder
+        self.agency_ids = agency_ids
+        self.route_types = route_types
+        self.write_parquet = write_parquet
+        self.chunk_size = chunk_size
+
+    def filter_file(self, name, keep, collect=()):
+        return filter_gtfs_file(self.gtfs_folder, self.cleaned_gtfs_folder, name, keep, collect, self.write_parquet, self.chunk_size)
+
+
+def is_in(column, values):
+    """Returns the mask of the rows of a column whose value is in values (all of them if values is None)."""
+    if values is None:
+        return pd.Series(True, index=column.index)
+    return column.isin(values)
+
+
+# Steps of the cleaning, one per file: each one gets the key sets it filters on and returns the ones
+# it collected. They run in worker processes, so they are module level functions.
+
+def clean_agency(options, keys):
+    return options.filter_file("agency", lambda agency: is_in(agency["agency_id"], options.agency_ids))
+
+
+def clean_routes(options, keys):
+    return options.filter_file(
+        "routes",
+        lambda routes: is_in(routes["agency_id"], options.agency_ids) & is_in(routes["route_type"], options.route_types),
+        collect=("route_id",),
+    )
+
+
+def clean_trips(options, keys):
+    return options.filter_file("trips", lambda trips: trips["route_id"].isin(keys["route_id"]), collect=("trip_id", "service_id"))
+
+
+def clean_calendar(options, keys):
+    return options.filter_file("calendar", lambda calendar: calendar["service_id"].isin(keys["service_id"]))
+
+
+def clean_calendar_dates(options, keys):
+    return options.filter_file("calendar_dates", lambda calendar_dates: calendar_dates["service_id"].isin(keys["service_id"]))
+
+
+def clean_stop_times(options, keys):
+    return options.filter_file("stop_times", lambda stop_times: stop_times["trip_id"].isin(keys["trip_id"]), collect=("stop_id",))
+
+
+def clean_stops(options, keys):
+    return options.filter_file("stops", lambda stops: stops["stop_id"].isin(keys["stop_id"]), collect=("stop_id",))
+
+
+def clean_pathways(options, keys):
+    return options.filter_file("pathways", lambda pathways: pathways["from_stop_id"].isin(keys["stop_id"]) & pathways["to_stop_id"].isin(keys["stop_id"]))
+
+
+def clean_transfers(options, keys):
+    return options.filter_file("transfers", lambda transfers: transfers["from_stop_id"].isin(keys["stop_id"]) & transfers["to_stop_id"].isin(keys["stop_id"]))
+
+
+def clean_stop_extensions(options, keys):
+    return options.filter_file("stop_extensions", lambda stop_extensions: stop_extensions["object_id"].isin(keys["stop_id"]))
+
+
+# The step of each file, and the step each key set it filters on comes from
+CLEANING_STEPS = {
+    "agency": (clean_agency, {}),
+    "routes": (clean_routes, {}),
+    "trips": (clean_trips, {"route_id": "routes"}),
+    "calendar": (clean_calendar, {"service_id": "trips"}),
+    "calendar_dates": (clean_calendar_dates, {"service_id": "trips"}),
+    "stop_times": (clean_stop_times, {"trip_id": "trips"}),
+    "stops": (clean_stops, {"stop_id": "stop_times"}),
+    "pathways": (clean_pathways, {"stop_id": "stops"}),
+    "transfers": (clean_transfers, {"stop_id": "stops"}),
+    "stop_extensions": (clean_stop_extensions, {"stop_id": "stops"}),
+}
+
+
+def run_cleaning_steps(options, steps=CLEANING_STEPS, max_workers=CLEANING_WORKERS):
+    """Runs the cleaning steps in a process pool, each one as soon as the steps it depends on are done.
+
+    Only the key sets a step filters on are sent to its worker.
+
+    Returns:
+        The key sets collected by each step.
+    """
+    for name, (_, inputs) in steps.items():
+        for dependency in inputs.values():
+            if dependency not in steps:
+                raise ValueError(f"Step {name} depends on an unknown step: {dependency}")
+
+    results = {}
+    pending = dict(steps)
+    running = {}
+    with ProcessPoolExecutor(max_workers) as executor:
+        while pending or running:
+            for name, (step, inputs) in list(pending.items()):
+                if all(dependency in results for dependency in inputs.values()):
+                    keys = {column: results[dependency][column] for column, dependency in inputs.items()}
+                    running[executor.submit(step, options, keys)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError("The cleaning steps have a dependency cycle: " + ", ".join(pending))
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+
+def clean_gtfs_data(gtfs_folder, cleaned_gtfs_folder, agency_ids=DEFAULT_AGENCY_IDS, route_types=DEFAULT_ROUTE_TYPES, write_parquet=False, chunk_size=CHUNK_SIZE, max_workers=CLEANING_WORKERS):
+    """Cleans GTFS data to include only the routes of some agencies and route types, and writes to a new folder.
+
+    The files are read in chunks of chunk_size rows and filtered against the IDs kept from the
+    files they depend on (CLEANING_STEPS), so that the multi-GB stop_times.txt never has to fit in
+    memory. The files that don't depend on each other (calendar, calendar_dates and stop_times, then
+    pathways, transfers and stop_extensions) are cleaned concurrently.
 
     Args:
         gtfs_folder: The directory containing the GTFS files.
         cleaned_gtfs_folder: The directory to write the cleaned GTFS files.
+        agency_ids: The agencies to keep, or None for all of them (RATP by default).
+        route_types: The route types to keep, or None for all of them (metro by default).
+        write_parquet: Whether to also write each cleaned file as Parquet (requires pyarrow).
+        chunk_size: The number of rows read at once.
+        max_workers: The number of files cleaned at the same time.
 
     Returns:
         None
@@ -21,70 +272,28 @@ def clean_gtfs_data(gtfs_folder, cleaned_gtfs_folder):
     if not os.path.exists(cleaned_gtfs_folder):
         os.makedirs(cleaned_gtfs_folder)
 
-    # Read agency.txt
-    agency = pd.read_csv(f"{gtfs_folder}/agency.txt")
-
-    # Filter agency.txt to include only RATP agencies
-    ratp_agency = agency[agency["agency_id"] == "IDFM:Operator_100"]
-    ratp_agency.to_csv(f"{cleaned_gtfs_folder}/agency.txt", index=False)
-
-    # Read routes.txt
-    routes = pd.read_csv(f"{gtfs_folder}/routes.txt")
-
-    # Filter routes.txt to include only RATP routes
-    ratp_routes = routes[routes["agency_id"] == "IDFM:Operator_100"]
-    ratp_routes.to_csv(f"{cleaned_gtfs_folder}/routes.txt", index=False)
-
-    # Filter routes.txt to keep only metro routes
-    ratp_routes = ratp_routes[ratp_routes["route_type"] == 1]
-    ratp_routes.to_csv(f"{cleaned_gtfs_folder}/routes.txt", index=False)
-
-    # Filter trips.txt based on the remaining routes
-    trips = pd.read_csv(f"{gtfs_folder}/trips.txt")
-    trips = trips[trips["route_id"].isin(ratp_routes["route_id"])]
-    trips.to_csv(f"{cleaned_gtfs_folder}/trips.txt", index=False)
-
-    # Filter calendar.txt based on the remaining trips
-    calendar = pd.read_csv(f"{gtfs_folder}/calendar.txt")
-    calendar = calendar[calendar["service_id"].isin(trips["service_id"])]
-    calendar.to_csv(f"{cleaned_gtfs_folder}/calendar.txt", index=False)
-
-    # Filter calendar_dates.txt based on the remaining trips
-    calendar_dates = pd.read_csv(f"{gtfs_folder}/calendar_dates.txt")
-    calendar_dates = calendar_dates[calendar_dates["service_id"].isin(trips["service_id"])]
-    calendar_dates.to_csv(f"{cleaned_gtfs_folder}/calendar_dates.txt", index=False)
-
-    # Filter stop_times.txt based on the remaining trips
-    stop_times = pd.read_csv(f"{gtfs_folder}/stop_times.txt")
-    stop_times = stop_times[stop_times["trip_id"].isin(trips["trip_id"])]
-    stop_times.to_csv(f"{cleaned_gtfs_folder}/stop_times.txt", index=False)
-
-    # Filter stops.txt based on the remaining stop_times
-    stops = pd.read_csv(f"{gtfs_folder}/stops.txt")
-    stops = stops[stops["stop_id"].isin(stop_times["stop_id"])]
-    stops.to_csv(f"{cleaned_gtfs_folder}/stops.txt", index=False)
-
-    # Filter pathways.txt based on the remaining stops
-    pathways = pd.read_csv(f"{gtfs_folder}/pathways.txt")
-    pathways = pathways[pathways["from_stop_id"].isin(stops["stop_id"])]
-    pathways = pathways[pathways["to_stop_id"].isin(stops["stop_id"])]
-    pathways.to_csv(f"{cleaned_gtfs_folder}/pathways.txt", index=False)
-
-    # Filter transfers.txt based on the remaining stops
-    transfers = pd.read_csv(f"{gtfs_folder}/transfers.txt")
-    transfers = transfers[transfers["from_stop_id"].isin(stops["stop_id"])]
-    transfers = transfers[transfers["to_stop_id"].isin(stops["stop_id"])]
-    transfers.to_csv(f"{cleaned_gtfs_folder}/transfers.txt", index=False)
-
-    # Filter stop_extensions.txt based on the remaining stops
-    stop_extensions = pd.read_csv(f"{gtfs_folder}/stop_extensions.txt")
-    stop_extensions = stop_extensions[stop_extensions["object_id"].isin(stops["stop_id"])]
-    stop_extensions.to_csv(f"{cleaned_gtfs_folder}/stop_extensions.txt", index=False)
+    options = CleaningOptions(gtfs_folder, cleaned_gtfs_folder, agency_ids, route_types, write_parquet, chunk_size)
+    run_cleaning_steps(options, max_workers=max_workers)
 
     print("-> GTFS data cleaned successfully. Files written to: " + colors.BLUE + colors.BOLD + cleaned_gtfs_folder + colors.RESET)
     print(colors.UNDERLINE + "-> Data processed in: " + colors.GREEN + colors.BOLD + str(time.time() - start_time) + colors.RESET + colors.UNDERLINE + " seconds" + colors.RESET)
 
-# Example usage
-gtfs_folder = "../../data/raw_gtfs"
-cleaned_gtfs_folder = "../../data/cleaned_gtfs4"
-clean_gtfs_data(gtfs_folder, cleaned_gtfs_folder)
\ No newline at end of file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keeps the routes of some agencies and route types of a GTFS feed.")
+    parser.add_argument("gtfs_folder", nargs="?", default="../../data/raw_gtfs", help="Directory of the raw GTFS files")
+    parser.add_argument("cleaned_gtfs_folder", nargs="?", default="../../data/cleaned_gtfs4", help="Directory to write the cleaned GTFS files")
+    parser.add_argument("--agency", nargs="*", default=list(DEFAULT_AGENCY_IDS), help="Agencies to keep (all of them if the option is given without any)")
+    parser.add_argument("--route-type", nargs="*", type=int, default=list(DEFAULT_ROUTE_TYPES), help="Route types to keep (all of them if the option is given without any)")
+    parser.add_argument("--parquet", action="store_true", help="Also write each cleaned file as Parquet (requires pyarrow)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Number of rows read at once")
+    parser.add_argument("--workers", type=int, default=CLEANING_WORKERS, help="Number of files cleaned at the same time")
+    args = parser.parse_args()
+    clean_gtfs_data(
+        args.gtfs_folder, args.cleaned_gtfs_folder,
+        agency_ids=args.agency or None,
+        route_types=args.route_type or None,
+        write_parquet=args.parquet,
+        chunk_size=args.chunk_size,
+        max_workers=args.workers,
+    )
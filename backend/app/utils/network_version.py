@@ -0,0 +1,58 @@
+import os
+
+# Shared between the API workers and the import scripts: bumping it tells every worker that the
+# GTFS data changed and that its in-memory network has to be rebuilt.
+NETWORK_VERSION_FILE = os.getenv(
+    "NETWORK_VERSION_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "network_version"),
+)
+
+
+# Version read at the last stat of the file: ((mtime, inode, size) of the file or None if missing, version)
+_cached_version = (None, 0)
+
+
+def read_network_version() -> int:
+    """Reads the current version of the network data from its file (0 if it was never bumped)."""
+    try:
+        with open(NETWORK_VERSION_FILE, "r") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def get_network_version() -> int:
+    """Returns the current version of the network data (0 if it was never bumped).
+
+    The file is only read again when its stat changes: every request checks the version, a bump
+    replaces the file and so changes its inode and modification time.
+    """
+    global _cached_version
+    try:
+        stat = os.stat(NETWORK_VERSION_FILE)
+        file_key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+    except FileNotFoundError:
+        file_key = None
+
+    key, version = _cached_version
+    if file_key != key:
+        version = read_network_version()
+        _cached_version = (file_key, version)
+    return version
+
+
+def bump_network_version() -> int:
+    """Increments the network data version, invalidating the caches of every running worker.
+
+    Returns:
+        The new version number.
+    """
+    version = read_network_version() + 1
+    os.makedirs(os.path.dirname(NETWORK_VERSION_FILE), exist_ok=True)
+
+    # Write then rename so that a worker never reads a half written file
+    tmp_file = NETWORK_VERSION_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(str(version))
+    os.replace(tmp_file, NETWORK_VERSION_FILE)
+    return version
@@ -0,0 +1,151 @@
+"""Settled stops and timings of the A* and bidirectional searches against Dijkstra, on random OD pairs.
+
+The static searches of services.graph run on the graph of the synthetic feed (one edge per pair of
+consecutive stops of a trip, weighted by the shortest ride), the time-dependent dijkstra of
+services.journey on its timetable, with and without the TravelTimeBound. Every variant must find
+the same travel time as Dijkstra; exits with an error code on the first mismatch.
+
+The bound is the distance at the speed of the fastest ride, measured once: the closer the trains run
+to that speed, the more stops A* leaves aside. The static searches run again on the graph with a few
+rides taking no time, which the bound takes as shortcuts.
+
+Usage: python benchmarks/bench_astar.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.network import MetroSystem
+from services.timetable_cache import TimetableCache
+from services.timetable import TimetableStore
+from services.journey import dijkstra as time_dependent_dijkstra, dijkstra_revert
+from services.graph import astar, bidirectional_search, dijkstra, get_graph_speed_limit
+from services.lower_bound import TravelTimeBound, get_timetable_speed_limit
+
+# Rides of the static graph set to take no time, as when the feed rounds their times to the minute
+INSTANT_RIDES = 3
+
+
+class CountingSystem(MetroSystem):
+    """MetroSystem counting the stops whose trains a search reads, once per settled stop."""
+
+    settled_stops = 0
+
+    def fastest_stop_times_from(self, stop, leaving_after):
+        self.settled_stops += 1
+        return super().fastest_stop_times_from(stop, leaving_after)
+
+    def latest_stop_times_to(self, stop, arriving_before):
+        self.settled_stops += 1
+        return super().latest_stop_times_to(stop, arriving_before)
+
+
+def get_static_graph(feed):
+    graph = {}
+    previous = None
+    for stop_time in feed.stop_times:
+        if previous is not None and previous.trip is stop_time.trip:
+            travel_time = stop_time.arrival_secs - previous.departure_secs
+            neighbors = graph.setdefault(previous.stop_id, {})
+            neighbors[stop_time.stop_id] = min(travel_time, neighbors.get(stop_time.stop_id, travel_time))
+        previous = stop_time
+    # Changes of line inside a station
+    for transfer in feed.transfers:
+        graph.setdefault(transfer["from_stop_id"], {})[transfer["to_stop_id"]] = transfer["min_transfer_time"]
+        graph.setdefault(transfer["to_stop_id"], {})[transfer["from_stop_id"]] = transfer["min_transfer_time"]
+    return graph
+
+
+def print_results(name, results, queries):
+    for variant, (settled_stops, total_time) in results.items():
+        print(f"{name} {variant:<16} {settled_stops / queries:8.1f} settled stops   {total_time / queries * 1000:7.2f} ms per query")
+
+
+async def run_static_searches(name, graph, coordinates, queries):
+    """Runs the static searches on random pairs of stops, returns the number of mismatches with Dijkstra."""
+    speed_limit = get_graph_speed_limit(graph, coordinates)
+    stops = list(graph)
+    searches = {
+        "dijkstra": lambda start, end: dijkstra(graph, start, end, None),
+        "astar": lambda start, end: astar(graph, start, end, None, coordinates, speed_limit),
+        "bidirectional": lambda start, end: bidirectional_search(graph, start, end, None),
+        "bidirectional A*": lambda start, end: bidirectional_search(graph, start, end, None, coordinates, speed_limit),
+    }
+    mismatches = 0
+    results = {variant: [0, 0] for variant in searches}
+    for _ in range(queries):
+        start, end = random.sample(stops, 2)
+        expected = None
+        for variant, search in searches.items():
+            begin_time = time.perf_counter()
+            result = await search(start, end)
+            results[variant][1] += time.perf_counter() - begin_time
+            results[variant][0] += result["settled_stops"]
+            if expected is None:
+                expected = result["total_time"]
+            elif result["total_time"] != expected:
+                mismatches += 1
+                print(f"Mismatch {start} -> {end}: dijkstra {expected}, {variant} {result['total_time']}")
+    print(f"Static graph: {len(graph)} stops, {queries} queries, bound at {speed_limit[0] * 3.6:.1f} km/h, {len(speed_limit[1])} shortcuts")
+    print_results(name, results, queries)
+    return mismatches
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    random.seed(42)
+
+    # Static graph, between stops
+    graph = get_static_graph(feed)
+    coordinates = {stop.stop_id: (stop.stop_lat, stop.stop_lon) for station in feed.stations_fetch for stop in station["stops"]}
+    mismatches = await run_static_searches("static", graph, coordinates, queries)
+
+    instant_graph = {stop: dict(neighbors) for stop, neighbors in graph.items()}
+    rides = [(stop, neighbor) for stop, neighbors in graph.items() for neighbor in neighbors if coordinates[stop] != coordinates[neighbor]]
+    for stop, neighbor in random.sample(rides, INSTANT_RIDES):
+        instant_graph[stop][neighbor] = 0
+    mismatches += await run_static_searches("instant", instant_graph, coordinates, queries)
+
+    # Time-dependent search on the timetable
+    timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    bound = TravelTimeBound(network, *get_timetable_speed_limit(await timetable_store.get(network, service_date)))
+    print(f"Speed of the bound: {bound.max_speed * 3.6:.1f} km/h")
+
+    stations = list(network.stations)
+    results = {variant: [0, 0] for variant in ("dijkstra", "A*", "dijkstra_revert", "A* revert")}
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(6 * 3600, 21 * 3600))
+        for variant, search, key, window, search_bound in (
+            ("dijkstra", time_dependent_dijkstra, "arrival_date", (date, date + timedelta(hours=1)), None),
+            ("A*", time_dependent_dijkstra, "arrival_date", (date, date + timedelta(hours=1)), bound),
+            ("dijkstra_revert", dijkstra_revert, "departure_date", (date - timedelta(hours=1), date), None),
+            ("A* revert", dijkstra_revert, "departure_date", (date - timedelta(hours=1), date), bound),
+        ):
+            system = CountingSystem(network, await timetable_cache.get_window(network, *window))
+            begin_time = time.perf_counter()
+            result = await search(system, start, end, date, time.time(), search_bound)
+            results[variant][1] += time.perf_counter() - begin_time
+            results[variant][0] += system.settled_stops
+            if search_bound is None:
+                expected = result.get(key)
+            elif result.get(key) != expected:
+                mismatches += 1
+                print(f"Mismatch {start} -> {end} at {date}: {variant} {result.get(key)}, expected {expected}")
+    print(f"Time-dependent search: {len(network.stops)} stops, {queries} queries")
+    print_results("timetable", results, queries)
+
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print("Same results for every query")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,100 @@
+"""Latencies of the route searches and of the cheap requests under a mixed concurrent load.
+
+Sends batches of concurrent searches (dijkstra, csa and isochrone on the synthetic feed) through a
+SearchPool in each mode, while a ticker stands for the cheap requests (stations, routes, cached
+answers) that only need a turn of the event loop. Reports the p50/p99 latency of each kind of
+request: in "inline" mode the searches hold the event loop and the cheap requests wait behind
+them, in "thread" and "process" modes they are answered while the searches run.
+
+The "process" mode only runs searches in parallel on a machine with more than one core; the
+threads share the GIL and mostly keep the event loop responsive.
+
+Usage: python benchmarks/bench_concurrency.py [number of searches] [concurrency] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.network import MetroSystem
+from services.timetable_cache import TimetableCache
+from services.timetable import TimetableStore
+from services.journey import dijkstra
+from services.csa import csa
+from services.isochrone import isochrone
+from services.search_pool import SEARCH_WORKERS, SearchPool
+
+# Interval between two cheap requests, in seconds
+TICK_INTERVAL = 0.005
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+async def run_mode(mode, feed, network, searches, concurrency):
+    timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await timetable_store.get(network, service_date)
+    pool = SearchPool(mode, SEARCH_WORKERS, queue_limit=concurrency)
+    # Forks the worker processes before the timings
+    await pool.run_timetable_search(len, timetable)
+
+    random.seed(42)
+    stations = list(network.stations)
+    search_latencies = {"dijkstra": [], "csa": [], "isochrone": []}
+    tick_latencies = []
+    running = True
+
+    async def ticker():
+        while running:
+            begin_time = time.perf_counter()
+            await asyncio.sleep(TICK_INTERVAL)
+            tick_latencies.append(time.perf_counter() - begin_time - TICK_INTERVAL)
+
+    async def search(kind, start, end, date):
+        begin_time = time.perf_counter()
+        if kind == "dijkstra":
+            graph = MetroSystem(network, await timetable_cache.get_window(network, date, date + timedelta(hours=1)))
+            await pool.run_graph_search(dijkstra, graph, start, end, date, time.time())
+        elif kind == "csa":
+            await pool.run_timetable_search(csa, timetable, start, end, date, time.time())
+        else:
+            await pool.run_timetable_search(isochrone, timetable, start, date, time.time(), 120, None)
+        search_latencies[kind].append(time.perf_counter() - begin_time)
+
+    queries = []
+    for number in range(searches):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(6 * 3600, 21 * 3600))
+        queries.append((("dijkstra", "csa", "isochrone")[number % 3], start, end, date))
+
+    ticker_task = asyncio.create_task(ticker())
+    begin_time = time.perf_counter()
+    for offset in range(0, searches, concurrency):
+        await asyncio.gather(*[search(*query) for query in queries[offset:offset + concurrency]])
+    total_time = time.perf_counter() - begin_time
+    running = False
+    await ticker_task
+    pool.shutdown()
+
+    print(f"{mode}: {searches / total_time:.1f} searches/s")
+    for kind, latencies in search_latencies.items():
+        print(f"  {kind:<10} p50 {percentile(latencies, 0.5) * 1000:8.1f} ms   p99 {percentile(latencies, 0.99) * 1000:8.1f} ms")
+    print(f"  {'cheap':<10} p50 {percentile(tick_latencies, 0.5) * 1000:8.1f} ms   p99 {percentile(tick_latencies, 0.99) * 1000:8.1f} ms   max {max(tick_latencies) * 1000:.1f} ms ({len(tick_latencies)} requests)")
+
+
+async def main(searches, concurrency):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    print(f"{searches} searches, {concurrency} at a time, {SEARCH_WORKERS} workers")
+    for mode in ("inline", "thread", "process"):
+        await run_mode(mode, feed, network, searches, concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 60, int(sys.argv[2]) if len(sys.argv) > 2 else 6))
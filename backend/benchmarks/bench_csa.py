@@ -0,0 +1,75 @@
+"""Parity check and timings of the Connection Scan Algorithm against the dijkstra search.
+
+Both engines answer the same random queries on the synthetic feed, forward and backward, and must
+find the same arrival (or departure) dates. The dijkstra search grows its window from the hour of
+the query, across midnight, as the timetable of a service day holds the trips of the previous and
+next days running around its midnight. Exits with an error code on the first mismatch.
+
+Usage: python benchmarks/bench_csa.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.network import MetroSystem
+from services.timetable_cache import TimetableCache
+from services.timetable import TimetableStore, get_service_date
+from services.journey import dijkstra, dijkstra_revert
+from services.csa import csa, csa_revert
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await timetable_store.get(network, service_date)
+
+    async def get_graph(begin, end):
+        return MetroSystem(network, await timetable_cache.get_window(network, begin, end))
+
+    random.seed(42)
+    stations = list(network.stations)
+    timings = {"dijkstra": 0, "csa": 0, "dijkstra_revert": 0, "csa_revert": 0}
+    mismatches = 0
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(0, 24 * 3600 - 1))
+
+        graph = await get_graph(date, date + timedelta(hours=1))
+        begin_time = time.time()
+        expected = await dijkstra(graph, start, end, date, begin_time)
+        timings["dijkstra"] += time.time() - begin_time
+        begin_time = time.time()
+        result = csa(await timetable_store.get(network, get_service_date(date, True)), start, end, date, begin_time)
+        timings["csa"] += time.time() - begin_time
+        if expected.get("arrival_date") != result.get("arrival_date"):
+            mismatches += 1
+            print(f"Mismatch {start} -> {end} at {date}: dijkstra {expected.get('arrival_date')}, csa {result.get('arrival_date')}")
+
+        graph = await get_graph(date - timedelta(hours=1), date)
+        begin_time = time.time()
+        expected = await dijkstra_revert(graph, start, end, date, begin_time)
+        timings["dijkstra_revert"] += time.time() - begin_time
+        begin_time = time.time()
+        result = csa_revert(await timetable_store.get(network, get_service_date(date, False)), start, end, date, begin_time)
+        timings["csa_revert"] += time.time() - begin_time
+        if expected.get("departure_date") != result.get("departure_date"):
+            mismatches += 1
+            print(f"Mismatch {start} <- {end} at {date}: dijkstra_revert {expected.get('departure_date')}, csa_revert {result.get('departure_date')}")
+
+    print(f"{len(timetable)} connections, {queries} queries")
+    for name, total in timings.items():
+        print(f"{name}: {total / queries * 1000:.2f} ms per query")
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print("Same results for every query")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
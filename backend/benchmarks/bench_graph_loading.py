@@ -0,0 +1,83 @@
+"""Compares the set-based loading of services.graph.get_metro_graph with the former per trip queries.
+
+The former loader ran one query per metro route for its trips, then one query per trip for its stop
+times; the current one streams every stop time of the day from a single query. Both are run against
+the database filled by populate_database.py, and the number of round trips, the time and the edges
+of each are reported. The StopPoint filter of get_metro_graph is left out of both, so that every
+edge is compared whatever the stop IDs look like.
+
+Usage: python benchmarks/bench_graph_loading.py 2024-06-10 (from the backend directory, DATABASE_URL set)
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from tortoise import Tortoise
+from db_config.config import DATABASE_URL
+from db_config.models import Route, StopTime, Trip
+from services.calendar import service_calendar
+from services.graph import STOP_TIMES_PREFETCH, iter_route_stop_times
+
+
+async def get_graph_per_trip(date):
+    """The former loader, one query per route and per trip."""
+    queries = 1
+    metro_routes = await Route.filter(route_type=1)
+    active_services = await service_calendar.get_active_services(date.strftime("%Y%m%d"))
+    trips = []
+    for route in metro_routes:
+        trips.extend(await Trip.filter(route=route, service_id__in=active_services).all())
+        queries += 1
+
+    graph = {}
+    for trip in trips:
+        stop_times = await StopTime.filter(trip=trip).order_by("stop_sequence").all()
+        queries += 1
+        for stop_time, next_stop_time in zip(stop_times, stop_times[1:]):
+            graph.setdefault(stop_time.stop_id, {})[next_stop_time.stop_id] = next_stop_time.arrival_secs - stop_time.departure_secs
+    return graph, queries
+
+
+async def get_graph_set_based(date):
+    """The current loader, one query read through a server-side cursor."""
+    rows = 0
+    graph = {}
+    previous_trip_id = previous_stop_id = previous_departure = None
+    async for trip_id, stop_id, _, arrival_secs, departure_secs in iter_route_stop_times(date.strftime("%Y%m%d")):
+        rows += 1
+        if trip_id == previous_trip_id:
+            graph.setdefault(previous_stop_id, {})[stop_id] = arrival_secs - previous_departure
+        previous_trip_id, previous_stop_id, previous_departure = trip_id, stop_id, departure_secs
+    return graph, 1 + rows // STOP_TIMES_PREFETCH
+
+
+def edges(graph):
+    return {(stop_id, next_stop_id): travel_time for stop_id, neighbors in graph.items() for next_stop_id, travel_time in neighbors.items()}
+
+
+async def main(args):
+    date = datetime.datetime.strptime(args.date, "%Y-%m-%d")
+    await Tortoise.init(db_url=DATABASE_URL, modules={"models": ["db_config.models"]})
+    try:
+        await service_calendar.get()
+        results = {}
+        for name, load in (("per trip queries", get_graph_per_trip), ("set-based cursor", get_graph_set_based)):
+            begin_time = time.time()
+            graph, queries = await load(date)
+            print(f"{name}: {time.time() - begin_time:.2f} seconds, {queries} round trips, {len(edges(graph))} edges")
+            results[name] = edges(graph)
+    finally:
+        await Tortoise.close_connections()
+
+    print("Same edges: " + str(results["per trip queries"] == results["set-based cursor"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the loaders of the metro graph.")
+    parser.add_argument("date", help="Service day (YYYY-MM-DD)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+"""Parity check and timings of the one-to-all isochrone search against one dijkstra search per station.
+
+For random origins, the arrival date of every station must match the one of a dijkstra search
+towards it, as /shortest_path computes them today. Exits with an error code on the first mismatch.
+
+Usage: python benchmarks/bench_isochrone.py [number of origins] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.network import MetroSystem
+from services.timetable_cache import TimetableCache
+from services.timetable import TimetableStore
+from services.journey import dijkstra
+from services.isochrone import isochrone
+
+
+async def main(origins):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await timetable_store.get(network, service_date)
+
+    random.seed(42)
+    stations = list(network.stations)
+    timings = {"isochrone": 0, "dijkstra per station": 0}
+    mismatches = 0
+    for _ in range(origins):
+        start = random.choice(stations)
+        date = service_date + timedelta(seconds=random.randint(0, 24 * 3600 - 1))
+
+        begin_time = time.time()
+        result = isochrone(timetable, start, date, begin_time, max_duration=120)
+        timings["isochrone"] += time.time() - begin_time
+        arrivals = {station["station_id"]: station["arrival_date"] for station in result["stations"]}
+
+        begin_time = time.time()
+        graph = MetroSystem(network, await timetable_cache.get_window(network, date, date + timedelta(hours=1)))
+        for end in stations:
+            if end == start:
+                continue
+            expected = (await dijkstra(graph, start, end, date, begin_time)).get("arrival_date")
+            if expected is not None and expected > date + timedelta(minutes=120):
+                expected = None
+            if arrivals.get(end) != expected:
+                mismatches += 1
+                print(f"Mismatch {start} -> {end} at {date}: dijkstra {expected}, isochrone {arrivals.get(end)}")
+        timings["dijkstra per station"] += time.time() - begin_time
+
+    print(f"{len(stations)} stations, {origins} origins")
+    for name, total in timings.items():
+        print(f"{name}: {total / origins * 1000:.2f} ms per origin")
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print("Same arrivals for every station")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
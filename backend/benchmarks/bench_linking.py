@@ -0,0 +1,59 @@
+"""Compares the stop time linking of get_metro_graph with the former quadratic loop.
+
+Usage: python benchmarks/bench_linking.py (from the backend directory)
+"""
+import datetime
+import time
+from synthetic_feed import SyntheticFeed
+from stop_time_objects import LinkedTrip, StopTimes, get_date_from_stop_time_arrival, get_date_from_stop_time_departure, link_stop_times
+
+
+def link_stop_times_quadratic(trips):
+    for trip in trips:
+        for stop_time in trip.stops:
+            for stop_time2 in trip.stops:
+                if not stop_time.next_stop_time and stop_time.departure_time < stop_time2.arrival_time:
+                    stop_time.next_stop_time = stop_time2
+                elif stop_time.departure_time < stop_time2.arrival_time < stop_time.next_stop_time.arrival_time:
+                    stop_time.next_stop_time = stop_time2
+                elif not stop_time.previous_stop_time and stop_time.arrival_time > stop_time2.departure_time:
+                    stop_time.previous_stop_time = stop_time2
+                elif stop_time.arrival_time > stop_time2.departure_time > stop_time.previous_stop_time.departure_time:
+                    stop_time.previous_stop_time = stop_time2
+
+
+def build_trips(feed, network, service_date):
+    trips = {}
+    for row in feed.stop_times:
+        try:
+            trip = trips[row.trip_id]
+        except KeyError:
+            trip = LinkedTrip(row.trip_id, network.routes[row.trip.route_id], row.trip.direction_id)
+            trips[row.trip_id] = trip
+        trip.stops.append(StopTimes(trip, network.stops[row.stop_id], get_date_from_stop_time_arrival(row, service_date), get_date_from_stop_time_departure(row, service_date), row.stop_sequence))
+    return list(trips.values())
+
+
+def links(trips):
+    return [(stop_time.previous_stop_time and stop_time.previous_stop_time.stop_sequence, stop_time.next_stop_time and stop_time.next_stop_time.stop_sequence) for trip in trips for stop_time in sorted(trip.stops, key=lambda stop_time: stop_time.stop_sequence)]
+
+
+def main():
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    service_date = datetime.datetime(2024, 6, 10)
+    print(f"{len(feed.stop_times)} stop times, {len(set(row.trip_id for row in feed.stop_times))} trips")
+
+    results = {}
+    for name, link in (("quadratic loop", link_stop_times_quadratic), ("sequence sort", link_stop_times)):
+        trips = build_trips(feed, network, service_date)
+        begin_time = time.time()
+        link(trips)
+        print(f"{name}: {time.time() - begin_time:.3f} seconds")
+        results[name] = links(trips)
+
+    print("Same links: " + str(results["quadratic loop"] == results["sequence sort"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Timings of the travel time matrix with a growing number of worker processes.
+
+Computes the full station to station matrix of the synthetic feed in the current process, then
+with MatrixPool for each number of workers, and checks that every matrix is the same.
+
+Usage: python benchmarks/bench_matrix.py [max number of workers] (from the backend directory)
+"""
+import asyncio
+import datetime
+import os
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.timetable import TimetableStore
+from services.matrix import MatrixPool, compute_travel_times, get_matrix_stations, matrix_to_npy
+
+
+async def main(max_workers):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await timetable_store.get(network, service_date)
+    date = service_date + timedelta(hours=8)
+
+    _, stations = get_matrix_stations(timetable, None)
+    begin_time = time.time()
+    expected = [compute_travel_times(timetable, stops, stations, timetable.get_seconds(date), 180 * 60) for stops in stations]
+    sequential_time = time.time() - begin_time
+    print(f"{len(stations)}x{len(stations)} matrix, {os.cpu_count()} cores")
+    print(f"sequential: {sequential_time:.2f} s")
+
+    workers = 1
+    while workers <= max_workers:
+        pool = MatrixPool(workers)
+        [row async for row in pool.rows(timetable, stations[:workers], stations, date, 180)]  # start the workers
+        begin_time = time.time()
+        rows = [row async for row in pool.rows(timetable, stations, stations, date, 180)]
+        elapsed = time.time() - begin_time
+        pool.shutdown()
+        print(f"{workers} workers: {elapsed:.2f} s, speedup {sequential_time / elapsed:.1f}x")
+        if rows != expected:
+            print("Different matrix")
+            sys.exit(1)
+        workers *= 2
+
+    print(f"Same matrix for every pool, {len(matrix_to_npy(expected))} bytes as .npy")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()))
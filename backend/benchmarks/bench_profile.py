@@ -0,0 +1,67 @@
+"""One profile query against one CSA query per departure minute over the same interval.
+
+Every pair of the profile must be the CSA answer for its departure time, and for every minute of
+the interval CSA must not find an earlier arrival than the profile, unless its journey leaves after
+the end of the interval or lasts more than MAX_DURATION (waiting for the first trains of the day).
+
+Usage: python benchmarks/bench_profile.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.timetable import TimetableStore
+from services.csa import csa, profile_csa, get_profile_arrival
+
+WINDOW = 60
+MAX_DURATION = 3 * 3600
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await TimetableStore(feed.fetch_service_day).get(network, service_date)
+
+    random.seed(42)
+    stations = list(network.stations)
+    profile_time = 0
+    minutes_time = 0
+    errors = 0
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(0, 24 * 3600 - 1))
+
+        begin_time = time.time()
+        profile = profile_csa(timetable, start, end, date, date + timedelta(minutes=WINDOW), MAX_DURATION, begin_time)["profile"]
+        profile_time += time.time() - begin_time
+
+        for journey in profile:
+            if csa(timetable, start, end, journey["departure_date"], begin_time)["arrival_date"] != journey["arrival_date"]:
+                errors += 1
+                print(f"Wrong pair {start} -> {end} leaving at {journey['departure_date']}")
+
+        pairs = ([timetable.get_seconds(journey["departure_date"]) for journey in profile], [timetable.get_seconds(journey["arrival_date"]) for journey in profile])
+        begin_time = time.time()
+        for minute in range(WINDOW + 1):
+            departure = date + timedelta(minutes=minute)
+            journey = csa(timetable, start, end, departure, begin_time)
+            if journey["stops"][0]["departure_time"] > date + timedelta(minutes=WINDOW) or (journey["arrival_date"] - journey["stops"][0]["departure_time"]).total_seconds() > MAX_DURATION:
+                continue
+            if timetable.get_seconds(journey["arrival_date"]) < get_profile_arrival(pairs, timetable.get_seconds(departure)):
+                errors += 1
+                print(f"Missing pair {start} -> {end} leaving after {departure}")
+        minutes_time += time.time() - begin_time
+
+    print(f"{queries} intervals of {WINDOW} minutes")
+    print(f"profile: {profile_time / queries * 1000:.2f} ms per interval")
+    print(f"csa every minute: {minutes_time / queries * 1000:.2f} ms per interval")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
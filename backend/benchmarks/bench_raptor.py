@@ -0,0 +1,73 @@
+"""Latency of the RAPTOR router against the dijkstra and CSA engines.
+
+The earliest journey of the Pareto set returned by RAPTOR must arrive at the same time as the CSA
+one, and the journeys must have strictly fewer transfers as they arrive later.
+
+Usage: python benchmarks/bench_raptor.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import sys
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.network import MetroSystem
+from services.timetable_cache import TimetableCache
+from services.timetable import TimetableStore
+from services.journey import dijkstra
+from services.csa import csa
+from services.raptor import raptor, get_route_patterns
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await TimetableStore(feed.fetch_service_day).get(network, service_date)
+
+    begin_time = time.time()
+    patterns, _ = get_route_patterns(timetable)
+    print(f"{len(patterns)} route patterns built in {time.time() - begin_time:.3f} seconds")
+
+    random.seed(42)
+    stations = list(network.stations)
+    timings = {"dijkstra (graph build included)": 0, "csa": 0, "raptor": 0}
+    errors = 0
+    pareto_sizes = 0
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(0, 24 * 3600 - 1))
+
+        begin_time = time.time()
+        graph = MetroSystem(network, await timetable_cache.get_window(network, date, date + timedelta(hours=1)))
+        await dijkstra(graph, start, end, date, begin_time)
+        timings["dijkstra (graph build included)"] += time.time() - begin_time
+
+        begin_time = time.time()
+        expected = csa(timetable, start, end, date, begin_time)
+        timings["csa"] += time.time() - begin_time
+
+        begin_time = time.time()
+        journeys = raptor(timetable, start, end, date, begin_time)["journeys"]
+        timings["raptor"] += time.time() - begin_time
+        pareto_sizes += len(journeys)
+
+        if journeys[-1]["arrival_date"] != expected["arrival_date"]:
+            errors += 1
+            print(f"Mismatch {start} -> {end} at {date}: csa {expected['arrival_date']}, raptor {journeys[-1]['arrival_date']}")
+        for faster, slower in zip(journeys[1:], journeys):
+            if not (faster["transfers"] > slower["transfers"] and faster["arrival_date"] < slower["arrival_date"]):
+                errors += 1
+                print(f"Dominated journey {start} -> {end} at {date}")
+
+    print(f"{queries} queries, {pareto_sizes / queries:.2f} journeys per Pareto set")
+    for name, total in timings.items():
+        print(f"{name}: {total / queries * 1000:.2f} ms per query")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
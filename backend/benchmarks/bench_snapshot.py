@@ -0,0 +1,85 @@
+"""Startup time and memory of a worker mapping the binary snapshot, against building from rows.
+
+Writes the synthetic network and one service day as a snapshot, then compares the time and the
+memory traced by tracemalloc to get a ready timetable (network, connections and route patterns)
+either way. CSA and RAPTOR must return the same journeys on both timetables; exits with an error
+code on the first mismatch.
+
+Usage: python benchmarks/bench_snapshot.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.timetable import build_timetable, load_timetable_rows
+from services.csa import csa
+from services.raptor import raptor, get_route_patterns
+from services.snapshot import Snapshot, write_snapshot
+
+
+def measure(name, build):
+    begin_time = time.time()
+    build()
+    elapsed = time.time() - begin_time
+
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}: ready in {elapsed * 1000:.1f} ms, {size / 1024 / 1024:.1f} MB allocated")
+    return result
+
+
+def without_timing(result):
+    result = dict(result)
+    result.pop("total_execution_time", None)
+    return result
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    service_date = datetime.datetime(2024, 6, 10)
+    rows = await load_timetable_rows(feed.fetch_service_day, service_date)
+
+    def build_from_rows():
+        timetable = build_timetable(service_date, feed.build_network(), *rows)
+        get_route_patterns(timetable)
+        return timetable
+
+    timetable = build_from_rows()
+    path = os.path.join(tempfile.mkdtemp(), "network.snapshot")
+    begin_time = time.time()
+    size = write_snapshot(path, 0, feed.route_fetch, feed.stations_fetch, feed.transfers, [timetable])
+    print(f"{len(timetable)} connections, snapshot of {size / 1024 / 1024:.1f} MB written in {time.time() - begin_time:.2f} s")
+
+    built = measure("build from rows", build_from_rows)
+    mapped = measure("map snapshot", lambda: Snapshot(path).get_timetable(service_date))
+
+    random.seed(42)
+    stations = list(built.network.stations)
+    mismatches = 0
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(6 * 3600, 21 * 3600))
+        for name, engine in (("csa", csa), ("raptor", raptor)):
+            expected = without_timing(engine(built, start, end, date, time.time()))
+            result = without_timing(engine(mapped, start, end, date, time.time()))
+            if result != expected:
+                mismatches += 1
+                print(f"Mismatch {start} -> {end} at {date} with {name}")
+
+    os.remove(path)
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print(f"{queries} queries, same journeys from both timetables")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,77 @@
+"""Memory used by a full service day in the timetable cache, against one StopTimes object per row.
+
+Loads every hour of the synthetic day into a TimetableCache, then builds the same stop times as
+linked StopTimes objects, as the cache stored them before, and reports for each the memory traced
+by tracemalloc, the number of objects tracked by the garbage collector and the build time.
+
+Usage: python benchmarks/bench_timetable_memory.py (from the backend directory)
+"""
+import asyncio
+import datetime
+import gc
+import time
+import tracemalloc
+from synthetic_feed import SyntheticFeed
+from stop_time_objects import LinkedTrip, StopTimes, get_date_from_stop_time_arrival, get_date_from_stop_time_departure, link_stop_times
+from services.timetable_cache import TimetableCache
+
+
+def build_stop_times(feed, network, service_date):
+    trips = {}
+    stop_times = []
+    for row in feed.stop_times:
+        try:
+            trip = trips[row.trip_id]
+        except KeyError:
+            trip = LinkedTrip(row.trip_id, network.routes[row.trip.route_id], row.trip.direction_id)
+            trip.head_stop = row.trip.trip_headsign
+            trips[row.trip_id] = trip
+        stop_time = StopTimes(trip, network.stops[row.stop_id], get_date_from_stop_time_arrival(row, service_date), get_date_from_stop_time_departure(row, service_date), row.stop_sequence)
+        trip.stops.append(stop_time)
+        stop_times.append(stop_time)
+    link_stop_times(trips.values())
+    return stop_times
+
+
+async def measure(name, build):
+    begin_time = time.time()
+    await build()
+    elapsed = time.time() - begin_time
+
+    gc.collect()
+    objects = len(gc.get_objects())
+    tracemalloc.start()
+    result = await build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}: {size / 1024 / 1024:.1f} MB, {len(gc.get_objects()) - objects} objects tracked by the gc, built in {elapsed:.2f} s")
+    return result
+
+
+async def main():
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    service_date = datetime.datetime(2024, 6, 10)
+    for hour in range(24 + 3):
+        await feed.fetch_stop_times_bucket(service_date.strftime("%Y%m%d"), hour)
+    print(f"{len(feed.stop_times)} stop times")
+
+    async def build_cache():
+        cache = TimetableCache(feed.fetch_stop_times_bucket)
+        cache.set_network(network)
+        for hour in range(24 + 3):
+            await cache.get_slice(service_date, hour)
+        return cache
+
+    async def build_objects():
+        return build_stop_times(feed, network, service_date)
+
+    cache = await measure("compact slices", build_cache)
+    print(f"  cache size accounted: {cache.size / 1024 / 1024:.1f} MB")
+    cache = None
+    await measure("StopTimes objects", build_objects)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
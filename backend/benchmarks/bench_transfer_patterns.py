@@ -0,0 +1,76 @@
+"""Build report and query timings of the transfer pattern index against the Connection Scan Algorithm.
+
+Builds the index of the synthetic feed, saves and reloads it, then answers random queries with
+both searches. The patterns hold the optimal journey of every departure time: a journey found on
+the query graph and covered by the index must arrive with the CSA one, exits with an error code
+otherwise.
+
+Usage: python benchmarks/bench_transfer_patterns.py [number of queries] (from the backend directory)
+"""
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from synthetic_feed import SyntheticFeed
+from services.timetable import TimetableStore
+from services.csa import csa
+from services.raptor import get_route_patterns
+from services.transfer_patterns import build_transfer_patterns, load_transfer_patterns, save_transfer_patterns, transfer_pattern_search
+
+
+async def main(queries):
+    feed = SyntheticFeed()
+    network = feed.build_network()
+    timetable_store = TimetableStore(feed.fetch_service_day)
+    service_date = datetime.datetime(2024, 6, 10)
+    timetable = await timetable_store.get(network, service_date)
+    get_route_patterns(timetable)
+
+    begin_time = time.time()
+    index = build_transfer_patterns(timetable, 0, "")
+    build_time = time.time() - begin_time
+    path = os.path.join(tempfile.mkdtemp(), "transfer_patterns.json.gz")
+    size = save_transfer_patterns(index, path)
+    begin_time = time.time()
+    index = load_transfer_patterns(path)
+    load_time = time.time() - begin_time
+    pairs = sum(len(destinations) for destinations in index.patterns.values())
+    patterns = sum(len(end_patterns) for destinations in index.patterns.values() for end_patterns in destinations.values())
+    print(f"built in {build_time:.1f} s, {pairs} pairs, {patterns} patterns, {size / 1024:.1f} KB, loaded in {load_time:.2f} s")
+
+    random.seed(42)
+    stations = list(network.stations)
+    timings = {"csa": 0, "transfer patterns": 0}
+    later = missing = uncovered = 0
+    for _ in range(queries):
+        start, end = random.sample(stations, 2)
+        date = service_date + timedelta(seconds=random.randint(6 * 3600, 21 * 3600))
+
+        begin_time = time.time()
+        expected = csa(timetable, start, end, date, begin_time)
+        timings["csa"] += time.time() - begin_time
+        begin_time = time.time()
+        result = transfer_pattern_search(timetable, index, start, end, date, begin_time)
+        timings["transfer patterns"] += time.time() - begin_time
+
+        if not result:
+            missing += 1
+        elif not index.covers(date, result["arrival_date"]):
+            uncovered += 1
+        elif result["arrival_date"] != expected["arrival_date"]:
+            later += 1
+            print(f"Mismatch {start} -> {end} at {date}: csa {expected['arrival_date']}, transfer patterns {result['arrival_date']}")
+
+    for name, total in timings.items():
+        print(f"{name}: {total / queries * 1000:.3f} ms per query")
+    print(f"{queries - later - missing - uncovered} same arrivals, {later} mismatches, {missing} without journey and {uncovered} longer than the index (full search fallback)")
+    if later:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,60 @@
+"""The stop times as linked objects, one per row, as the graph searches read them before the timetable cache.
+
+Only the benchmarks comparing against that former storage use them.
+"""
+import datetime
+from datetime import timedelta
+from synthetic_feed import FakeStopTime
+from services.network import Routes, Stops, Trips
+
+
+class LinkedTrip(Trips):
+    def __init__(self, trip_id: str, route: Routes, direction: int):
+        super().__init__(trip_id, route, direction)
+        self.stops = []
+
+
+class StopTimes:
+    def __init__(self, trip: Trips, stop: Stops, arrival_time: datetime.datetime, departure_time: datetime.datetime, stop_sequence: int):
+        self.stop = stop
+        self.trip = trip
+        self.arrival_time = arrival_time
+        self.departure_time = departure_time
+        self.stop_sequence = stop_sequence
+        self.next_stop_time = None
+        self.previous_stop_time = None
+
+    def __str__(self):
+        return str({
+            "arrival time": self.arrival_time,
+            "departure time": self.departure_time,
+        })
+
+
+def get_date_from_stop_time_departure(next_time: FakeStopTime, date: datetime.datetime):
+    return datetime.datetime.combine(date.date(), datetime.time()) + timedelta(seconds=next_time.departure_secs)
+
+
+def get_date_from_stop_time_arrival(next_time: FakeStopTime, date: datetime.datetime):
+    return datetime.datetime.combine(date.date(), datetime.time()) + timedelta(seconds=next_time.arrival_secs)
+
+
+def link_stop_times(trips):
+    """Links every stop time of the given trips to the previous and next stop times of its trip.
+
+    The stop times are ordered by stop_sequence and not by time, so the trips running past
+    midnight (times after 24:00) are linked like any other. Runs in linear time as the stop
+    times of a trip are almost always already in order.
+    """
+    for trip in trips:
+        trip.stops.sort(key=lambda stop_time: stop_time.stop_sequence)
+
+        previous_stop_time = None
+        for stop_time in trip.stops:
+            stop_time.previous_stop_time = previous_stop_time
+            if previous_stop_time:
+                previous_stop_time.next_stop_time = stop_time
+            previous_stop_time = stop_time
+
+        if previous_stop_time:
+            previous_stop_time.next_stop_time = None
@@ -0,0 +1,113 @@
+"""Synthetic full-day metro feed used by the benchmarks.
+
+The network is a grid: horizontal lines go through every column of their row and vertical lines
+through every row of their column, so each vertical line crosses every horizontal one. Every line
+has one stop per station it serves, and the stops of a same station are linked by transfers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+
+class FakeStop:
+    def __init__(self, stop_id, stop_name, stop_lat, stop_lon, parent_station):
+        self.stop_id = stop_id
+        self.stop_name = stop_name
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.parent_station = parent_station
+
+
+class FakeTrip:
+    def __init__(self, trip_id, route_id, direction_id, trip_headsign, service_id):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.direction_id = direction_id
+        self.trip_headsign = trip_headsign
+        self.service_id = service_id
+
+
+class FakeStopTime:
+    def __init__(self, trip, stop_id, arrival_secs, departure_secs, stop_sequence):
+        self.trip = trip
+        self.trip_id = trip.trip_id
+        self.stop_id = stop_id
+        self.arrival_time = format_time(arrival_secs)
+        self.departure_time = format_time(departure_secs)
+        self.arrival_secs = arrival_secs
+        self.departure_secs = departure_secs
+        self.stop_sequence = stop_sequence
+
+
+def format_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class SyntheticFeed:
+    def __init__(self, rows=8, columns=30, vertical_lines=8, headway=240, first_departure=5 * 3600 + 30 * 60, last_departure=24 * 3600 + 30 * 60, run_time=90, dwell_time=20, transfer_time=120):
+        self.route_fetch = []
+        self.stations_fetch = []
+        self.transfers = []
+        self.stop_times = []
+
+        stations = {}
+        lines = []
+        for row in range(rows):
+            lines.append([(row, column) for column in range(columns)])
+        step = max(columns // vertical_lines, 1)
+        for column in range(0, step * vertical_lines, step):
+            lines.append([(row, column) for row in range(rows)])
+
+        for line, cells in enumerate(lines):
+            route_id = f"SYN:L{line + 1}"
+            self.route_fetch.append({"route_id": route_id, "route_long_name": f"Ligne {line + 1}"})
+
+            stop_ids = []
+            for (row, column) in cells:
+                station_id = f"SYN:{row}-{column}"
+                station = stations.setdefault(station_id, {
+                    "parent_station": station_id,
+                    "stop_name": f"Station {row}-{column}",
+                    "barycenter_lat": 48.80 + row * 0.01,
+                    "barycenter_lon": 2.25 + column * 0.007,
+                    "route_ids": [],
+                    "stops": [],
+                    "route_ids_with_sequences": [],
+                })
+                stop = FakeStop(f"{station_id}:L{line + 1}", station["stop_name"], station["barycenter_lat"], station["barycenter_lon"], station_id)
+                for other_stop in station["stops"]:
+                    self.transfers.append({"from_stop_id": other_stop.stop_id, "to_stop_id": stop.stop_id, "transfer_type": 2, "min_transfer_time": transfer_time})
+                station["route_ids"].append(route_id)
+                station["stops"].append(stop)
+                stop_ids.append(stop.stop_id)
+
+            for direction, sequence in enumerate((stop_ids, stop_ids[::-1])):
+                headsign = stations[sequence[-1].rsplit(":", 1)[0]]["stop_name"]
+                for count, start in enumerate(range(first_departure, last_departure, headway)):
+                    trip = FakeTrip(f"{route_id}:{direction}:{count}", route_id, direction, headsign, "SYN:service")
+                    for index, stop_id in enumerate(sequence):
+                        arrival = start + index * (run_time + dwell_time)
+                        self.stop_times.append(FakeStopTime(trip, stop_id, arrival, arrival + dwell_time, index + 1))
+
+        self.stations_fetch = list(stations.values())
+
+    def build_network(self):
+        from services.network import build_static_network
+        return build_static_network(self.route_fetch, self.stations_fetch, self.transfers)
+
+    def rows(self):
+        """Returns the stop times as the tuples of main.fetch_service_day."""
+        return [(row.trip_id, row.trip.route_id, row.stop_id, row.stop_sequence, row.arrival_secs, row.departure_secs) for row in self.stop_times]
+
+    async def fetch_stop_times_bucket(self, date_str, hour):
+        """Returns the stop times leaving during one hour as the tuples of main.fetch_stop_times_bucket."""
+        if not hasattr(self, "buckets"):
+            self.buckets = {}
+            for row in self.stop_times:
+                self.buckets.setdefault(row.departure_secs // 3600, []).append((row.trip_id, row.trip.route_id, row.trip.direction_id, row.trip.trip_headsign, row.stop_id, row.stop_sequence, row.arrival_secs, row.departure_secs))
+        return self.buckets.get(hour, [])
+
+    async def fetch_service_day(self, date_str, begin_secs=None, end_secs=None):
+        """Returns the stop times leaving between two times as the tuples of main.fetch_service_day."""
+        return [row for row in self.rows() if (begin_secs is None or row[5] >= begin_secs) and (end_secs is None or row[5] < end_secs)]
@@ -3,95 +3,189 @@ import pandas as pd
 from tortoise import Tortoise
 from app.db_config.models import *
 from app.db_config.config import DATABASE_URL
+from app.utils.network_version import bump_network_version
 import asyncio
 
-BATCH_SIZE = 1500
+# Rows read from a file and sent in a single COPY
+CHUNK_SIZE = 500000
+
+# Values of the empty cells of the columns the models don't allow to be null
+DEFAULT_VALUES = {
+    "zone_id": 0,
+    "stop_timezone": "Europe/Paris",
+}
+
+# Columns computed from a GTFS time column (HH:MM:SS), in seconds since the start of the service day.
+# GTFS leaves the times of the stops between two timepoints empty, both stay null.
+SECONDS_COLUMNS = {
+    "arrival_secs": "arrival_time",
+    "departure_secs": "departure_time",
+}
+
+
+def get_seconds(series):
+    """Converts a column of GTFS times (HH:MM:SS, hours can go past 23) to seconds, the empty times to null."""
+    parts = series.str.extract(r"^\s*(\d+):(\d+):(\d+)\s*$").apply(pd.to_numeric).astype("Int32")
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def get_records(model, df):
+    """Converts a chunk of a GTFS file to the columns and records of a model table.
+
+    The cells are read as strings and converted column by column to the type of the model field,
+    empty cells becoming None (or their value in DEFAULT_VALUES). The columns of SECONDS_COLUMNS
+    are computed from the times they come from.
+
+    Returns:
+        The database columns found in the file, and one tuple per row.
+    """
+    columns = []
+    values = []
+    for field_name, column in model._meta.fields_db_projection.items():
+        if column in model._meta.generated_db_fields:
+            continue
+        if column in df.columns:
+            series = df[column]
+        elif SECONDS_COLUMNS.get(column) in df.columns:
+            series = get_seconds(df[SECONDS_COLUMNS[column]])
+        else:
+            continue
+
+        if column in DEFAULT_VALUES:
+            series = series.fillna(str(DEFAULT_VALUES[column]))
+        field_type = model._meta.fields_map[field_name].field_type
+        if field_type is int:
+            series = pd.to_numeric(series).astype("Int64")
+        elif field_type is float:
+            series = pd.to_numeric(series)
+        elif field_type is bool:
+            series = pd.to_numeric(series).astype("Int64").astype("boolean")
+
+        series = series.astype(object)
+        columns.append(column)
+        values.append(series.where(series.notna(), None).tolist())
+    return columns, list(zip(*values))
+
+
+async def copy_records(model, columns, records, key_field=None):
+    """Sends records to the table of a model with COPY.
+
+    Without a key the records are copied straight into the table. With one they go through a
+    temporary table first, and only the ones whose key is not in the table yet are inserted.
+
+    Returns:
+        The number of rows inserted.
+    """
+    table = model._meta.db_table
+    connection_client = Tortoise.get_connection("default")
+    async with connection_client.acquire_connection() as connection:
+        if key_field is None:
+            await connection.copy_records_to_table(table, records=records, columns=columns)
+            return len(records)
+
+        async with connection.transaction():
+            staging_table = f"staging_{table}"
+            column_list = ", ".join(f'"{column}"' for column in columns)
+            await connection.execute(f'CREATE TEMPORARY TABLE "{staging_table}" (LIKE "{table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            await connection.copy_records_to_table(staging_table, records=records, columns=columns)
+            status = await connection.execute(f'INSERT INTO "{table}" ({column_list}) SELECT {column_list} FROM "{staging_table}" ON CONFLICT ("{key_field}") DO NOTHING')
+            return int(status.split()[-1])
+
+
+def print_rate(name, rows, begin_time):
+    elapsed = time.time() - begin_time
+    print(f"{name} populated: {rows} rows in {elapsed:.2f} seconds ({rows / max(elapsed, 1e-9):.0f} rows/s).")
 
-async def bulk_insert(model, data):
-    await model.bulk_create(data)
 
 async def populate_model(model, file_path, key_field=None):
-    df = pd.read_csv(file_path)
-    total_rows = len(df)
-    chunk_size = max(total_rows // 200, 1)
-    chunks = [df[i:i + chunk_size] for i in range(0, total_rows, chunk_size)]
-
-    async def process_chunk(chunk):
-        batch = []
-        for index, row in chunk.iterrows():
-            if key_field and await model.filter(**{key_field: row[key_field]}).exists():
+    """Loads a GTFS file into the table of a model, CHUNK_SIZE rows per COPY.
+
+    Args:
+        model: The model of the table.
+        file_path: The GTFS file.
+        key_field: The primary key of the table, if any: the rows repeating a key, in the file
+            or already in the table, are skipped.
+    """
+    begin_time = time.time()
+    rows = 0
+    for chunk in pd.read_csv(file_path, dtype=str, chunksize=CHUNK_SIZE):
+        if key_field:
+            chunk = chunk.drop_duplicates(subset=key_field)
+        columns, records = get_records(model, chunk)
+        rows += await copy_records(model, columns, records, key_field)
+    print_rate(model.__name__, rows, begin_time)
+
+
+async def add_seconds_columns():
+    """Adds the SECONDS_COLUMNS to a stop_times table created before they existed, computed from its times.
+
+    The time columns of a table created when they couldn't be null are made nullable. It runs
+    before generate_schemas, which then creates the indexes.
+    """
+    connection_client = Tortoise.get_connection("default")
+    async with connection_client.acquire_connection() as connection:
+        rows = await connection.fetch("SELECT column_name FROM information_schema.columns WHERE table_name = 'stop_times'")
+        columns = {row["column_name"] for row in rows}
+        for column, time_column in SECONDS_COLUMNS.items():
+            if not columns:
                 continue
+            if column in columns:
+                await connection.execute(f'ALTER TABLE stop_times ALTER COLUMN "{column}" DROP NOT NULL, ALTER COLUMN "{time_column}" DROP NOT NULL')
+                continue
+            begin_time = time.time()
+            async with connection.transaction():
+                await connection.execute(f'ALTER TABLE stop_times ALTER COLUMN "{time_column}" DROP NOT NULL, ADD COLUMN "{column}" INT')
+                status = await connection.execute(
+                    f"""UPDATE stop_times SET "{column}" = CASE WHEN trim({time_column}) <> '' THEN split_part({time_column}, ':', 1)::int * 3600 + split_part({time_column}, ':', 2)::int * 60 + split_part({time_column}, ':', 3)::int END"""
+                )
+            print_rate(f"StopTime.{column}", int(status.split()[-1]), begin_time)
+
+
+async def populate_junction_table(model, query):
+    """Fills a junction table with a single INSERT ... SELECT over the stop times."""
+    begin_time = time.time()
+    connection_client = Tortoise.get_connection("default")
+    async with connection_client.acquire_connection() as connection:
+        status = await connection.execute(query)
+    print_rate(model.__name__, int(status.split()[-1]), begin_time)
+
+
+# Junction tables, one row per route (or trip) and stop with the first stop sequence of the stop.
+# The rows already in the table are left as they are.
+ROUTE_STOP_QUERY = """
+    INSERT INTO route_stop (route_id, stop_id, stop_sequence)
+    SELECT DISTINCT ON (trip.route_id, stop_times.stop_id) trip.route_id, stop_times.stop_id, stop_times.stop_sequence
+    FROM stop_times JOIN trip ON trip.trip_id = stop_times.trip_id
+    WHERE NOT EXISTS (SELECT 1 FROM route_stop WHERE route_stop.route_id = trip.route_id AND route_stop.stop_id = stop_times.stop_id)
+    ORDER BY trip.route_id, stop_times.stop_id, stop_times.stop_sequence
+"""
+
+TRIP_STOP_QUERY = """
+    INSERT INTO trip_stop (trip_id, stop_id, stop_sequence)
+    SELECT DISTINCT ON (stop_times.trip_id, stop_times.stop_id) stop_times.trip_id, stop_times.stop_id, stop_times.stop_sequence
+    FROM stop_times
+    WHERE NOT EXISTS (SELECT 1 FROM trip_stop WHERE trip_stop.trip_id = stop_times.trip_id AND trip_stop.stop_id = stop_times.stop_id)
+    ORDER BY stop_times.trip_id, stop_times.stop_id, stop_times.stop_sequence
+"""
 
-            # Convert empty strings to None for all fields
-            for key, value in row.items():
-                if pd.isna(value):
-                    if key == 'zone_id':
-                        row[key] = 0 
-                    elif key == 'stop_timezone':
-                        row[key] = 'Europe/Paris'
-                    else:
-                        row[key] = None
-
-            batch.append(model(**row))
-
-            if len(batch) >= BATCH_SIZE:
-                await bulk_insert(model, batch)
-                batch.clear()
-
-        if batch:
-            await bulk_insert(model, batch)
-
-    tasks = [process_chunk(chunk) for chunk in chunks]
-    await asyncio.gather(*tasks)
-    print(f"{model.__name__} populated.")
 
 async def populate_route_stop():
     """Populates the RouteStop junction table."""
-    stop_times = await StopTime.all().prefetch_related("trip", "stop", "trip__route")
-    route_stop_data = []
-    for stop_time in stop_times:
-        route = stop_time.trip.route
-        stop = stop_time.stop
-
-        # Avoid duplicates using 'exists()'
-        if not await RouteStop.filter(route=route, stop=stop).exists():
-            route_stop_data.append(RouteStop(route=route, stop=stop))
+    await populate_junction_table(RouteStop, ROUTE_STOP_QUERY)
 
-        if len(route_stop_data) >= BATCH_SIZE:
-            await bulk_insert(RouteStop, route_stop_data)
-            route_stop_data.clear()
-
-    if route_stop_data:
-        await bulk_insert(RouteStop, route_stop_data)
-    print("RouteStop table populated.")
 
 async def populate_trip_stop():
     """Populates the TripStop junction table."""
-    stop_times = await StopTime.all().prefetch_related("trip", "stop")
-    trip_stop_data = []
-    for stop_time in stop_times:
-        trip = stop_time.trip
-        stop = stop_time.stop
-
-        # Avoid duplicates using 'exists()'
-        if not await TripStop.filter(trip=trip, stop=stop).exists():
-            trip_stop_data.append(TripStop(trip=trip, stop=stop, stop_sequence=stop_time.stop_sequence)) 
-
-        if len(trip_stop_data) >= BATCH_SIZE:
-            await bulk_insert(TripStop, trip_stop_data)
-            trip_stop_data.clear()
-
-    if trip_stop_data:
-        await bulk_insert(TripStop, trip_stop_data)
-    print("TripStop table populated.")
+    await populate_junction_table(TripStop, TRIP_STOP_QUERY)
 
 async def main():
-    start_time = time.time() 
+    start_time = time.time()
 
     await Tortoise.init(
         db_url=DATABASE_URL,
         modules={"models": ["app.db_config.models"]},
     )
+    await add_seconds_columns()
     await Tortoise.generate_schemas()
 
     await populate_model(Agency, "./data/clean2_gtfs/agency.txt", key_field='agency_id')
@@ -110,11 +204,15 @@ async def main():
 
     await Tortoise.close_connections()
 
-    end_time = time.time()  
-    total_time = end_time - start_time  
+    # Tell the running API workers to rebuild their in-memory network
+    version = bump_network_version()
+    print(f"Network version bumped to {version}.")
+
+    end_time = time.time()
+    total_time = end_time - start_time
     print(f"Total execution time: {total_time} seconds")
 
 if __name__ == "__main__":
     import asyncio
 
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
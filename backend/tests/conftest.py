@@ -0,0 +1,8 @@
+"""Puts the application and the benchmarks on the import path, the tests import their modules as they do."""
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, "app"))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
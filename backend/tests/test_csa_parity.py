@@ -0,0 +1,130 @@
+"""Parity of the Connection Scan Algorithm with the dijkstra search, on the synthetic feed of the benchmarks.
+
+csa must find the arrival date of dijkstra, and csa_revert the departure date of dijkstra_revert,
+the dijkstra searches growing their window from the hour of the query, across midnight.
+
+Run with: python -m pytest tests (from the backend directory)
+"""
+import asyncio
+import datetime
+import random
+import time
+from datetime import timedelta
+import pytest
+
+from synthetic_feed import FakeStop, SyntheticFeed
+from services.csa import csa, csa_revert
+from services.journey import dijkstra, dijkstra_revert
+from services.network import MetroSystem
+from services.timetable import TimetableStore, get_service_date
+from services.timetable_cache import TimetableCache
+
+SERVICE_DATE = datetime.datetime(2024, 6, 10)
+
+# Station served by no train
+ISOLATED_STATION = "SYN:isolated"
+
+
+class Searches:
+    """Runs the four searches on the synthetic feed, in an event loop of their own."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        feed = SyntheticFeed(rows=4, columns=12, vertical_lines=4)
+        feed.stations_fetch.append({
+            "parent_station": ISOLATED_STATION,
+            "stop_name": "Isolated",
+            "barycenter_lat": 48.7,
+            "barycenter_lon": 2.2,
+            "route_ids": [],
+            "stops": [FakeStop(ISOLATED_STATION + ":1", "Isolated", 48.7, 2.2, ISOLATED_STATION)],
+            "route_ids_with_sequences": [],
+        })
+        self.feed = feed
+        self.network = feed.build_network()
+        self.timetable_cache = TimetableCache(feed.fetch_stop_times_bucket)
+        self.timetable_store = TimetableStore(feed.fetch_service_day)
+
+    def get_timetable(self, date, forward):
+        return self.loop.run_until_complete(self.timetable_store.get(self.network, get_service_date(date, forward)))
+
+    def get_graph(self, begin, end):
+        return MetroSystem(self.network, self.loop.run_until_complete(self.timetable_cache.get_window(self.network, begin, end)))
+
+    def earliest_arrivals(self, start, end, date):
+        expected = self.loop.run_until_complete(dijkstra(self.get_graph(date, date + timedelta(hours=1)), start, end, date, time.time()))
+        return expected, csa(self.get_timetable(date, True), start, end, date, time.time())
+
+    def latest_departures(self, start, end, date):
+        expected = self.loop.run_until_complete(dijkstra_revert(self.get_graph(date - timedelta(hours=1), date), start, end, date, time.time()))
+        return expected, csa_revert(self.get_timetable(date, False), start, end, date, time.time())
+
+    def get_route_ids(self, station_id):
+        return next(set(station["route_ids"]) for station in self.feed.stations_fetch if station["parent_station"] == station_id)
+
+
+@pytest.fixture(scope="module")
+def searches():
+    searches = Searches()
+    yield searches
+    searches.loop.close()
+
+
+def get_random_queries(count):
+    random.seed(42)
+    stations = [f"SYN:{row}-{column}" for row in range(4) for column in range(12)]
+    return [
+        (*random.sample(stations, 2), SERVICE_DATE + timedelta(seconds=random.randint(7 * 3600, 21 * 3600)))
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("start, end, date", get_random_queries(20))
+def test_earliest_arrival(searches, start, end, date):
+    expected, result = searches.earliest_arrivals(start, end, date)
+    assert expected
+    assert result["arrival_date"] == expected["arrival_date"]
+
+
+@pytest.mark.parametrize("start, end, date", get_random_queries(20))
+def test_latest_departure(searches, start, end, date):
+    expected, result = searches.latest_departures(start, end, date)
+    assert expected
+    assert result["departure_date"] == expected["departure_date"]
+
+
+@pytest.mark.parametrize("start, end, date", [
+    (start, end, SERVICE_DATE + timedelta(hours=hours, minutes=minutes))
+    for start, end in (("SYN:0-1", "SYN:0-3"), ("SYN:0-1", "SYN:2-5"), ("SYN:3-10", "SYN:1-0"))
+    for hours, minutes in ((24, 5), (24, 40), (23, 50))
+])
+def test_around_midnight(searches, start, end, date):
+    # The trips of the previous day still running after midnight, and the first ones of the next day
+    expected, result = searches.earliest_arrivals(start, end, date)
+    assert expected
+    assert result["arrival_date"] == expected["arrival_date"]
+
+    expected, result = searches.latest_departures(start, end, date)
+    assert expected
+    assert result["departure_date"] == expected["departure_date"]
+
+
+def test_journey_with_transfers(searches):
+    # No line serves both stations, the journey changes trains at least once
+    start, end = "SYN:0-1", "SYN:2-5"
+    assert not searches.get_route_ids(start) & searches.get_route_ids(end)
+    date = SERVICE_DATE + timedelta(hours=8, minutes=3)
+
+    expected, result = searches.earliest_arrivals(start, end, date)
+    assert result["arrival_date"] == expected["arrival_date"]
+    assert [stop["station"] for stop in result["stops"]][::len(result["stops"]) - 1] == [start, end]
+
+    expected, result = searches.latest_departures(start, end, date + timedelta(hours=1))
+    assert result["departure_date"] == expected["departure_date"]
+
+
+def test_no_path(searches):
+    date = SERVICE_DATE + timedelta(hours=12)
+    for start, end in (("SYN:0-0", ISOLATED_STATION), (ISOLATED_STATION, "SYN:0-0")):
+        assert searches.earliest_arrivals(start, end, date) == ({}, {})
+        assert searches.latest_departures(start, end, date) == ({}, {})
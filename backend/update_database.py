@@ -0,0 +1,215 @@
+"""Applies a new GTFS feed to the database as a diff, instead of reloading every table.
+
+Run it on the cleaned feed, from the backend directory like populate_database.py:
+    python update_database.py ./data/clean2_gtfs
+
+Each file is streamed into a staging table, and its rows are matched with the rows of the table on
+their key and compared by the database: neither the file nor the table is held in memory, and
+only the new, changed and removed rows are written, in a single transaction, so the API keeps
+routing on the previous data until the commit. The junction tables are rebuilt for the trips that
+changed, then the network version is bumped and the workers rebuild their graph and timetable
+caches on their next request.
+"""
+import argparse
+import asyncio
+import os
+import time
+import pandas as pd
+from tortoise import Tortoise
+from app.db_config.models import *
+from app.db_config.config import DATABASE_URL
+from app.utils.network_version import bump_network_version, get_network_version
+from populate_database import CHUNK_SIZE, ROUTE_STOP_QUERY, TRIP_STOP_QUERY, add_seconds_columns, get_records
+
+# Tables updated from the feed, in the order their rows can be inserted, with the columns
+# identifying a row
+FEED_TABLES = (
+    (Calendar, "calendar.txt", ("service_id",)),
+    (CalendarDate, "calendar_dates.txt", ("service_id", "date")),
+    (Trip, "trips.txt", ("trip_id",)),
+    (StopTime, "stop_times.txt", ("trip_id", "stop_sequence")),
+    (Transfer, "transfers.txt", ("from_stop_id", "to_stop_id")),
+    (Pathway, "pathways.txt", ("pathway_id",)),
+)
+
+
+class TableDiff:
+    """The differences between a table and a feed file loaded in a staging table.
+
+    Attributes:
+        columns: The database columns found in the file.
+        key_columns: The columns identifying a row.
+        staging_table: The temporary table holding the rows of the file, dropped at commit.
+        inserts / updates / deletes: The number of rows missing from the table, different in it,
+            or missing from the file.
+        compared: The number of rows of the file.
+    """
+
+    def __init__(self, model, columns, key_columns, staging_table):
+        self.model = model
+        self.table = model._meta.db_table
+        self.columns = columns
+        self.key_columns = key_columns
+        self.value_columns = [column for column in columns if column not in key_columns]
+        self.staging_table = staging_table
+        self.inserts = 0
+        self.updates = 0
+        self.deletes = 0
+        self.compared = 0
+
+    def __bool__(self):
+        return bool(self.inserts or self.updates or self.deletes)
+
+    def get_columns(self, table: str, columns: list) -> str:
+        return ", ".join(f'"{table}"."{column}"' for column in columns)
+
+    def get_key_condition(self) -> str:
+        return " AND ".join(f'"{self.table}"."{column}" = "{self.staging_table}"."{column}"' for column in self.key_columns)
+
+    def get_value_condition(self) -> str:
+        return f"ROW({self.get_columns(self.table, self.value_columns)}) IS DISTINCT FROM ROW({self.get_columns(self.staging_table, self.value_columns)})"
+
+    def get_inserted(self, columns: list) -> str:
+        """Returns a query selecting columns of the rows of the file missing from the table."""
+        return f'SELECT {self.get_columns(self.staging_table, columns)} FROM "{self.staging_table}" WHERE NOT EXISTS (SELECT 1 FROM "{self.table}" WHERE {self.get_key_condition()})'
+
+    def get_updated(self, columns: list) -> str:
+        """Returns a query selecting columns of the rows of the file different in the table."""
+        if not self.value_columns:
+            return f'SELECT {self.get_columns(self.staging_table, columns)} FROM "{self.staging_table}" WHERE false'
+        return f'SELECT {self.get_columns(self.staging_table, columns)} FROM "{self.staging_table}" JOIN "{self.table}" ON {self.get_key_condition()} WHERE {self.get_value_condition()}'
+
+    def get_deleted(self, columns: list) -> str:
+        """Returns a query selecting columns of the rows of the table missing from the file."""
+        return f'SELECT {self.get_columns(self.table, columns)} FROM "{self.table}" WHERE NOT EXISTS (SELECT 1 FROM "{self.staging_table}" WHERE {self.get_key_condition()})'
+
+    async def count(self, connection):
+        self.inserts = await connection.fetchval(f"SELECT count(*) FROM ({self.get_inserted(self.key_columns)}) AS rows")
+        self.updates = await connection.fetchval(f"SELECT count(*) FROM ({self.get_updated(self.key_columns)}) AS rows")
+        self.deletes = await connection.fetchval(f"SELECT count(*) FROM ({self.get_deleted(self.key_columns)}) AS rows")
+
+    async def get_changed_keys(self, connection, column: str) -> set:
+        """Returns the values of a key column in the inserted, updated and deleted rows."""
+        rows = await connection.fetch(f"{self.get_inserted([column])} UNION {self.get_updated([column])} UNION {self.get_deleted([column])}")
+        return {row[0] for row in rows}
+
+
+async def copy_to_staging(connection, table: str, name: str, columns: list, records: list):
+    """Copies records to a temporary table with the given columns of a table, dropped at commit."""
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    await connection.execute(f'CREATE TEMPORARY TABLE "{name}" ON COMMIT DROP AS SELECT {column_list} FROM "{table}" WITH NO DATA')
+    await connection.copy_records_to_table(name, records=records, columns=columns)
+
+
+async def get_table_diff(connection, model, file_path: str, key_columns: tuple) -> TableDiff:
+    """Streams a feed file into a staging table, CHUNK_SIZE rows per COPY, and counts its differences with the table.
+
+    The rows repeating a key in the file are dropped, the first one is kept.
+    """
+    columns, _ = get_records(model, pd.read_csv(file_path, dtype=str, nrows=0))
+    diff = TableDiff(model, columns, list(key_columns), f"feed_{model._meta.db_table}")
+    await copy_to_staging(connection, diff.table, diff.staging_table, columns, [])
+    await connection.execute(f'ALTER TABLE "{diff.staging_table}" ADD COLUMN feed_row BIGSERIAL')
+    for chunk in pd.read_csv(file_path, dtype=str, chunksize=CHUNK_SIZE):
+        _, records = get_records(model, chunk)
+        await connection.copy_records_to_table(diff.staging_table, records=records, columns=columns)
+        diff.compared += len(records)
+
+    key_list = ", ".join(f'"{column}"' for column in key_columns)
+    await connection.execute(f'CREATE INDEX ON "{diff.staging_table}" ({key_list})')
+    await connection.execute(f'ANALYZE "{diff.staging_table}"')
+    duplicate_condition = " AND ".join(f'"{diff.staging_table}"."{column}" = first_rows."{column}"' for column in key_columns)
+    status = await connection.execute(f'DELETE FROM "{diff.staging_table}" USING "{diff.staging_table}" AS first_rows WHERE {duplicate_condition} AND first_rows.feed_row < "{diff.staging_table}".feed_row')
+    diff.compared -= int(status.split()[-1])
+
+    await diff.count(connection)
+    return diff
+
+
+async def apply_upserts(connection, diff: TableDiff):
+    column_list = ", ".join(f'"{column}"' for column in diff.columns)
+    if diff.inserts:
+        await connection.execute(f'INSERT INTO "{diff.table}" ({column_list}) {diff.get_inserted(diff.columns)}')
+
+    if diff.updates:
+        assignments = ", ".join(f'"{column}" = "{diff.staging_table}"."{column}"' for column in diff.value_columns)
+        await connection.execute(f'UPDATE "{diff.table}" SET {assignments} FROM "{diff.staging_table}" WHERE {diff.get_key_condition()} AND {diff.get_value_condition()}')
+
+
+async def apply_deletes(connection, diff: TableDiff):
+    if diff.deletes:
+        await connection.execute(f'DELETE FROM "{diff.table}" WHERE NOT EXISTS (SELECT 1 FROM "{diff.staging_table}" WHERE {diff.get_key_condition()})')
+
+
+async def get_trip_routes(connection, trip_ids: list) -> set:
+    rows = await connection.fetch("SELECT DISTINCT route_id FROM trip WHERE trip_id = ANY($1::varchar[])", trip_ids)
+    return {row["route_id"] for row in rows}
+
+
+async def main(args):
+    start_time = time.time()
+
+    await Tortoise.init(
+        db_url=DATABASE_URL,
+        modules={"models": ["app.db_config.models"]},
+    )
+    await add_seconds_columns()
+    await Tortoise.generate_schemas()
+
+    diffs = []
+    connection_client = Tortoise.get_connection("default")
+    async with connection_client.acquire_connection() as connection:
+        async with connection.transaction():
+            for model, file_name, key_columns in FEED_TABLES:
+                file_path = os.path.join(args.feed, file_name)
+                if not os.path.exists(file_path):
+                    print(f"{model.__name__}: {file_path} not found, table left as it is.")
+                    continue
+                begin_time = time.time()
+                diff = await get_table_diff(connection, model, file_path, key_columns)
+                diffs.append(diff)
+                print(f"{model.__name__}: {diff.inserts} inserted, {diff.updates} updated, {diff.deletes} deleted ({diff.compared} rows compared in {time.time() - begin_time:.2f} seconds).")
+
+            if args.dry_run or not any(diffs):
+                # Nothing written, the transaction only served to read a consistent state
+                diffs = []
+            else:
+                begin_time = time.time()
+                changed_trips = set()
+                for diff in diffs:
+                    if diff.model in (Trip, StopTime):
+                        changed_trips |= await diff.get_changed_keys(connection, "trip_id")
+                changed_trips = list(changed_trips)
+                changed_routes = await get_trip_routes(connection, changed_trips)
+
+                for diff in diffs:
+                    await apply_upserts(connection, diff)
+                for diff in reversed(diffs):
+                    await apply_deletes(connection, diff)
+
+                # The junction tables of the routes a changed trip belonged to, before or after
+                changed_routes |= await get_trip_routes(connection, changed_trips)
+                await connection.execute("DELETE FROM trip_stop WHERE trip_id = ANY($1::varchar[])", changed_trips)
+                await connection.execute("DELETE FROM route_stop WHERE route_id = ANY($1::varchar[])", list(changed_routes))
+                await connection.execute(TRIP_STOP_QUERY)
+                await connection.execute(ROUTE_STOP_QUERY)
+                print(f"Changes applied in {time.time() - begin_time:.2f} seconds ({len(changed_trips)} trips, {len(changed_routes)} routes refreshed).")
+
+    await Tortoise.close_connections()
+
+    if diffs:
+        # Tell the running API workers to rebuild their in-memory network
+        version = bump_network_version()
+        print(f"Network version bumped to {version}.")
+    else:
+        print(f"No changes applied, network version left at {get_network_version()}.")
+
+    end_time = time.time()
+    total_time = end_time - start_time
+    print(f"Total execution time: {total_time} seconds")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Applies a cleaned GTFS feed to the database as a diff.")
+    parser.add_argument("feed", nargs="?", default="./data/clean2_gtfs", help="Directory of the cleaned GTFS feed")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the differences")
+    asyncio.run(main(parser.parse_args()))